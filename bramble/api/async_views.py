@@ -0,0 +1,120 @@
+"""
+Async-native versions of the read-heavy endpoints, for running under ASGI.
+
+DRF views are synchronous, so under ASGI each request to them holds a worker
+thread for its whole duration. These views await the async ORM instead and
+only leave the event loop for the actual database calls. They take the same
+query parameters and return the same bodies as their DRF counterparts, but
+only accept token authentication.
+
+feed_push_view has no DRF counterpart: it streams new feed posts as
+Server-Sent Events (see api.pubsub), which only ASGI serves without a
+thread per connection.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from . import feed, pubsub
+from .authentication import aauthenticate_token
+from .pagination import FeedCursorPagination, SearchPagination, decode_cursor
+from .metrics import serializing
+from .profiles import aget_profile
+from .routers import replica_reads
+from .search import search_app_users
+from .renderers import dumps
+from .serializers import app_user_row_data
+
+
+def json_response(data, status=200):
+    # The DRF views' renderer, so bodies are byte for byte the same
+    with serializing():
+        return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def unauthorized():
+    response = json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def feed_view(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    token = await aauthenticate_token(request)
+    if token is None:
+        return unauthorized()
+
+    paginator = FeedCursorPagination()
+    try:
+        with replica_reads(token.user):
+            page = await paginator.apaginate_sources(feed.feed_sources(token.user.appuser), Request(request))
+    except NotFound as exc:
+        return json_response({'detail': str(exc.detail)}, status=404)
+    return json_response(paginator.get_paginated_data(page))
+
+
+async def profile_view(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    token = await aauthenticate_token(request)
+    if token is None:
+        return unauthorized()
+    with replica_reads(token.user):
+        return json_response(await aget_profile(token.user.appuser.id))
+
+
+async def user_search_view(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    token = await aauthenticate_token(request)
+    if token is None:
+        return unauthorized()
+
+    query = request.GET.get('q', '')
+    if not query:
+        return json_response({'message': 'Search query is required.'}, status=400)
+
+    paginator = SearchPagination()
+    # The FTS5 lookup is raw SQL, which has no async API; run the search in
+    # one thread hop and serialize its rows on the loop
+    with replica_reads(token.user):
+        users = await sync_to_async(paginator.paginate_search)(
+            lambda limit, offset: search_app_users(query, limit, offset), Request(request),
+        )
+    with serializing():
+        data = [app_user_row_data(row) for row in users]
+    return json_response(paginator.get_paginated_data(data))
+
+
+async def feed_push_view(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    token = await aauthenticate_token(request)
+    if token is None:
+        return unauthorized()
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the never-ending body would hold a worker thread, and be buffered whole
+        return json_response({'detail': 'Push needs the ASGI server (bramble/asgi.py).'}, status=501)
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        cursor = decode_cursor(since) if since else None
+    except ValueError:
+        return json_response({'detail': 'Invalid cursor.'}, status=404)
+
+    app_user = token.user.appuser
+    backlog = None
+    if cursor is not None:
+        backlog = partial(pubsub.missed_events, feed.new_posts_source(app_user), cursor, token.user)
+    response = StreamingHttpResponse(
+        pubsub.event_stream(pubsub.feed_channel(app_user.id), backlog), content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
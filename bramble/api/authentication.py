@@ -0,0 +1,78 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+def token_cache():
+    return caches[getattr(settings, 'TOKEN_CACHE_ALIAS', 'default')]
+
+
+def token_cache_key(key):
+    # Never use the credential itself as a cache key
+    return 'token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def token_model():
+    return TokenAuthentication().get_model()
+
+
+def forget_tokens(*keys):
+    token_cache().delete_many([token_cache_key(key) for key in keys])
+
+
+class AppUserTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that resolves token, User and AppUser in one joined
+    query, so views read ``request.user.appuser`` without another round trip.
+
+    With TOKEN_CACHE_TTL > 0 the resolved token is also cached for that many
+    seconds and most requests skip the database entirely. Deleting a token or
+    saving its user drops the cached entry (see api.signals), which reaches
+    every worker only if TOKEN_CACHE_ALIAS is shared between them. Only ids
+    should be read from the cached AppUser; its counters may be up to TTL
+    seconds old.
+    """
+    def authenticate_credentials(self, key):
+        ttl = getattr(settings, 'TOKEN_CACHE_TTL', 0)
+        token = token_cache().get(token_cache_key(key)) if ttl else None
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user__appuser').get(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            if ttl:
+                token_cache().set(token_cache_key(key), token, ttl)
+
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+async def aauthenticate_token(request):
+    """
+    AppUserTokenAuthentication for plain async views: the Token (with its User
+    and AppUser) named by the Authorization header, or None.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != TokenAuthentication.keyword.lower():
+        return None
+    key = auth[1]
+
+    ttl = getattr(settings, 'TOKEN_CACHE_TTL', 0)
+    token = await token_cache().aget(token_cache_key(key)) if ttl else None
+    if token is None:
+        token = await token_model().objects.select_related('user__appuser').filter(key=key).afirst()
+        if token is None:
+            return None
+        if ttl:
+            await token_cache().aset(token_cache_key(key), token, ttl)
+
+    if not token.user.is_active:
+        return None
+    return token
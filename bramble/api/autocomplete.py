@@ -0,0 +1,240 @@
+"""
+In-process username prefix index for type-ahead.
+
+Usernames are kept case-folded in one sorted list, so the matches for a
+prefix are a contiguous slice found with two bisects. The slice is then cut
+down to the ``limit`` most-followed users. Short prefixes match huge slices,
+so their top results are memoized until a change touches them.
+
+The index is built when the WSGI/ASGI application starts (or on first use)
+and kept current from api.signals: signups insert, deletions remove, renames
+move, follows and unfollows adjust popularity. Each process holds its own
+copy, and signals only reach the copy of the process that wrote, so every
+AUTOCOMPLETE_REFRESH_INTERVAL seconds a background thread compares the
+highest AppUser id and the 'usernames' VersionCounter, which renames and
+deletions bump, with the ones the index was loaded at, and reloads it if
+they moved. That also picks up rows inserted with bulk_create, which sends
+no signals. Follows don't move the version, so other processes' follower
+counts, which only rank results, catch up at their next reload.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F, Max
+
+from .models import AppUser, VersionCounter
+
+logger = logging.getLogger(__name__)
+
+# Prefixes up to this length get their top results memoized
+MEMO_PREFIX_LENGTH = 3
+
+
+class UsernameIndex:
+    def __init__(self, users=(), version=None):
+        """
+        users is an iterable of (app_user_id, username, followers_count);
+        version is what users_version() returned before reading them.
+        """
+        self._lock = threading.Lock()
+        self.version = version
+        self._load(users)
+
+    def _load(self, users):
+        users = list(users)
+        rows = sorted((username.casefold(), username, app_user_id) for app_user_id, username, _ in users)
+        self._keys = [key for key, _, _ in rows]
+        self._entries = [(username, app_user_id) for _, username, app_user_id in rows]
+        self._followers = {app_user_id: followers for app_user_id, _, followers in users}
+        self._usernames = {app_user_id: username for _, username, app_user_id in rows}
+        self._memo = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, app_user_id, username, followers_count=0):
+        with self._lock:
+            if app_user_id not in self._usernames:
+                self._insert(app_user_id, username, followers_count)
+
+    def remove(self, app_user_id):
+        with self._lock:
+            self._remove(app_user_id)
+
+    def rename(self, app_user_id, username):
+        with self._lock:
+            current = self._usernames.get(app_user_id)
+            if current is None or current == username:
+                return
+            followers_count = self._followers[app_user_id]
+            self._remove(app_user_id)
+            self._insert(app_user_id, username, followers_count)
+
+    def _insert(self, app_user_id, username, followers_count):
+        key = username.casefold()
+        position = bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self._entries.insert(position, (username, app_user_id))
+        self._followers[app_user_id] = followers_count
+        self._usernames[app_user_id] = username
+        self._forget(key)
+
+    def _remove(self, app_user_id):
+        username = self._usernames.pop(app_user_id, None)
+        if username is None:
+            return
+        del self._followers[app_user_id]
+        key = username.casefold()
+        # Usernames can share a case-folded key; this user's entry is among them
+        position = bisect_left(self._keys, key)
+        while self._entries[position][1] != app_user_id:
+            position += 1
+        del self._keys[position]
+        del self._entries[position]
+        self._forget(key)
+
+    def adjust_followers(self, app_user_id, delta):
+        with self._lock:
+            if app_user_id not in self._followers:
+                return
+            self._followers[app_user_id] = max(0, self._followers[app_user_id] + delta)
+            self._forget(self._usernames[app_user_id].casefold())
+
+    def _forget(self, key):
+        for length in range(MEMO_PREFIX_LENGTH + 1):
+            self._memo.pop(key[:length], None)
+
+    def complete(self, prefix, limit=10):
+        """The limit most-followed users whose username starts with prefix (case-insensitive)."""
+        key = prefix.casefold()
+        memoize = len(key) <= MEMO_PREFIX_LENGTH
+        with self._lock:
+            if memoize and key in self._memo:
+                return self._memo[key][:limit]
+            # Every string starting with key sorts before key + U+10FFFF
+            start = bisect_left(self._keys, key)
+            end = bisect_right(self._keys, key + '\U0010ffff', lo=start)
+            followers = self._followers
+            # A memo entry holds the most anyone may ask for, so any limit can reuse it
+            count = max(limit, max_results()) if memoize else limit
+            top = heapq.nsmallest(
+                count, self._entries[start:end],
+                key=lambda entry: (-followers[entry[1]], entry[0]),
+            )
+            results = [
+                {'id': app_user_id, 'username': username, 'followers_count': followers[app_user_id]}
+                for username, app_user_id in top
+            ]
+            if memoize:
+                self._memo[key] = results
+            return results[:limit]
+
+
+def default_results():
+    return getattr(settings, 'AUTOCOMPLETE_RESULTS', 10)
+
+
+def max_results():
+    return getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', 20)
+
+
+_index = None
+_index_lock = threading.Lock()
+_refresher = None
+
+
+USERNAMES_VERSION = 'usernames'
+
+
+def users_version():
+    """Changes whenever a user is added, deleted or renamed, in any process; two primary key lookups."""
+    latest = AppUser.objects.aggregate(latest=Max('id'))['latest']
+    renames = VersionCounter.objects.filter(name=USERNAMES_VERSION).values_list('value', flat=True).first()
+    return latest, renames
+
+
+def bump_users_version():
+    """Note a rename or deletion in users_version(), in the caller's transaction."""
+    if not VersionCounter.objects.filter(name=USERNAMES_VERSION).update(value=F('value') + 1):
+        VersionCounter.objects.get_or_create(name=USERNAMES_VERSION, defaults={'value': 1})
+
+
+def load_index():
+    version = users_version()
+    rows = AppUser.objects.values_list('id', 'user__username', 'followers_count')
+    return UsernameIndex(rows.iterator(chunk_size=10000), version)
+
+
+def get_index():
+    """The process-wide index, loaded from the database on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+                _start_refresher()
+    return _index
+
+
+def loaded_index():
+    """The index if it has been loaded, else None (nothing to keep current yet)."""
+    return _index
+
+
+def reset_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def refresh_index():
+    """Reload the index if the users changed since it was loaded. Returns whether it did."""
+    global _index
+    index = _index
+    if index is None or users_version() == index.version:
+        return False
+    # Built before taking the lock, so completions keep being served meanwhile
+    fresh = load_index()
+    with _index_lock:
+        if _index is not index:
+            # Reset or refreshed meanwhile
+            return False
+        _index = fresh
+    return True
+
+
+def _start_refresher():
+    global _refresher
+    if not getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 60):
+        return
+    # A forked worker inherits the global but not the thread
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = threading.Thread(target=_refresh_periodically, name='bramble-autocomplete', daemon=True)
+        _refresher.start()
+
+
+def _refresh_periodically():
+    while interval := getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 60):
+        time.sleep(interval)
+        try:
+            refresh_index()
+        except DatabaseError:
+            logger.warning('Could not refresh the username index', exc_info=True)
+        finally:
+            close_old_connections()
+
+
+def preload():
+    """Build the index at startup if AUTOCOMPLETE_PRELOAD is on."""
+    if not getattr(settings, 'AUTOCOMPLETE_PRELOAD', True):
+        return
+    try:
+        get_index()
+    except DatabaseError:
+        # Not migrated yet (e.g. a fresh checkout); the first request loads it
+        logger.warning('Could not preload the username index', exc_info=True)
@@ -0,0 +1,17 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite, with transactions started by BEGIN IMMEDIATE (what Django 5.1
+    offers as OPTIONS transaction_mode).
+
+    A deferred BEGIN takes the write lock only at the first write. If another
+    connection is writing by then, SQLite fails with "database is locked" at
+    once instead of waiting out the busy timeout, because waiting could
+    deadlock. Taking the lock up front makes concurrent write transactions
+    queue instead. Readers outside transactions are unaffected, and in WAL
+    mode they are never blocked.
+    """
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
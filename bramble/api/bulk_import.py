@@ -0,0 +1,273 @@
+"""
+Bulk loading of users, follows and posts, for seeding large databases.
+
+Rows are plain dicts, streamed from JSONL or CSV files (read_rows) or
+generated by api.synthetic.graph_rows, and referenced by username:
+
+- users: username, plus optional email, first_name, last_name, bio and either
+  password (plain text, hashed here) or password_hash (stored as is). Users
+  with neither get an unusable password. Usernames that already exist are
+  skipped.
+- follows: follower, followee. Duplicates, self-follows and unknown users
+  are skipped.
+- posts: username, text, plus optional timestamp (ISO 8601; default now) and
+  likes.
+
+Rows go in with bulk_create, batch_size at a time, and commit every
+transaction_size rows, so a failure loses at most one chunk. Plain-text
+passwords are hashed in a process pool, one batch ahead of the inserts.
+
+Bulk inserts skip api.signals: finish() rebuilds counters and, in
+FEED_FANOUT mode, timelines; the search index is updated as users go in.
+"""
+import csv
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import counters, feed, search
+from .hashers import hash_passwords
+from .models import AppUser, Follows, Post
+
+FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+
+
+def read_rows(f, format):
+    """Yield the rows of an open JSONL or CSV file as dicts; blank CSV cells are dropped."""
+    if format == 'jsonl':
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    elif format == 'csv':
+        for row in csv.DictReader(f):
+            yield {key: value for key, value in row.items() if value not in ('', None)}
+    else:
+        raise ValueError(f'Unknown format {format!r}; expected jsonl or csv.')
+
+
+def format_for(path):
+    """The format read_rows() should use for path, from its extension."""
+    for suffix, format in FORMATS.items():
+        if path.lower().endswith(suffix):
+            return format
+    raise ValueError(f'Cannot tell the format of {path!r} from its extension.')
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+class Phase:
+    """Rows read, inserted and skipped by one import phase, and how long it took."""
+    def __init__(self, name):
+        self.name = name
+        self.read = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.seconds if self.seconds else 0.0
+
+
+@contextmanager
+def keeping_post_timestamps():
+    # Post.timestamp is auto_now_add, which bulk_create would stamp over imported values
+    field = Post._meta.get_field('timestamp')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Importer:
+    def __init__(self, batch_size=5000, transaction_size=50000, workers=None, iterations=None, progress=None):
+        self.batch_size = batch_size
+        # Whole batches per transaction
+        self.transaction_batches = max(1, transaction_size // batch_size)
+        self.workers = workers
+        self.iterations = iterations
+        self.progress = progress
+        self.pool = None
+        # username -> AppUser id, for every user imported or looked up so far
+        self.ids = {}
+        self.phases = []
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self, name, rows, insert_batch):
+        phase = Phase(name)
+        self.phases.append(phase)
+        started = time.perf_counter()
+        chunks = batches(batches(rows, self.batch_size), self.transaction_batches)
+        for chunk in chunks:
+            with transaction.atomic():
+                for batch in chunk:
+                    phase.read += len(batch)
+                    insert_batch(batch, phase)
+            phase.seconds = time.perf_counter() - started
+            if self.progress:
+                self.progress(phase)
+        phase.seconds = time.perf_counter() - started
+        return phase
+
+    # Users
+
+    def import_users(self, rows):
+        # Hash each batch's passwords in the pool while the previous batch is inserted
+        pending = None
+
+        def insert_batch(batch, phase):
+            nonlocal pending
+            hashed = self._hash_async(batch)
+            if pending is not None:
+                self._insert_users(*pending, phase)
+            pending = (batch, hashed)
+
+        phase = self._run('users', rows, insert_batch)
+        if pending is not None:
+            started = time.perf_counter()
+            with transaction.atomic():
+                self._insert_users(*pending, phase)
+            phase.seconds += time.perf_counter() - started
+        return phase
+
+    def _hash_async(self, batch):
+        plain = [(i, row['password']) for i, row in enumerate(batch) if row.get('password') and not row.get('password_hash')]
+        if not plain:
+            return []
+        if not self.workers:
+            return [(plain, hash_passwords([password for _, password in plain], self.iterations))]
+        if self.pool is None:
+            # django.setup() makes spawned (non-forked) workers usable too
+            self.pool = ProcessPoolExecutor(self.workers, initializer=django.setup)
+        size = -(-len(plain) // self.workers)
+        return [
+            (part, self.pool.submit(hash_passwords, [password for _, password in part], self.iterations))
+            for part in (plain[start:start + size] for start in range(0, len(plain), size))
+        ]
+
+    def _insert_users(self, batch, hashed, phase):
+        passwords = {}
+        for part, result in hashed:
+            hashes = result if isinstance(result, list) else result.result()
+            passwords.update((i, password_hash) for (i, _), password_hash in zip(part, hashes))
+
+        usernames = [row['username'] for row in batch]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        users, bios = [], []
+        for i, row in enumerate(batch):
+            username = row['username']
+            if username in existing:
+                phase.skipped += 1
+                continue
+            existing.add(username)
+            users.append(User(
+                username=username,
+                email=row.get('email', ''),
+                first_name=row.get('first_name', ''),
+                last_name=row.get('last_name', ''),
+                password=row.get('password_hash') or passwords.get(i) or make_password(None),
+            ))
+            bios.append(row.get('bio', ''))
+
+        users = User.objects.bulk_create(users)
+        app_users = AppUser.objects.bulk_create([AppUser(user=user, bio=bio) for user, bio in zip(users, bios)])
+        for user, app_user in zip(users, app_users):
+            self.ids[user.username] = app_user.pk
+        search.index_app_users([app_user.pk for app_user in app_users])
+        phase.inserted += len(app_users)
+
+    def _resolve(self, usernames):
+        missing = {username for username in usernames if username not in self.ids}
+        if missing:
+            self.ids.update(
+                AppUser.objects.filter(user__username__in=missing).values_list('user__username', 'id')
+            )
+
+    # Follows
+
+    def import_follows(self, rows):
+        def insert_batch(batch, phase):
+            self._resolve(itertools.chain.from_iterable((row['follower'], row['followee']) for row in batch))
+            follows = {}
+            for row in batch:
+                follower_id, followee_id = self.ids.get(row['follower']), self.ids.get(row['followee'])
+                if follower_id is not None and followee_id is not None and follower_id != followee_id:
+                    follows[(follower_id, followee_id)] = Follows(follower_id=follower_id, followee_id=followee_id)
+            # Follows already in the table are ignored by the database, but counted as inserted
+            Follows.objects.bulk_create(follows.values(), ignore_conflicts=True)
+            phase.inserted += len(follows)
+            phase.skipped += len(batch) - len(follows)
+
+        return self._run('follows', rows, insert_batch)
+
+    # Posts
+
+    def import_posts(self, rows):
+        def insert_batch(batch, phase):
+            self._resolve(row['username'] for row in batch)
+            now = timezone.now()
+            posts = []
+            for row in batch:
+                app_user_id = self.ids.get(row['username'])
+                if app_user_id is None:
+                    phase.skipped += 1
+                    continue
+                posts.append(Post(
+                    user_id_id=app_user_id,
+                    text=row['text'],
+                    timestamp=_timestamp(row.get('timestamp')) or now,
+                    likes=int(row.get('likes', 0)),
+                ))
+            Post.objects.bulk_create(posts)
+            phase.inserted += len(posts)
+
+        with keeping_post_timestamps():
+            return self._run('posts', rows, insert_batch)
+
+    def finish(self, stdout=None):
+        """Bring the denormalized data bulk_create skipped back in step with the imported rows."""
+        phase = Phase('rebuild')
+        self.phases.append(phase)
+        started = time.perf_counter()
+        with transaction.atomic():
+            phase.read = phase.inserted = counters.rebuild_counters()
+        if feed.fanout_enabled():
+            call_command('rebuild_timelines', stdout=stdout)
+        phase.seconds = time.perf_counter() - started
+        return phase
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Invalid timestamp {value!r}.')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
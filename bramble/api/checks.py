@@ -0,0 +1,28 @@
+"""
+System checks for settings that only go wrong across processes.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose entries live in one process only
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, Tags.database)
+def check_sticky_cache(app_configs, **kwargs):
+    """Read-your-writes (api.routers) needs the sticky cache shared by every worker."""
+    if not getattr(settings, 'DATABASE_REPLICAS', []):
+        return []
+    alias = getattr(settings, 'REPLICA_STICKY_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f"REPLICA_STICKY_CACHE_ALIAS {alias!r} uses {backend}, which isn't shared between processes, "
+        "so a user's next request can read from a replica that hasn't caught up with their write.",
+        hint='Set BRAMBLE_REDIS_URL, or point REPLICA_STICKY_CACHE_ALIAS at a shared cache.',
+        id='api.E001',
+    )]
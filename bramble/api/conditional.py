@@ -0,0 +1,106 @@
+"""
+HTTP conditional requests for the endpoints clients poll.
+
+``AppUser.updated_at`` is bumped by every write that changes what the user's
+profile or posts look like to others: counter adjustments (follows, posts,
+deletions), saves of the AppUser or its auth User, and timeline writes by
+the fan-out tasks. So
+
+- a profile's validators are its owner's ``updated_at``, read through the
+  profile cache (api.profiles invalidates both on the same writes), and
+- a feed's validators are the latest ``updated_at`` among the reader and
+  everyone they follow, which one indexed query over their follows finds.
+
+``@conditional(validators)`` hands them to Django's ``condition()``, which
+answers a matching If-None-Match / If-Modified-Since with a 304 before the
+view runs, and marks the responses ``private, no-cache`` so clients store
+them but revalidate each time.
+
+Likes don't bump ``updated_at``: that would put a write to the author's row
+on the like path, which LIKES_BUFFERED exists to keep cheap. Instead the feed
+validators also change every FEED_ETAG_MAX_AGE seconds, which bounds how old
+the like counts in a revalidated feed can be.
+"""
+import datetime
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import AppUser, Follows
+from .profiles import get_updated_at
+from .routers import replica_reads
+
+
+def touch(*app_user_ids):
+    """Mark app_user_ids as changed, for writes that adjust no counter."""
+    AppUser.objects.filter(pk__in=app_user_ids).update(updated_at=timezone.now())
+
+
+def _version(moment):
+    return int(moment.timestamp()) * 1_000_000 + moment.microsecond
+
+
+def profile_validators(request):
+    """(ETag, Last-Modified) of the requesting user's profile."""
+    try:
+        app_user_id = request.user.appuser.id
+    except (AttributeError, AppUser.DoesNotExist):
+        return None, None
+    with replica_reads(request.user):
+        updated_at = get_updated_at(app_user_id)
+    if updated_at is None:
+        return None, None
+    return f'profile-{request.user.pk}-{_version(updated_at)}', updated_at
+
+
+def feed_validators(request):
+    """(ETag, Last-Modified) of the requesting user's feed."""
+    followees_updated_at = (
+        Follows.objects.filter(follower=OuterRef('pk')).values('follower')
+        .annotate(latest=Max('followee__updated_at')).values('latest')
+    )
+    with replica_reads(request.user):
+        row = (
+            AppUser.objects.filter(user_id=request.user.pk)
+            .annotate(followees_updated_at=Subquery(followees_updated_at))
+            .values_list('updated_at', 'followees_updated_at').first()
+        )
+    if row is None:
+        return None, None
+    updated_at = max(moment for moment in row if moment is not None)
+    max_age = getattr(settings, 'FEED_ETAG_MAX_AGE', 60)
+    now = time.time()
+    window = datetime.datetime.fromtimestamp(now - now % max_age, tz=datetime.timezone.utc)
+    return f'feed-{request.user.pk}-{_version(updated_at)}-{int(window.timestamp())}', max(updated_at, window)
+
+
+def conditional(validators):
+    """
+    Answer conditional GETs of the decorated DRF view (function, or method
+    via method_decorator) from validators(request) -> (etag, last_modified).
+    Runs validators once per request.
+    """
+    def cached(request):
+        if not hasattr(request, '_conditional_validators'):
+            request._conditional_validators = validators(request)
+        return request._conditional_validators
+
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=lambda request, *args, **kwargs: cached(request)[0],
+            last_modified_func=lambda request, *args, **kwargs: cached(request)[1],
+        )(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
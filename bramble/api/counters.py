@@ -0,0 +1,44 @@
+"""
+Denormalized follower/following/post counters on AppUser.
+
+The counters are adjusted in the same transaction as the row that changes
+them (see api.signals), so a profile is one row read instead of three
+COUNT(*) queries. rebuild_counters() recomputes them from the source tables.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import AppUser, Follows, Post
+
+
+def adjust(app_user_id, **deltas):
+    """Atomically add deltas to counters, e.g. adjust(1, followers_count=1)."""
+    adjust_many([app_user_id], **deltas)
+
+
+def adjust_many(app_user_ids, **deltas):
+    """adjust() for several users in one UPDATE, which also bumps their updated_at."""
+    AppUser.objects.filter(pk__in=app_user_ids).update(updated_at=timezone.now(), **{
+        # Clamp at zero so a counter that has drifted low can't violate the
+        # unsigned constraint; rebuild_counters() fixes the drift itself
+        field: Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items()
+    })
+
+
+def _count(model, field):
+    rows = model.objects.filter(**{field: OuterRef('pk')}).values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(rows), Value(0))
+
+
+def rebuild_counters(queryset=None):
+    """Recompute the counters of queryset (default: everyone). Returns rows updated."""
+    if queryset is None:
+        queryset = AppUser.objects.all()
+    return queryset.update(
+        followers_count=_count(Follows, 'followee'),
+        following_count=_count(Follows, 'follower'),
+        post_count=_count(Post, 'user_id'),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,207 @@
+"""
+Feed assembly.
+
+By default the feed is pulled on read: every request ranges over the posts of
+everyone the user follows. With ``FEED_FANOUT`` enabled, new posts are instead
+pushed into each follower's ``TimelineEntry`` rows when they are written, and a
+feed read becomes one indexed range scan of the reader's own timeline.
+
+Authors with more than ``FEED_FANOUT_MAX_FOLLOWERS`` followers are never fanned
+out, so a single post from them doesn't turn into a write storm. Their posts
+are pulled on read and merged into the timeline page. When unfollows bring an
+author back down to the threshold their posts stop being pulled, so the ones
+written meanwhile are backfilled into their followers' timelines.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, QuerySet
+from django.db.models.expressions import RawSQL
+
+from .models import AppUser, Follows, Post, TimelineEntry
+from .pagination import KeysetSource
+
+
+def fanout_enabled():
+    return getattr(settings, 'FEED_FANOUT', False)
+
+
+def max_fanout_followers():
+    return getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 5000)
+
+
+def followee_ids(app_user):
+    return Follows.objects.filter(follower=app_user).values_list('followee', flat=True)
+
+
+def celebrity_followee_ids(app_user):
+    """Followees of app_user whose posts are too widely followed to fan out."""
+    return Follows.objects.filter(
+        follower=app_user, followee__followers_count__gt=max_fanout_followers(),
+    ).values_list('followee', flat=True)
+
+
+def feed_rows(posts):
+    """A Post queryset projected to feed rows."""
+    return posts.values('id', 'text', 'timestamp', 'likes', user=F('user_id__user__username'))
+
+
+class PullSource(KeysetSource):
+    """
+    Posts by author_ids.
+
+    For ``ORDER BY timestamp DESC LIMIT n`` over all the authors at once,
+    PostgreSQL reads and sorts every post after the cursor, and SQLite only
+    stops early when its planner happens to. A page instead reads at most n
+    posts per author, each a range read of api_post_user_ts_id_idx, and
+    sorts only those, so its cost depends on the number of authors but not
+    on how much they have posted.
+    """
+    def __init__(self, author_ids):
+        self.author_ids = author_ids
+        super().__init__(feed_rows(Post.objects.filter(user_id__in=author_ids)))
+
+    def page(self, cursor, limit):
+        posts = Post.objects.filter(pk__in=self.newest_per_author(cursor, limit))
+        return feed_rows(posts).order_by('-timestamp', '-id')[:limit]
+
+    def newest_per_author(self, cursor, limit):
+        """RawSQL for the ids of each author's first limit posts after cursor."""
+        connection = connections[self.queryset.db]
+        qn = connection.ops.quote_name
+        meta = Post._meta
+        table, author = qn(meta.db_table), qn(meta.get_field('user_id').column)
+        timestamp, pk = qn(meta.get_field('timestamp').column), qn(meta.pk.column)
+        authors = self.author_ids
+        if not isinstance(authors, QuerySet):
+            authors = AppUser.objects.filter(pk__in=authors).values_list('pk', flat=True)
+        authors_sql, params = authors.query.get_compiler(connection=connection).as_sql()
+        params = list(params)
+        after = ''
+        if cursor is not None:
+            cursor_timestamp = meta.get_field('timestamp').get_db_prep_value(cursor[0], connection)
+            after = f' AND (post.{timestamp} < %s OR (post.{timestamp} = %s AND post.{pk} < %s))'
+            params += [cursor_timestamp, cursor_timestamp, cursor[1]]
+        # One correlated LIMIT per author, which the (author, timestamp, id) index answers directly
+        return RawSQL(
+            f'WITH authors (id) AS ({authors_sql}) '
+            f'SELECT newest.{pk} FROM authors JOIN {table} newest ON newest.{pk} IN ('
+            f'SELECT post.{pk} FROM {table} post WHERE post.{author} = authors.id{after} '
+            f'ORDER BY post.{timestamp} DESC, post.{pk} DESC LIMIT %s)',
+            params + [limit],
+        )
+
+
+def pull_source(author_ids):
+    """Posts by author_ids, projected to feed rows."""
+    return PullSource(author_ids)
+
+
+def timeline_source(app_user):
+    """The materialized timeline of app_user, projected to feed rows."""
+    return KeysetSource(TimelineEntry.objects.filter(owner=app_user).values(
+        'post_id', 'timestamp',
+        text=F('post__text'), likes=F('post__likes'), user=F('author__user__username'),
+    ), id_field='post_id')
+
+
+def feed_sources(app_user):
+    """The KeysetSources whose merge is app_user's feed."""
+    if not fanout_enabled():
+        return [pull_source(followee_ids(app_user))]
+    return [timeline_source(app_user), pull_source(celebrity_followee_ids(app_user))]
+
+
+def new_posts_source(app_user):
+    """
+    The source of app_user's feed for FeedSincePagination: followees' posts
+    straight from Post, in either mode. Fan-out fills timelines after the
+    fact, so a timeline can gain entries behind a cursor a client already
+    polled past.
+    """
+    return pull_source(followee_ids(app_user))
+
+
+def should_fan_out(author_id):
+    if not fanout_enabled():
+        return False
+    return AppUser.objects.filter(pk=author_id, followers_count__lte=max_fanout_followers()).exists()
+
+
+def fan_out_post(post):
+    """Copy a new post into the timeline of every follower of its author."""
+    author_id = post.user_id_id
+    if not should_fan_out(author_id):
+        return
+    follower_ids = Follows.objects.filter(followee=author_id).values_list('follower', flat=True)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=follower_id, post=post, author_id=author_id, timestamp=post.timestamp)
+            for follower_id in follower_ids.iterator()
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def backfill_timeline(follower_id, followee_id):
+    """Seed the follower's timeline with the followee's recent posts after a new follow."""
+    if not should_fan_out(followee_id):
+        return
+    limit = getattr(settings, 'FEED_FANOUT_BACKFILL', 100)
+    posts = Post.objects.filter(user_id=followee_id).order_by('-timestamp', '-id').values('id', 'timestamp')[:limit]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=follower_id, post_id=post['id'], author_id=followee_id, timestamp=post['timestamp'])
+            for post in posts
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def authors_back_at_threshold(author_ids):
+    """
+    Those of author_ids who just lost a follower and are now fanned out
+    again. Followers are lost one at a time, so each downward crossing lands
+    on the threshold exactly once.
+    """
+    return AppUser.objects.filter(pk__in=author_ids, followers_count=max_fanout_followers()).values_list('id', flat=True)
+
+
+def backfill_followers(author_id):
+    """
+    Seed every follower's timeline with the author's recent posts, once the
+    author is fanned out again: posts written while they were over the
+    threshold were only ever pulled on read.
+    """
+    if not should_fan_out(author_id):
+        return
+    limit = getattr(settings, 'FEED_FANOUT_BACKFILL', 100)
+    posts = list(
+        Post.objects.filter(user_id=author_id).order_by('-timestamp', '-id').values('id', 'timestamp')[:limit]
+    )
+    if not posts:
+        return
+    follower_ids = Follows.objects.filter(followee=author_id).values_list('follower', flat=True).iterator()
+    # A few hundred followers at a time, so at most a few thousand entries are held
+    while batch := list(islice(follower_ids, max(1, 5000 // len(posts)))):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner_id=follower_id, post_id=post['id'], author_id=author_id, timestamp=post['timestamp'])
+                for follower_id in batch
+                for post in posts
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+
+def trim_timeline(follower_id, *followee_ids):
+    """
+    Drop the followees' posts from the follower's timeline after an unfollow.
+
+    Deleted posts need no such call: their entries go with them by cascade.
+    """
+    if fanout_enabled():
+        TimelineEntry.objects.filter(owner_id=follower_id, author_id__in=followee_ids).delete()
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the work factor taken from
+    settings.PASSWORD_PBKDF2_ITERATIONS.
+
+    The algorithm name is unchanged, so existing hashes keep verifying and are
+    re-hashed at the configured cost on the user's next login.
+    """
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_PBKDF2_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+def hash_passwords(passwords, iterations=None):
+    """
+    Hash passwords with the default hasher, at iterations if given. Module
+    level so bulk imports can fan it out over a process pool.
+    """
+    from django.contrib.auth.hashers import get_hasher
+
+    hasher = get_hasher('default')
+    if iterations is None:
+        return [hasher.encode(password, hasher.salt()) for password in passwords]
+    return [hasher.encode(password, hasher.salt(), iterations) for password in passwords]
@@ -0,0 +1,208 @@
+"""
+Background jobs.
+
+Functions decorated with ``@task`` can be queued with ``f.enqueue(**kwargs)``:
+that writes a ``Job`` row in the caller's transaction, so the job exists
+exactly when the write that caused it commits, and survives restarts. Jobs
+are run by a worker: a thread that claims due jobs TASKS_BATCH_SIZE at a time
+and runs them on a pool of TASKS_THREADS threads, each job in its own
+transaction. The web process starts one (see bramble/wsgi.py) unless
+TASKS_WORKER is off, which it is by default unless FEED_FANOUT, the only
+producer of jobs, is on; ``manage.py run_tasks`` runs one standalone. An
+idle worker only reads: claiming opens a write transaction only once a job
+is due.
+
+A job that raises is retried up to its max_attempts, TASKS_RETRY_DELAY
+seconds later, doubling each time, and then left as failed. A job claimed by
+a worker that died is claimed again after TASKS_LOCK_TIMEOUT seconds, so
+tasks must be safe to run twice.
+
+With TASKS_ALWAYS_EAGER on, enqueue() runs the task at once instead, in the
+caller's transaction, and lets its exceptions propagate (the tests do this).
+"""
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """Register func as a task, giving it .enqueue(**kwargs) and .enqueue_many([kwargs, ...])."""
+    def register(func):
+        func.task_name = name or f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        func.enqueue = lambda **payload: enqueue(func, payload)
+        func.enqueue_many = lambda payloads: enqueue_many(func, payloads)
+        _tasks[func.task_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def _max_attempts(func):
+    return func.max_attempts or getattr(settings, 'TASKS_MAX_ATTEMPTS', 5)
+
+
+def enqueue(func, payload):
+    """Queue one call of func(**payload). Returns the Job, or None if run eagerly."""
+    jobs = enqueue_many(func, [payload])
+    return jobs[0] if jobs else None
+
+
+def enqueue_many(func, payloads):
+    """Queue a call of func(**payload) for every payload, in one INSERT."""
+    payloads = list(payloads)
+    if getattr(settings, 'TASKS_ALWAYS_EAGER', False):
+        for payload in payloads:
+            func(**payload)
+        return []
+    now = timezone.now()
+    jobs = Job.objects.bulk_create([
+        Job(task=func.task_name, payload=payload, run_at=now, max_attempts=_max_attempts(func))
+        for payload in payloads
+    ])
+    if jobs:
+        transaction.on_commit(wake_worker)
+    return jobs
+
+
+def claim(batch_size, now=None):
+    """Mark up to batch_size due jobs as running and return them, oldest first."""
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'TASKS_LOCK_TIMEOUT', 300))
+    due = Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale)
+    # A plain read first: an idle worker polls every second, and the transaction
+    # below takes the database write lock on SQLite (BEGIN IMMEDIATE)
+    if not Job.objects.filter(due).exists():
+        return []
+    with transaction.atomic():
+        # On SQLite the transaction's BEGIN IMMEDIATE already keeps other workers out
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True).filter(due)
+            .order_by('run_at', 'id').values_list('id', flat=True)[:batch_size]
+        )
+        Job.objects.filter(id__in=ids).update(status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def _run(job):
+    """Run one claimed job. Returns None on success, else the formatted exception."""
+    try:
+        func = _tasks.get(job.task)
+        if func is None:
+            raise LookupError(f'Unknown task {job.task!r}')
+        with transaction.atomic():
+            func(**job.payload)
+        return None
+    except Exception:
+        logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts, exc_info=True)
+        return traceback.format_exc()
+
+
+def _run_in_pool(job):
+    try:
+        return _run(job)
+    finally:
+        # Pool threads outlive requests, so they tidy up connections the way request_finished would
+        close_old_connections()
+
+
+def _record(results, now=None):
+    """Delete the jobs that succeeded; reschedule or fail the rest."""
+    now = now or timezone.now()
+    Job.objects.filter(id__in=[job.pk for job, error in results if error is None]).delete()
+    delay = getattr(settings, 'TASKS_RETRY_DELAY', 2.0)
+    for job, error in results:
+        if error is None:
+            continue
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, locked_at=None, last_error=error)
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, locked_at=None, last_error=error,
+                run_at=now + timedelta(seconds=delay * 2 ** (job.attempts - 1)),
+            )
+
+
+def run_pending(batch_size=None, pool=None):
+    """
+    Claim one batch of due jobs and run it, on pool if given. Returns the
+    number of jobs run.
+    """
+    jobs = claim(batch_size or getattr(settings, 'TASKS_BATCH_SIZE', 50))
+    if not jobs:
+        return 0
+    errors = pool.map(_run_in_pool, jobs) if pool is not None else map(_run, jobs)
+    _record(list(zip(jobs, errors)))
+    return len(jobs)
+
+
+class Worker:
+    """Runs due jobs on a thread pool until stopped; wake() skips the rest of a poll interval."""
+    def __init__(self, threads=None, batch_size=None, poll_interval=None):
+        self.threads = threads or getattr(settings, 'TASKS_THREADS', 4)
+        self.batch_size = batch_size or getattr(settings, 'TASKS_BATCH_SIZE', 50)
+        self.poll_interval = poll_interval or getattr(settings, 'TASKS_POLL_INTERVAL', 1.0)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='bramble-jobs', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        with ThreadPoolExecutor(self.threads, thread_name_prefix='bramble-job') as pool:
+            while not self._stop.is_set():
+                try:
+                    ran = run_pending(self.batch_size, pool)
+                except Exception:
+                    # E.g. the database is briefly unavailable; try again next poll
+                    logger.exception('Claiming jobs failed')
+                    ran = 0
+                finally:
+                    close_old_connections()
+                if not ran:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+    """Start this process's worker, if TASKS_WORKER is on and it isn't running yet."""
+    global _worker
+    if not getattr(settings, 'TASKS_WORKER', True) or getattr(settings, 'TASKS_ALWAYS_EAGER', False):
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = Worker()
+            _worker.start()
+    return _worker
+
+
+def wake_worker():
+    if _worker is not None:
+        _worker.wake()
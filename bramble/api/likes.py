@@ -0,0 +1,131 @@
+"""
+Like counting.
+
+By default a like is a single ``UPDATE ... SET likes = likes + 1``, so
+concurrent likes never overwrite each other and no other column is touched.
+
+With ``LIKES_BUFFERED`` on, likes are collected in process memory and written
+in batches instead: a hot post then takes one row lock per flush rather than
+one per like. A flush happens whenever ``LIKES_FLUSH_BATCH`` likes are pending,
+every ``LIKES_FLUSH_INTERVAL`` seconds while any are (on a daemon thread that
+exits once the buffer stays empty), and at interpreter exit. Likes still
+pending when a process dies are lost, which is the trade-off for taking them
+off the row lock; the timer bounds the loss to about one interval's worth.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.http import Http404
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    def __init__(self):
+        self._pending = Counter()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    def add(self, post_id, count=1):
+        """
+        Record count likes for post_id, flushing if a threshold is crossed.
+
+        Returns how many likes were pending for the post, this one included.
+        """
+        with self._lock:
+            self._pending[post_id] += count
+            self._total += count
+            pending = self._pending[post_id]
+            if self._flusher is None:
+                # Started here rather than at import, so it also runs in forked workers
+                self._flusher = threading.Thread(target=self._flush_periodically, name='bramble-likes', daemon=True)
+                self._flusher.start()
+            due = (
+                self._total >= getattr(settings, 'LIKES_FLUSH_BATCH', 100)
+                or time.monotonic() - self._last_flush >= getattr(settings, 'LIKES_FLUSH_INTERVAL', 1.0)
+            )
+        if due:
+            self.flush()
+        return pending
+
+    def _flush_periodically(self):
+        """Flush every LIKES_FLUSH_INTERVAL seconds until a wait ends with nothing pending."""
+        while True:
+            time.sleep(getattr(settings, 'LIKES_FLUSH_INTERVAL', 1.0))
+            with self._lock:
+                if not self._total:
+                    self._flusher = None
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # The likes went back in the buffer; the next interval retries them
+                logger.exception('Flushing likes failed')
+            finally:
+                close_old_connections()
+
+    def pending(self, post_id):
+        with self._lock:
+            return self._pending[post_id]
+
+    def flush(self):
+        """Write out everything pending. Posts with the same increment share one UPDATE."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._total = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        by_increment = defaultdict(list)
+        for post_id, count in pending.items():
+            by_increment[count].append(post_id)
+        try:
+            with transaction.atomic():
+                for count, post_ids in by_increment.items():
+                    Post.objects.filter(id__in=post_ids).update(likes=F('likes') + count)
+        except Exception:
+            # Put the likes back so the next flush retries them
+            with self._lock:
+                self._pending.update(pending)
+                self._total += sum(pending.values())
+            raise
+
+
+like_buffer = LikeBuffer()
+
+
+def _flush_at_exit():
+    try:
+        like_buffer.flush()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def like_post(post_id):
+    """Add one like to post_id and return its like count. Raises Http404 if it doesn't exist."""
+    if getattr(settings, 'LIKES_BUFFERED', False):
+        likes = Post.objects.filter(id=post_id).values_list('likes', flat=True).first()
+        if likes is None:
+            raise Http404
+        return likes + like_buffer.add(post_id)
+
+    if not Post.objects.filter(id=post_id).update(likes=F('likes') + 1):
+        raise Http404
+    # The post may be deleted between the two statements
+    likes = Post.objects.values_list('likes', flat=True).filter(id=post_id).first()
+    if likes is None:
+        raise Http404
+    return likes
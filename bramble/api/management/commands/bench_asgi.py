@@ -0,0 +1,102 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import AsyncClient, Client
+from rest_framework.authtoken.models import Token
+
+from api.models import AppUser, Follows, Post
+from .bench_autocomplete import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare feed throughput of the sync view under WSGI with the sync and async views under ASGI, '
+        'driving the Django handlers in process. Creates a temporary fixture and removes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--followees', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20, help='posts per followee')
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        key = self.create_fixture(run, options['followees'], options['posts'])
+        headers = {'Authorization': f'Token {key}'}
+        # The test clients send Host: testserver, as under the test runner
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        try:
+            for label, bench, path in (
+                ('WSGI  /feed/      ', self.bench_wsgi, '/feed/'),
+                ('ASGI  /feed/      ', self.bench_asgi, '/feed/'),
+                ('ASGI  /async/feed/', self.bench_asgi, '/async/feed/'),
+            ):
+                elapsed, latencies = bench(path, headers, options['requests'], options['concurrency'])
+                latencies.sort()
+                self.stdout.write(
+                    f'{label} {len(latencies) / elapsed:8.1f} req/s, '
+                    f'p50 {percentile(latencies, 0.50) * 1000:.1f}ms, '
+                    f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms'
+                )
+        finally:
+            User.objects.filter(username__startswith=f'bench_{run}_').delete()
+
+    def create_fixture(self, run, followees, posts):
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench_{run}_{i}', email=f'bench_{run}_{i}@example.com')
+                for i in range(followees + 1)
+            ])
+            app_users = [AppUser.objects.create(user=user, bio='Benchmark user') for user in users]
+            reader, authors = app_users[0], app_users[1:]
+            Follows.objects.bulk_create([Follows(follower=reader, followee=author) for author in authors])
+            Post.objects.bulk_create([
+                Post(user_id=author, text=f'Benchmark post {i}', likes=0)
+                for author in authors for i in range(posts)
+            ])
+            return Token.objects.create(user=users[0]).key
+
+    def bench_wsgi(self, path, headers, count, concurrency):
+        def worker(n):
+            client = Client()
+            latencies = []
+            for _ in range(n):
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{path} returned {response.status_code}')
+            return latencies
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            shares = [count // concurrency + (i < count % concurrency) for i in range(concurrency)]
+            results = list(pool.map(worker, shares))
+        return time.perf_counter() - started, [latency for result in results for latency in result]
+
+    def bench_asgi(self, path, headers, count, concurrency):
+        async def worker(n):
+            client = AsyncClient()
+            latencies = []
+            for _ in range(n):
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{path} returned {response.status_code}')
+            return latencies
+
+        async def main():
+            shares = [count // concurrency + (i < count % concurrency) for i in range(concurrency)]
+            return await asyncio.gather(*(worker(n) for n in shares))
+
+        started = time.perf_counter()
+        results = asyncio.run(main())
+        return time.perf_counter() - started, [latency for result in results for latency in result]
@@ -0,0 +1,58 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.autocomplete import UsernameIndex
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark username autocomplete latency on a synthetic in-memory index (no database).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=20_000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        alphabet = string.ascii_lowercase + string.digits + '_'
+
+        names = set()
+        while len(names) < options['users']:
+            names.add(''.join(rng.choices(alphabet, k=rng.randint(4, 14))))
+        # Pareto-distributed follower counts: most users have a handful, a few have millions
+        users = [(i, name, int(rng.paretovariate(1.2)) - 1) for i, name in enumerate(names)]
+
+        started = time.perf_counter()
+        index = UsernameIndex(users)
+        build = time.perf_counter() - started
+        self.stdout.write(f'Built index of {len(index):,} usernames in {build:.2f}s')
+
+        # Prefixes of 1-6 characters taken from real usernames, as typed one key at a time
+        prefixes = [
+            name[:rng.randint(1, min(6, len(name)))]
+            for _, name, _ in rng.choices(users, k=options['queries'])
+        ]
+        latencies = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.complete(prefix, options['limit'])
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+
+        ms = lambda seconds: f'{seconds * 1000:.3f}ms'
+        self.stdout.write(
+            f"{len(latencies):,} queries: "
+            f"p50 {ms(percentile(latencies, 0.50))}, "
+            f"p95 {ms(percentile(latencies, 0.95))}, "
+            f"p99 {ms(percentile(latencies, 0.99))}, "
+            f"max {ms(latencies[-1])}"
+        )
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+from api.models import AppUser, Follows, Post
+from .bench_autocomplete import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure mixed read/write throughput against the configured database profile '
+        '(run once per BRAMBLE_DB_PROFILE to compare). Creates a temporary fixture and removes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10.0)
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='fraction of operations that write')
+        parser.add_argument('--users', type=int, default=50)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        app_user_ids = self.create_fixture(run, options['users'])
+        deadline = time.perf_counter() + options['seconds']
+        results = []
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            reads, writes, errors = [], [], 0
+            try:
+                while time.perf_counter() < deadline:
+                    app_user_id = rng.choice(app_user_ids)
+                    write = rng.random() < options['write_ratio']
+                    started = time.perf_counter()
+                    try:
+                        if write:
+                            self.write(app_user_id)
+                        else:
+                            self.read(app_user_id)
+                    except OperationalError:  # "database is locked" past the busy timeout
+                        errors += 1
+                        continue
+                    (writes if write else reads).append(time.perf_counter() - started)
+            finally:
+                # Persistent connections are per thread; don't leak them
+                connection.close()
+            with lock:
+                results.append((reads, writes, errors))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            reads = sorted(latency for result in results for latency in result[0])
+            writes = sorted(latency for result in results for latency in result[1])
+            errors = sum(result[2] for result in results)
+            db = settings.DATABASES['default']
+            self.stdout.write(
+                f"Profile {settings.DB_PROFILE} ({connection.vendor}, CONN_MAX_AGE={db.get('CONN_MAX_AGE', 0)}), "
+                f"{options['threads']} threads, {elapsed:.1f}s:"
+            )
+            self.stdout.write(f'  total   {(len(reads) + len(writes)) / elapsed:8.1f} ops/s, {errors} lock errors')
+            for label, samples in (('reads ', reads), ('writes', writes)):
+                if samples:
+                    self.stdout.write(
+                        f'  {label}  {len(samples) / elapsed:8.1f} ops/s, '
+                        f'p50 {percentile(samples, 0.50) * 1000:.1f}ms, '
+                        f'p99 {percentile(samples, 0.99) * 1000:.1f}ms'
+                    )
+        finally:
+            User.objects.filter(username__startswith=f'bench_{run}_').delete()
+
+    def create_fixture(self, run, count):
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench_{run}_{i}', email=f'bench_{run}_{i}@example.com') for i in range(count)
+            ])
+            app_users = [AppUser.objects.create(user=user, bio='Benchmark user') for user in users]
+            rng = random.Random(0)
+            Follows.objects.bulk_create([
+                Follows(follower=app_user, followee=followee)
+                for app_user in app_users
+                for followee in rng.sample(app_users, min(10, count))
+                if followee != app_user
+            ])
+            Post.objects.bulk_create([
+                Post(user_id=app_user, text=f'Benchmark post {i}', likes=0)
+                for app_user in app_users for i in range(10)
+            ])
+        return [app_user.pk for app_user in app_users]
+
+    def read(self, app_user_id):
+        # A first feed page, as the pull-model feed reads it
+        followees = Follows.objects.filter(follower_id=app_user_id).values('followee_id')
+        list(Post.objects.filter(user_id__in=followees).order_by('-timestamp', '-id').values('id', 'text')[:20])
+
+    def write(self, app_user_id):
+        # A post with its counter update, as PostAPIView writes it
+        with transaction.atomic():
+            Post.objects.create(user_id_id=app_user_id, text='Benchmark write', likes=0)
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import tracemalloc
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import AsyncClient
+from rest_framework.authtoken.models import Token
+
+from api import pubsub
+from api.models import AppUser, Follows, Post
+from .bench_autocomplete import percentile
+
+# Streams whose memory is traced
+MEMORY_SAMPLE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Open --connections idle push streams (/async/feed/push/) through the ASGI handler in process, '
+        'then time how long each post takes to reach all of them. Creates a temporary fixture and removes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--posts', type=int, default=20)
+        parser.add_argument('--connect-concurrency', type=int, default=200)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        connections = options['connections']
+        self.stdout.write(f'Creating {connections} followers...')
+        author, keys = self.create_fixture(run, connections)
+        # The test client sends Host: testserver; streams must outlive the benchmark
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        settings.PUSH_HEARTBEAT = settings.PUSH_MAX_AGE = 3600
+        try:
+            asyncio.run(self.bench(author, keys, options['posts'], options['connect_concurrency']))
+        finally:
+            User.objects.filter(username__startswith=f'bench_{run}_').delete()
+
+    def create_fixture(self, run, connections):
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench_{run}_{i}', email=f'bench_{run}_{i}@example.com')
+                for i in range(connections + 1)
+            ])
+            app_users = AppUser.objects.bulk_create([AppUser(user=user) for user in users])
+            author, followers = app_users[0], app_users[1:]
+            Follows.objects.bulk_create([Follows(follower=follower, followee=author) for follower in followers])
+            tokens = Token.objects.bulk_create([
+                Token(user=user, key=Token.generate_key()) for user in users[1:]
+            ])
+            return author, [token.key for token in tokens]
+
+    async def bench(self, author, keys, posts, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def connect(key):
+            async with semaphore:
+                response = await client.get('/async/feed/push/', headers={'Authorization': f'Token {key}'})
+                if response.status_code != 200:
+                    raise RuntimeError(f'/async/feed/push/ returned {response.status_code}')
+                stream = aiter(response.streaming_content)
+                await anext(stream)  # The retry: line; the stream is subscribed from here on
+                return stream
+
+        # Memory is traced over a sample only: tracing slows connecting several times over
+        sample = min(MEMORY_SAMPLE, len(keys))
+        tracemalloc.start()
+        sampled = await asyncio.gather(*(connect(key) for key in keys[:sample]))
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        started = time.perf_counter()
+        streams = sampled + await asyncio.gather(*(connect(key) for key in keys[sample:]))
+        elapsed = time.perf_counter() - started
+        rate = f'{(len(streams) - sample) / elapsed:,.0f}/s' if len(streams) > sample else 'n/a'
+        self.stdout.write(
+            f'{len(streams)} streams open ({rate} untraced), {memory / sample / 1024:.1f} KiB of Python heap each '
+            f'(including the test client\'s copy of each request), {pubsub.get_broker().subscriber_count()} subscribed'
+        )
+
+        username = await sync_to_async(lambda: author.user.username)()
+        publish_times, latencies = [], []
+        for i in range(posts):
+            post = await Post.objects.acreate(user_id=author, text=f'Push benchmark post {i}', likes=0)
+            readers = [asyncio.ensure_future(anext(stream)) for stream in streams]
+            await asyncio.sleep(0)  # Let every reader start waiting
+            published = time.perf_counter()
+            reached = await sync_to_async(pubsub.publish_post)(post, username)
+            publish_times.append(time.perf_counter() - published)
+            arrivals = await asyncio.gather(*(self.arrival(reader) for reader in readers))
+            latencies.extend(arrival - published for arrival in arrivals)
+            if reached != len(streams):
+                raise RuntimeError(f'Post reached {reached} of {len(streams)} streams')
+
+        latencies.sort()
+        publish_times.sort()
+        self.stdout.write(
+            f'{posts} posts to {len(streams)} followers: publish p50 {percentile(publish_times, 0.50) * 1000:.1f}ms; '
+            f'delivery p50 {percentile(latencies, 0.50) * 1000:.1f}ms, '
+            f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms'
+        )
+        for stream in streams:
+            await stream.aclose()
+
+    async def arrival(self, reader):
+        event = await reader
+        if b'event: post' not in event:
+            raise RuntimeError(f'Unexpected event {event!r}')
+        return time.perf_counter()
@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+
+from api import renderers
+from api.models import AppUser, Post, User
+from api.serializers import AppUserSerializer, PostSerializer, app_user_row_data
+from .bench_autocomplete import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark serializing and rendering one search page and one feed page of --items items: '
+        "DRF ModelSerializers and DRF's JSON renderer against .values() rows and api.renderers (no database)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=50)
+
+    def handle(self, *args, **options):
+        items, rounds = options['items'], options['rounds']
+        now = timezone.now()
+
+        app_users = [
+            AppUser(
+                id=i, bio=f'Bio of user {i}', followers_count=i * 7, following_count=i % 50, post_count=i % 300,
+                user=User(id=i, username=f'user{i}', email=f'user{i}@example.com', first_name='First', last_name='Last'),
+            )
+            for i in range(items)
+        ]
+        # What search_app_users() returns for the same users
+        user_rows = [
+            {
+                'id': app_user.id, 'bio': app_user.bio, 'followers_count': app_user.followers_count,
+                'following_count': app_user.following_count, 'post_count': app_user.post_count,
+                'user__username': app_user.user.username, 'user__email': app_user.user.email,
+                'user__first_name': app_user.user.first_name, 'user__last_name': app_user.user.last_name,
+            }
+            for app_user in app_users
+        ]
+        posts = [
+            Post(id=i, user_id=app_users[i], text=f'Post number {i} ' * 4, likes=i, timestamp=now - timedelta(seconds=i))
+            for i in range(items)
+        ]
+        # What the feed sources return for the same posts
+        post_rows = [
+            {'id': post.id, 'text': post.text, 'timestamp': post.timestamp, 'likes': post.likes,
+             'user': post.user_id.user.username}
+            for post in posts
+        ]
+
+        drf_render = DRFJSONRenderer().render
+        fast_render = renderers.dumps
+        cases = [
+            ('search', 'AppUserSerializer + DRF JSON', lambda: drf_render(page(AppUserSerializer(app_users, many=True).data))),
+            ('search', 'rows + DRF JSON', lambda: drf_render(page([app_user_row_data(row) for row in user_rows]))),
+            ('search', 'rows + api.renderers', lambda: fast_render(page([app_user_row_data(row) for row in user_rows]))),
+            ('feed', 'PostSerializer + DRF JSON', lambda: drf_render(page(PostSerializer(posts, many=True).data))),
+            ('feed', 'rows + DRF JSON', lambda: drf_render(page(post_rows))),
+            ('feed', 'rows + api.renderers', lambda: fast_render(page(post_rows))),
+        ]
+
+        self.stdout.write(f'{items} items per response, {rounds} rounds, orjson {"on" if renderers.orjson else "off"}')
+        self.stdout.write(f"{'endpoint':<8} {'path':<30} {'p50':>9} {'p95':>9} {'items/s':>11} {'speedup':>8}")
+        baselines = {}
+        for endpoint, name, render in cases:
+            render()  # Warm up
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                render()
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            median = percentile(timings, 0.50)
+            baseline = baselines.setdefault(endpoint, median)
+            self.stdout.write(
+                f'{endpoint:<8} {name:<30} {median * 1000:>7.2f}ms {percentile(timings, 0.95) * 1000:>7.2f}ms '
+                f'{items / median:>11,.0f} {baseline / median:>7.1f}x'
+            )
+
+
+def page(results):
+    return {'next': None, 'results': results}
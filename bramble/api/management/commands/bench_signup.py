@@ -0,0 +1,64 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from api.views import signup
+
+
+class Command(BaseCommand):
+    help = 'Measure signup throughput through the signup view. Every signup is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=50)
+        parser.add_argument(
+            '--iterations', type=int,
+            help='PBKDF2 iterations to benchmark with (default: PASSWORD_PBKDF2_ITERATIONS)',
+        )
+
+    def handle(self, *args, **options):
+        # Every signup comes from the same address, which the signup throttle would stop
+        overrides = {'THROTTLE_ENABLED': False}
+        if options['iterations']:
+            overrides['PASSWORD_PBKDF2_ITERATIONS'] = options['iterations']
+        with override_settings(**overrides):
+            self.bench(options['signups'])
+
+    def bench(self, count):
+        factory = APIRequestFactory()
+        run = uuid.uuid4().hex[:8]
+
+        started = time.perf_counter()
+        for i in range(count):
+            make_password('benchmark-password')
+        hashing = time.perf_counter() - started
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            for i in range(count):
+                request = factory.post('/signup/', {
+                    'user': {
+                        'username': f'bench_{run}_{i}',
+                        'email': f'bench_{run}_{i}@example.com',
+                        'first_name': 'Bench',
+                        'last_name': 'User',
+                        'password': 'benchmark-password',
+                    },
+                    'bio': 'Benchmark user',
+                }, format='json')
+                response = signup(request)
+                if response.status_code != 201:
+                    raise RuntimeError(f'Signup failed: {response.data}')
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'{count} signups at {settings.PASSWORD_PBKDF2_ITERATIONS} PBKDF2 iterations: '
+            f'{count / elapsed:.1f} signups/s, {elapsed / count * 1000:.1f}ms each, '
+            f'of which hashing {hashing / count * 1000:.1f}ms'
+        )
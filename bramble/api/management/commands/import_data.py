@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from api import bulk_import, synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk load users, follows and posts from JSONL or CSV files, or generate a synthetic power-law graph, '
+        'and report rows/s per phase. See api.bulk_import for the row formats.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='users file (JSONL or CSV; - for stdin)')
+        parser.add_argument('--follows', help='follows file')
+        parser.add_argument('--posts', help='posts file')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='file format (default: from the extension)')
+        parser.add_argument('--synthetic', type=int, metavar='USERS', help='generate this many users instead of reading files')
+        parser.add_argument('--prefix', help='username prefix of synthetic users (default: random)')
+        parser.add_argument('--following', type=int, default=20, help='mean number of users each synthetic user follows')
+        parser.add_argument('--alpha', type=float, default=1.2, help='power-law exponent of popularity')
+        parser.add_argument('--posts-per-user', type=int, default=5)
+        parser.add_argument('--password', default='password', help='password of every synthetic user')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows per bulk_create')
+        parser.add_argument('--transaction-size', type=int, default=50000, help='rows per transaction')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='processes hashing plain-text passwords (0: hash in this process)',
+        )
+        parser.add_argument(
+            '--iterations', type=int,
+            help='PBKDF2 iterations for imported passwords (default: PASSWORD_PBKDF2_ITERATIONS); '
+                 'they are re-hashed at the configured cost on first login',
+        )
+
+    def handle(self, *args, **options):
+        files = [options[kind] for kind in ('users', 'follows', 'posts')]
+        if options['synthetic'] is not None and any(files):
+            raise CommandError('Pass either --synthetic or files, not both.')
+        if options['synthetic'] is None and not any(files):
+            raise CommandError('Nothing to import: pass --users, --follows and/or --posts, or --synthetic.')
+        if options['batch_size'] < 1 or options['transaction_size'] < 1:
+            raise CommandError('--batch-size and --transaction-size must be positive.')
+
+        importer = bulk_import.Importer(
+            options['batch_size'], options['transaction_size'], options['workers'], options['iterations'],
+            progress=self.progress,
+        )
+        started = time.perf_counter()
+        with importer:
+            if options['synthetic'] is not None:
+                prefix = options['prefix'] or f'synthetic_{uuid.uuid4().hex[:8]}'
+                # One shared hash, as seed_graph does: hashing is for real passwords in files
+                users, follows, posts = synthetic.graph_rows(
+                    prefix, options['synthetic'], options['following'], options['posts_per_user'],
+                    options['alpha'], make_password(options['password']), options['seed'],
+                )
+                importer.import_users(users)
+                importer.import_follows(follows)
+                importer.import_posts(posts)
+                self.stdout.write(f'Generated users {prefix}_0 to {prefix}_{options["synthetic"] - 1}')
+            else:
+                for kind, path in zip(('users', 'follows', 'posts'), files):
+                    if path:
+                        self.import_file(importer, kind, path, options['format'])
+            importer.finish(stdout=self.stdout)
+        self.report(importer, time.perf_counter() - started)
+
+    def import_file(self, importer, kind, path, format):
+        if path == '-' and not format:
+            raise CommandError('--format is required when reading stdin.')
+        try:
+            if path == '-':
+                return getattr(importer, f'import_{kind}')(bulk_import.read_rows(sys.stdin, format))
+            format = format or bulk_import.format_for(path)
+            with open(path, newline='', encoding='utf-8') as f:
+                return getattr(importer, f'import_{kind}')(bulk_import.read_rows(f, format))
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Importing {kind} from {path}: {e!r}')
+
+    def progress(self, phase):
+        self.stdout.write(f'{phase.name}: {phase.read} rows, {phase.rows_per_second:.0f} rows/s')
+
+    def report(self, importer, elapsed):
+        self.stdout.write(f"{'phase':<10} {'read':>10} {'inserted':>10} {'skipped':>8} {'seconds':>8} {'rows/s':>10}")
+        for phase in importer.phases:
+            self.stdout.write(
+                f'{phase.name:<10} {phase.read:>10} {phase.inserted:>10} {phase.skipped:>8} '
+                f'{phase.seconds:>8.1f} {phase.rows_per_second:>10.0f}'
+            )
+        rows = sum(phase.read for phase in importer.phases if phase.name != 'rebuild')
+        self.stdout.write(self.style.SUCCESS(f'Imported {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s).'))
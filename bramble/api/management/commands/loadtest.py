@@ -0,0 +1,222 @@
+import http.client
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import synthetic
+from api.models import Post
+from .bench_autocomplete import percentile
+
+DEFAULT_MIX = 'feed=40,like=20,search=10,post=10,follow=10,login=5,signup=5'
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Client:
+    """One keep-alive HTTP connection to the server under test, per worker thread."""
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        payload = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(method, path, payload, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                return response.status, response.getheader('Server-Timing'), data
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed the kept-alive connection; reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic power-law social graph, then replay signup, login, post, like, follow, feed and '
+        'search flows against a running server and report throughput and latency percentiles per flow. '
+        'Run the server against the same database, with BRAMBLE_SERVER_TIMING=1 to also get queries per request, '
+        'and BRAMBLE_THROTTLE=0 unless the throttles are what is being tested.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--following', type=int, default=20, help='mean number of users each user follows')
+        parser.add_argument('--alpha', type=float, default=1.2, help='power-law exponent of popularity')
+        parser.add_argument('--posts-per-user', type=int, default=5)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'flow weights (default: {DEFAULT_MIX})')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='write the results to this JSON file')
+        parser.add_argument('--keep', action='store_true', help='keep the seeded users afterwards')
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        prefix = f'load_{uuid.uuid4().hex[:8]}'
+        password = 'loadtest-password'
+
+        started = time.perf_counter()
+        users = synthetic.seed_graph(
+            prefix, options['users'], options['following'], options['posts_per_user'],
+            options['alpha'], password, options['seed'],
+        )
+        self.stdout.write(f'Seeded {len(users)} users as {prefix}_* in {time.perf_counter() - started:.1f}s')
+        post_ids = list(Post.objects.filter(user_id__in=[user.app_user_id for user in users]).values_list('id', flat=True))
+
+        try:
+            results, elapsed = self.replay(options, mix, users, post_ids, prefix, password)
+        finally:
+            if not options['keep']:
+                synthetic.remove_graph(prefix)
+
+        report = self.report(options, results, elapsed)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Saved results to {options['output']}")
+
+    def parse_mix(self, spec):
+        mix = {}
+        for part in spec.split(','):
+            flow, _, weight = part.partition('=')
+            if not hasattr(self, f'flow_{flow.strip()}'):
+                raise CommandError(f'Unknown flow {flow!r} in --mix.')
+            mix[flow.strip()] = float(weight or 1)
+        return mix
+
+    def replay(self, options, mix, users, post_ids, prefix, password):
+        flows, weights = list(mix), list(mix.values())
+        remaining = itertools.count()
+        signups = itertools.count()
+        results = []
+        lock = threading.Lock()
+
+        def worker(n):
+            rng = random.Random(options['seed'] * 1000 + n)
+            client = Client(options['url'])
+            samples = []
+            while next(remaining) < options['requests']:
+                flow = rng.choices(flows, weights)[0]
+                context = {'rng': rng, 'user': rng.choice(users), 'users': users, 'post_ids': post_ids,
+                           'prefix': prefix, 'password': password, 'signups': signups}
+                started = time.perf_counter()
+                try:
+                    label, status, server_timing = getattr(self, f'flow_{flow}')(client, context)
+                except OSError:
+                    label, status, server_timing = flow, None, None
+                latency = time.perf_counter() - started
+                match = SERVER_TIMING_QUERIES.search(server_timing or '')
+                samples.append((label, status, latency, int(match.group(1)) if match else None))
+            with lock:
+                results.extend(samples)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    # Every flow is one request and returns (label, status, Server-Timing header)
+
+    def flow_signup(self, client, context):
+        username = f"{context['prefix']}_signup{next(context['signups'])}"
+        status, timing, _ = client.request('POST', '/signup/', {
+            'user': {'username': username, 'email': f'{username}@example.com', 'password': context['password'],
+                     'first_name': 'Load', 'last_name': 'Test'},
+            'bio': 'Signed up by loadtest',
+        })
+        return 'signup', status, timing
+
+    def flow_login(self, client, context):
+        status, timing, _ = client.request('POST', '/login/', {
+            'username': context['user'].username, 'password': context['password'],
+        })
+        return 'login', status, timing
+
+    def flow_post(self, client, context):
+        status, timing, _ = client.request('POST', '/post/', {'text': 'Posted by loadtest'}, context['user'].token)
+        return 'post', status, timing
+
+    def flow_like(self, client, context):
+        post_id = context['rng'].choice(context['post_ids'])
+        status, timing, _ = client.request('PATCH', f'/post/{post_id}/', token=context['user'].token)
+        return 'like', status, timing
+
+    def flow_follow(self, client, context):
+        # Follow someone, or unfollow them if already following
+        other = context['rng'].choice(context['users']).app_user_id
+        status, timing, _ = client.request('POST', f'/follow/{other}/', token=context['user'].token)
+        if status != 400:
+            return 'follow', status, timing
+        status, timing, _ = client.request('DELETE', f'/follow/{other}/', token=context['user'].token)
+        return 'unfollow', status, timing
+
+    def flow_feed(self, client, context):
+        status, timing, _ = client.request('GET', '/feed/', token=context['user'].token)
+        return 'feed', status, timing
+
+    def flow_search(self, client, context):
+        other = context['rng'].choice(context['users']).username
+        query = urlencode({'q': other[:len(other) - context['rng'].randint(0, 2)]})
+        status, timing, _ = client.request('GET', f'/search/users/?{query}', token=context['user'].token)
+        return 'search', status, timing
+
+    def report(self, options, results, elapsed):
+        def summarize(samples):
+            latencies = sorted(sample[2] for sample in samples)
+            queries = [sample[3] for sample in samples if sample[3] is not None]
+            return {
+                'requests': len(samples),
+                'throughput': len(samples) / elapsed,
+                'errors': sum(1 for sample in samples if sample[1] is None or sample[1] >= 500),
+                'client_errors': sum(1 for sample in samples if sample[1] is not None and 400 <= sample[1] < 500),
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'queries_per_request': sum(queries) / len(queries) if queries else None,
+            }
+
+        flows = {}
+        for label in sorted({sample[0] for sample in results}):
+            flows[label] = summarize([sample for sample in results if sample[0] == label])
+        report = {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'config': {key: options[key] for key in (
+                'url', 'users', 'following', 'alpha', 'posts_per_user', 'requests', 'concurrency', 'mix', 'seed',
+            )},
+            'elapsed_s': elapsed,
+            'total': summarize(results) if results else None,
+            'flows': flows,
+        }
+
+        self.stdout.write(f"{'flow':<10} {'reqs':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'errors':>7}")
+        for label, row in [*flows.items(), ('total', report['total'])]:
+            queries = f"{row['queries_per_request']:.1f}" if row['queries_per_request'] is not None else '-'
+            self.stdout.write(
+                f"{label:<10} {row['requests']:>6} {row['throughput']:>8.1f} {row['p50_ms']:>6.1f}ms "
+                f"{row['p95_ms']:>6.1f}ms {row['p99_ms']:>6.1f}ms {queries:>8} {row['errors']:>7}"
+            )
+        if not any(row['queries_per_request'] is not None for row in flows.values()):
+            self.stderr.write('No Server-Timing headers seen; run the server with BRAMBLE_SERVER_TIMING=1 for query counts.')
+        return report
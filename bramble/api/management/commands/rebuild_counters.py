@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the follower, following and post counters of every AppUser.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt counters for {updated} users.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api import feed
+from api.models import AppUser, Follows, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every materialized timeline from the follow graph (FEED_FANOUT mode).'
+
+    def handle(self, *args, **options):
+        if not feed.fanout_enabled():
+            self.stderr.write('FEED_FANOUT is off; timelines are not read, nothing to do.')
+            return
+
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            edges = Follows.objects.values_list('follower_id', 'followee_id').iterator(chunk_size=1000)
+            for count, (follower_id, followee_id) in enumerate(edges, start=1):
+                feed.backfill_timeline(follower_id, followee_id)
+                if count % 1000 == 0:
+                    self.stdout.write(f'{count} follows replayed')
+            # Every feed may have changed, so no client may keep its copy (see api.conditional)
+            AppUser.objects.update(updated_at=timezone.now())
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {TimelineEntry.objects.count()} timeline entries.'))
@@ -0,0 +1,33 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (see api.jobs) until interrupted, '
+        'or with --burst until none are due. Run with BRAMBLE_TASKS_WORKER=0 on the web processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once no jobs are due.')
+        parser.add_argument('--threads', type=int, default=None, help='Default: TASKS_THREADS.')
+        parser.add_argument('--batch-size', type=int, default=None, help='Default: TASKS_BATCH_SIZE.')
+
+    def handle(self, *args, **options):
+        if options['burst']:
+            total = 0
+            while ran := jobs.run_pending(options['batch_size']):
+                total += ran
+            self.stdout.write(self.style.SUCCESS(f'Ran {total} jobs.'))
+            return
+
+        worker = jobs.Worker(threads=options['threads'], batch_size=options['batch_size'])
+        signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+        self.stdout.write(f'Running jobs on {worker.threads} threads, polling every {worker.poll_interval}s; Ctrl-C to stop.')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary onto the local SQLite replica (BRAMBLE_SQLITE_REPLICA_PATH), '
+        'standing in for replication when testing replica routing locally.'
+    )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        replicas = [
+            alias for alias in getattr(settings, 'DATABASE_REPLICAS', [])
+            if connections[alias].vendor == 'sqlite'
+        ]
+        if connections['default'].vendor != 'sqlite' or not replicas:
+            raise CommandError('Needs an SQLite primary and BRAMBLE_SQLITE_REPLICA_PATH.')
+
+        for alias in replicas:
+            connections[alias].close()
+            # The online backup API copies a consistent snapshot even while the primary is in use
+            source = sqlite3.connect(primary['NAME'])
+            target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            self.stdout.write(f"Copied {primary['NAME']} to {settings.DATABASES[alias]['NAME']} ({alias})")
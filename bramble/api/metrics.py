@@ -0,0 +1,267 @@
+"""
+Per-endpoint request metrics, exposed in the Prometheus text format.
+
+MetricsMiddleware records, per URL name and method, a latency histogram plus
+totals of database queries, database time, serialization time and response
+bytes. Queries are counted by a wrapper installed on every database connection
+when it opens (see api.signals), which also logs statements slower than
+SLOW_QUERY_MS to the ``api.slow_queries`` logger. Serialization time is what
+the views spend in DRF serializers and the JSON renderer, marked with
+``serializing()``.
+
+The same wrapper feeds ``db_latency``, a moving average of query latency on
+the primary that load shedding (api.throttling) compares to its threshold.
+
+Metrics are kept per process, like the profile cache stats; scrape each
+worker, or run one worker per scrape target.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+slow_query_logger = logging.getLogger('api.slow_queries')
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestTimings:
+    """What one request spent, accumulated while it runs."""
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+            f'serialize;dur={self.serialize_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+_current = contextvars.ContextVar('bramble_request_timings', default=None)
+
+
+@contextmanager
+def serializing():
+    """Count the time spent in the block as the current request's serialization time."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.serialize_time += time.perf_counter() - started
+
+
+class LatencyTracker:
+    """
+    Exponentially weighted moving average of latency samples. The average
+    halves every half_life seconds without samples, so an estimate taken
+    under load doesn't outlive the load when traffic stops.
+    """
+    def __init__(self, weight=0.1, half_life=1.0):
+        self.weight = weight
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.average = 0.0
+            self.updated = time.monotonic()
+
+    def _decayed(self, now):
+        return self.average * 0.5 ** ((now - self.updated) / self.half_life)
+
+    def record(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            average = self._decayed(now)
+            self.average = average + self.weight * (seconds - average)
+            self.updated = now
+
+    def current(self):
+        with self._lock:
+            return self._decayed(time.monotonic())
+
+
+db_latency = LatencyTracker()
+
+
+def query_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        if context['connection'].alias == 'default':
+            # Only the primary: a slow replica is no reason to turn writes away
+            db_latency.record(elapsed)
+        timings = _current.get()
+        if timings is not None:
+            timings.queries += 1
+            timings.db_time += elapsed
+        threshold = getattr(settings, 'SLOW_QUERY_MS', 0)
+        if threshold and elapsed * 1000 >= threshold:
+            registry.record_slow_query()
+            slow_query_logger.warning(
+                'Slow query (%.1fms) on %s: %s', elapsed * 1000, context['connection'].alias, sql,
+            )
+
+
+def instrument_connection(connection):
+    # Wrappers live on the per-thread connection object and survive reconnects
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+class EndpointStats:
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.latency = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.buckets = tuple(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS))
+            self.endpoints = {}
+            self.slow_queries = 0
+            self.shed_requests = 0
+
+    def record(self, endpoint, method, elapsed, timings, response_bytes):
+        with self._lock:
+            stats = self.endpoints.get((endpoint, method))
+            if stats is None:
+                stats = self.endpoints[(endpoint, method)] = EndpointStats(self.buckets)
+            index = bisect.bisect_left(self.buckets, elapsed)
+            if index < len(self.buckets):
+                stats.bucket_counts[index] += 1
+            stats.count += 1
+            stats.latency += elapsed
+            stats.queries += timings.queries
+            stats.db_time += timings.db_time
+            stats.serialize_time += timings.serialize_time
+            stats.response_bytes += response_bytes or 0
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def record_shed_request(self):
+        with self._lock:
+            self.shed_requests += 1
+
+    def render(self, extra=()):
+        """
+        The Prometheus text exposition of everything recorded, followed by
+        extra (name, help, type, value) samples.
+        """
+        lines = []
+
+        def family(name, help, kind):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            family('bramble_request_duration_seconds', 'Request latency by endpoint.', 'histogram')
+            for (endpoint, method), stats in endpoints:
+                labels = f'endpoint="{_escape(endpoint)}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, stats.bucket_counts):
+                    cumulative += count
+                    lines.append(f'bramble_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'bramble_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+                lines.append(f'bramble_request_duration_seconds_sum{{{labels}}} {stats.latency}')
+                lines.append(f'bramble_request_duration_seconds_count{{{labels}}} {stats.count}')
+
+            for name, attr, help in (
+                ('bramble_db_queries_total', 'queries', 'Database queries issued by requests.'),
+                ('bramble_db_query_seconds_total', 'db_time', 'Time requests spent in database queries.'),
+                ('bramble_serialize_seconds_total', 'serialize_time', 'Time requests spent serializing and rendering.'),
+                ('bramble_response_bytes_total', 'response_bytes', 'Response body bytes (streamed bodies excluded).'),
+            ):
+                family(name, help, 'counter')
+                for (endpoint, method), stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{_escape(endpoint)}",method="{method}"}} {getattr(stats, attr)}')
+
+            family('bramble_slow_queries_total', 'Queries slower than SLOW_QUERY_MS.', 'counter')
+            lines.append(f'bramble_slow_queries_total {self.slow_queries}')
+            family('bramble_shed_requests_total', 'Writes turned away by load shedding.', 'counter')
+            lines.append(f'bramble_shed_requests_total {self.shed_requests}')
+
+        family('bramble_db_latency_seconds', 'Moving average of query latency on the primary.', 'gauge')
+        lines.append(f'bramble_db_latency_seconds {db_latency.current()}')
+
+        for name, help, kind, value in extra:
+            family(name, help, kind)
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+@sync_and_async_middleware
+class MetricsMiddleware:
+    """Record every request in the registry; optionally report it in a Server-Timing header."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        # Queries run through sync_to_async see the same timings: it copies the context
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings, time.perf_counter() - started)
+
+    def record(self, request, response, timings, elapsed):
+        match = request.resolver_match
+        # Unnamed routes fall back to their pattern, so labels stay bounded
+        endpoint = (match.url_name or match.route) if match else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        registry.record(endpoint, request.method, elapsed, timings, size)
+
+        if getattr(settings, 'METRICS_SERVER_TIMING', False):
+            response['Server-Timing'] = timings.server_timing(elapsed)
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user_id', 'timestamp', 'id'], name='api_post_user_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_post_feed_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.appuser')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='api.appuser')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'timestamp', 'post'], name='api_timeline_owner_ts_idx'), models.Index(fields=['owner', 'author'], name='api_timeline_owner_auth_idx')],
+                'unique_together': {('owner', 'post')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    AppUser = apps.get_model('api', 'AppUser')
+    Follows = apps.get_model('api', 'Follows')
+    Post = apps.get_model('api', 'Post')
+
+    def count(model, field):
+        rows = model.objects.filter(**{field: OuterRef('pk')}).values(field).annotate(n=Count('*')).values('n')
+        return Coalesce(Subquery(rows), Value(0))
+
+    AppUser.objects.update(
+        followers_count=count(Follows, 'followee'),
+        following_count=count(Follows, 'follower'),
+        post_count=count(Post, 'user_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='appuser',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='appuser',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# The Django icontains lookup compiles to UPPER(col::text) LIKE UPPER(%s) on
+# PostgreSQL, so the trigram indexes are built on that exact expression.
+POSTGRES_INDEXES = [
+    ('api_user_username_trgm', 'auth_user', 'username'),
+    ('api_user_email_trgm', 'auth_user', 'email'),
+    ('api_appuser_bio_trgm', 'api_appuser', 'bio'),
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_user_search USING fts5("
+            "username, email, bio, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO api_user_search (rowid, username, email, bio) "
+            "SELECT a.id, u.username, u.email, a.bio FROM api_appuser a JOIN auth_user u ON u.id = a.user_id"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, table, column in POSTGRES_INDEXES:
+            schema_editor.execute(
+                f'CREATE INDEX {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE api_user_search')
+    elif vendor == 'postgresql':
+        for name, table, column in POSTGRES_INDEXES:
+            schema_editor.execute(f'DROP INDEX {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_appuser_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
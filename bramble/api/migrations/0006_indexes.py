@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        # After auth's last table rebuild on SQLite, which would drop the raw index below
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('api', '0005_user_search_index'),
+    ]
+
+    operations = [
+        # New index first, so followers are never unindexed between steps
+        migrations.AddIndex(
+            model_name='follows',
+            index=models.Index(fields=['followee', 'follower'], name='api_follows_followee_idx'),
+        ),
+        # Single-column FK indexes made redundant by composites leading with the same column
+        migrations.AlterField(
+            model_name='follows',
+            name='followee',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='followers', to='api.appuser'),
+        ),
+        migrations.AlterField(
+            model_name='follows',
+            name='follower',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='following', to='api.appuser'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='user_id',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.appuser'),
+        ),
+        # Case-insensitive username lookups (see api.search); auth_user isn't ours to add Meta indexes to
+        migrations.RunSQL(
+            'CREATE INDEX api_auth_user_username_lower_idx ON auth_user (LOWER(username))',
+            'DROP INDEX api_auth_user_username_lower_idx',
+        ),
+    ]
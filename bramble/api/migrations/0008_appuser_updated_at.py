@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-18 22:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
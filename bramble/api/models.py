@@ -5,21 +5,89 @@ from django.contrib.auth.models import User
 class AppUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.CharField(max_length=50, blank=True)
+    # Denormalized counters, kept in step by api.signals; `manage.py rebuild_counters` repairs drift
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    post_count = models.PositiveIntegerField(default=0)
+    # Last change to anything in the profile or to the user's posts; the HTTP validators of api.conditional
+    updated_at = models.DateTimeField(auto_now=True)
     # TODO: Add profile picture
 
 class Post(models.Model):
-    user_id = models.ForeignKey(AppUser, on_delete=models.CASCADE)
+    # Indexed by api_post_user_ts_id_idx, which leads with this column
+    user_id = models.ForeignKey(AppUser, on_delete=models.CASCADE, db_index=False)
     text = models.TextField(max_length=256)
     timestamp = models.DateTimeField(auto_now_add=True)
     likes = models.BigIntegerField()
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the feed walks (author, timestamp, id); scanned
+            # backwards it serves ORDER BY -timestamp, -id too
+            models.Index(fields=['user_id', 'timestamp', 'id'], name='api_post_user_ts_id_idx'),
+        ]
+
 class Follows(models.Model):
-    follower = models.ForeignKey(AppUser, related_name='following', on_delete=models.CASCADE)
-    followee = models.ForeignKey(AppUser, related_name='followers', on_delete=models.CASCADE)
+    # Both directions are served by the two composite indexes below
+    follower = models.ForeignKey(AppUser, related_name='following', on_delete=models.CASCADE, db_index=False)
+    followee = models.ForeignKey(AppUser, related_name='followers', on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('follower', 'followee')  # Ensure that a user can follow another user only once
+        indexes = [
+            # A user's followers (fan-out, counter rebuilds) without touching the table
+            models.Index(fields=['followee', 'follower'], name='api_follows_followee_idx'),
+        ]
 
     def __str__(self):
         return f"{self.follower} follows {self.followee}"
+
+class TimelineEntry(models.Model):
+    """A post copied into a follower's materialized timeline (fan-out on write)."""
+    owner = models.ForeignKey(AppUser, related_name='timeline', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(AppUser, related_name='+', on_delete=models.CASCADE)
+    timestamp = models.DateTimeField()  # Copy of post.timestamp so reads never touch Post to sort
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', 'timestamp', 'post'], name='api_timeline_owner_ts_idx'),
+            models.Index(fields=['owner', 'author'], name='api_timeline_owner_auth_idx'),
+        ]
+
+class Job(models.Model):
+    """A queued call of a background task (see api.jobs). Finished jobs are deleted; failed ones kept."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    task = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)  # Keyword arguments of the task
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()  # Not before; pushed back after each failed attempt
+    locked_at = models.DateTimeField(null=True, blank=True)  # When a worker claimed it
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim due jobs oldest first
+            models.Index(fields=['status', 'run_at', 'id'], name='api_job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task}({self.payload}) [{self.status}]"
+
+
+class VersionCounter(models.Model):
+    """A named counter other processes poll to notice changes they got no signal for (see api.autocomplete)."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
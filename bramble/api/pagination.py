@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+
+def encode_cursor(timestamp, post_id):
+    """Pack a (timestamp, id) keyset position into an opaque token."""
+    raw = f'{timestamp.isoformat()}|{post_id}'.encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Unpack a token from encode_cursor. Raises ValueError on garbage."""
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        timestamp, post_id = urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(post_id)
+    except (TypeError, UnicodeDecodeError) as exc:
+        raise ValueError('Malformed cursor.') from exc
+
+
+class KeysetSource:
+    """
+    A ``.values()`` queryset read newest first by (timestamp, id).
+
+    ``id_field`` names the column that holds the post id when it is not ``id``
+    (timeline rows carry it as ``post_id``); rows are always returned with it
+    under ``id``.
+    """
+    def __init__(self, queryset, id_field='id'):
+        self.queryset = queryset
+        self.id_field = id_field
+
+    def filter(self, cursor):
+        queryset = self.queryset
+        if cursor is not None:
+            timestamp, post_id = cursor
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, **{f'{self.id_field}__lt': post_id})
+            )
+        return queryset.order_by('-timestamp', f'-{self.id_field}')
+
+    def filter_newer(self, cursor):
+        """The rows newer than cursor, oldest first: the range filter() leaves out, read the other way."""
+        timestamp, post_id = cursor
+        return self.queryset.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, **{f'{self.id_field}__gt': post_id})
+        ).order_by('timestamp', self.id_field)
+
+    def page(self, cursor, limit):
+        """The queryset of the first limit rows after cursor."""
+        return self.filter(cursor)[:limit]
+
+    def rows(self, cursor, limit):
+        return self.rename(list(self.page(cursor, limit)))
+
+    def newer_rows(self, cursor, limit):
+        return self.rename(list(self.filter_newer(cursor)[:limit]))
+
+    async def arows(self, cursor, limit):
+        return self.rename([row async for row in self.page(cursor, limit)])
+
+    async def anewer_rows(self, cursor, limit):
+        return self.rename([row async for row in self.filter_newer(cursor)[:limit]])
+
+    def iterate(self, cursor, chunk_size):
+        """Every row after cursor, read from the database chunk_size at a time."""
+        for row in self.filter(cursor).iterator(chunk_size=chunk_size):
+            yield self.rename([row])[0]
+
+    def rename(self, rows):
+        if self.id_field != 'id':
+            for row in rows:
+                row['id'] = row.pop(self.id_field)
+        return rows
+
+
+class FeedCursorPagination(BasePagination):
+    """
+    Keyset pagination over (timestamp, id), newest first.
+
+    Each page is a single range read starting just after the last row of the
+    previous page, so deep pages cost the same as the first one. The first
+    page also carries ``since``, the cursor of its newest row, for polling
+    FeedSincePagination for what comes after it.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'FEED_PAGE_SIZE', 20)
+        max_page_size = getattr(settings, 'FEED_MAX_PAGE_SIZE', 100)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        if requested <= 0:
+            return page_size
+        return min(requested, max_page_size)
+
+    def get_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            return decode_cursor(token)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return one page of a ``.values()`` queryset that includes timestamp and id."""
+        return self.paginate_sources([KeysetSource(queryset)], request, view=view)
+
+    def paginate_sources(self, sources, request, view=None):
+        """
+        Merge several KeysetSources into one page.
+
+        Each source contributes at most a page worth of rows after the cursor,
+        so the cost stays bounded however many sources there are. A post that
+        shows up in more than one source is only returned once.
+        """
+        self.start_page(request)
+        return self.merge_page([source.rows(self.cursor, self.page_size + 1) for source in sources])
+
+    async def apaginate_sources(self, sources, request, view=None):
+        """paginate_sources() for async views, reading the sources through the async ORM."""
+        self.start_page(request)
+        rows = await asyncio.gather(*(source.arows(self.cursor, self.page_size + 1) for source in sources))
+        return self.merge_page(rows)
+
+    def stream_sources(self, sources, request, chunk_size):
+        """
+        Every row of the merged sources after the request's cursor, unpaged,
+        as a generator that holds about chunk_size rows per source at a time.
+        """
+        cursor = self.get_cursor(request)
+        rows = [source.iterate(cursor, chunk_size) for source in sources]
+        merged = rows[0] if len(rows) == 1 else heapq.merge(*rows, key=itemgetter('timestamp', 'id'), reverse=True)
+
+        def unique(merged):
+            # A post in several sources has the same (timestamp, id) everywhere, so its copies are adjacent
+            last_id = None
+            for row in merged:
+                if row['id'] != last_id:
+                    last_id = row['id']
+                    yield row
+        return unique(merged)
+
+    def start_page(self, request):
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.get_cursor(request)
+
+    def merge_page(self, source_rows):
+        limit = self.page_size + 1
+        if len(source_rows) == 1:
+            rows = source_rows[0]
+        else:
+            merged = heapq.merge(*source_rows, key=itemgetter('timestamp', 'id'), reverse=True)
+            rows, seen = [], set()
+            for row in merged:
+                if row['id'] in seen:
+                    continue
+                seen.add(row['id'])
+                rows.append(row)
+                if len(rows) == limit:
+                    break
+
+        self.since = None
+        if self.cursor is None:
+            # An empty feed gets everything posted from now on
+            newest = rows[0] if rows else {'timestamp': timezone.now(), 'id': 0}
+            self.since = encode_cursor(newest['timestamp'], newest['id'])
+
+        self.next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            last = rows[-1]
+            self.next_cursor = encode_cursor(last['timestamp'], last['id'])
+        return rows
+
+    def get_paginated_data(self, data):
+        data = {'next': self.next_cursor, 'results': data}
+        if self.since is not None:
+            data['since'] = self.since
+        return data
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class FeedSincePagination(FeedCursorPagination):
+    """
+    What is new on top of a feed the client already holds: the rows after a
+    ``?since=`` cursor, read forward from it at most a page at a time and
+    returned newest first.
+
+    A poll is one range read however old the rest of the feed is. The
+    response's ``since`` is where the next poll starts, and ``more`` says
+    whether that poll already has rows to return, so a client that fell far
+    behind catches up page by page without gaps.
+    """
+    cursor_query_param = 'since'
+
+    def paginate_newer(self, source, request):
+        """Return the page of source's rows after the request's since cursor."""
+        self.start_page(request)
+        rows = source.newer_rows(self.cursor, self.page_size + 1)
+        self.more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if rows:
+            self.since = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+        else:
+            self.since = request.query_params[self.cursor_query_param]
+        rows.reverse()
+        return rows
+
+    def get_paginated_data(self, data):
+        return {'since': self.since, 'count': len(data), 'more': self.more, 'results': data}
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    ?limit=&offset= paging for ranked results.
+
+    Unlike LimitOffsetPagination there is no COUNT(*): one extra row is
+    fetched to tell whether a next page exists, and ``next`` is its offset.
+    """
+    def __init__(self):
+        self.default_limit = getattr(settings, 'SEARCH_PAGE_SIZE', 20)
+        self.max_limit = getattr(settings, 'SEARCH_MAX_PAGE_SIZE', 50)
+
+    def paginate_search(self, search, request, view=None):
+        """Call search(limit, offset) for one page and return its results."""
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        results = search(self.limit + 1, self.offset)
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_paginated_data(self, data):
+        next_offset = self.offset + self.limit if self.has_next else None
+        return {'next': next_offset, 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
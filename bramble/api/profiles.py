@@ -0,0 +1,151 @@
+"""
+Read-through cache of serialized profiles.
+
+Profiles are cached per AppUser id in the ``PROFILE_CACHE_ALIAS`` cache (a
+bounded LRU local-memory cache unless configured otherwise, see settings).
+api.signals invalidates an entry whenever something in the payload changes:
+follows and unfollows on either side, posts created or deleted, and edits to
+the AppUser or its auth User. Entries also expire after PROFILE_CACHE_TTL
+seconds as a backstop. Invalidations only reach the workers that share the
+cache, so PROFILE_CACHE_TTL defaults to 0, no caching, unless it is shared.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+
+from .metrics import serializing
+from .models import AppUser
+from .serializers import APP_USER_VALUES, app_user_data, app_user_row_data
+
+
+class CacheStats:
+    """Process-local hit/miss/invalidation counters."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def record(self, hits=0, misses=0, invalidations=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.invalidations += invalidations
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / lookups if lookups else None,
+            }
+
+
+stats = CacheStats()
+
+
+def profile_cache():
+    return caches[getattr(settings, 'PROFILE_CACHE_ALIAS', 'profiles')]
+
+
+def profile_key(app_user_id):
+    return f'profile:{app_user_id}'
+
+
+def updated_at_key(app_user_id):
+    return f'profile-updated-at:{app_user_id}'
+
+
+def cache_ttl():
+    return getattr(settings, 'PROFILE_CACHE_TTL', 0)
+
+
+def fill_timeout():
+    ttl = cache_ttl()
+    # A replica may lag behind an invalidation; don't let its copy outlive the lag
+    if router.db_for_read(AppUser) in getattr(settings, 'DATABASE_REPLICAS', []):
+        return min(ttl, getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+    return ttl
+
+
+def get_profile(app_user_id, app_user=None):
+    """
+    The AppUserSerializer payload for app_user_id.
+
+    Pass app_user if it is already loaded (with its user) to save the reload
+    on a miss.
+    """
+    cache = profile_cache()
+    key = profile_key(app_user_id)
+    data = cache.get(key) if cache_ttl() else None
+    if data is not None:
+        stats.record(hits=1)
+        return data
+
+    stats.record(misses=1)
+    if app_user is not None:
+        with serializing():
+            data = app_user_data(app_user)
+    else:
+        row = AppUser.objects.filter(pk=app_user_id).values(*APP_USER_VALUES).get()
+        with serializing():
+            data = app_user_row_data(row)
+    if timeout := fill_timeout():
+        cache.set(key, data, timeout)
+    return data
+
+
+async def aget_profile(app_user_id):
+    """get_profile() for async views."""
+    cache = profile_cache()
+    key = profile_key(app_user_id)
+    data = await cache.aget(key) if cache_ttl() else None
+    if data is not None:
+        stats.record(hits=1)
+        return data
+
+    stats.record(misses=1)
+    # Counters are columns on AppUser, so the whole profile is this one row read
+    row = await AppUser.objects.filter(pk=app_user_id).values(*APP_USER_VALUES).aget()
+    with serializing():
+        data = app_user_row_data(row)
+    if timeout := fill_timeout():
+        await cache.aset(key, data, timeout)
+    return data
+
+
+def get_updated_at(app_user_id):
+    """
+    AppUser.updated_at of app_user_id (the profile's HTTP validator, see
+    api.conditional), cached and invalidated along with the profile.
+    """
+    cache = profile_cache()
+    key = updated_at_key(app_user_id)
+    updated_at = cache.get(key) if cache_ttl() else None
+    if updated_at is None:
+        updated_at = AppUser.objects.filter(pk=app_user_id).values_list('updated_at', flat=True).first()
+        if updated_at is not None and (timeout := fill_timeout()):
+            cache.set(key, updated_at, timeout)
+    return updated_at
+
+
+def invalidate_profiles(*app_user_ids):
+    """
+    Drop the cached profiles of app_user_ids.
+
+    The entries are dropped right away and again once the surrounding
+    transaction commits, so a reader that refilled one from pre-commit data
+    in between doesn't leave it stale.
+    """
+    keys = [profile_key(app_user_id) for app_user_id in app_user_ids]
+    stats.record(invalidations=len(keys))
+    keys += [updated_at_key(app_user_id) for app_user_id in app_user_ids]
+    cache = profile_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,252 @@
+"""
+Push of new feed posts to connected clients, as Server-Sent Events under ASGI.
+
+Each open /async/feed/push/ stream subscribes to its reader's channel on the
+process's broker. Once a post is committed, publish_post() looks up which
+of the readers with a stream open follow the author, so its cost follows the
+number of open streams, not the author's follower count, and publishes the
+post to all of their channels at once: the event is encoded a single time
+and shared by every subscriber, and each event loop is woken once per
+publish, not once per subscriber. An idle
+stream is a suspended coroutine and an empty queue, with no thread, so one
+process holds tens of thousands of them.
+
+LocalBroker only reaches the streams held by this process. PUSH_BROKER names
+the broker class; one with the same subscribe / publish / has_subscribers /
+channels methods over e.g. Redis pub/sub reaches them across processes.
+
+Every event's id is a feed cursor (see api.pagination). A client that
+reconnects with Last-Event-ID (or ?since=) is first sent what it missed,
+read like /feed/new/; if that is more than FEED_MAX_PAGE_SIZE posts, or a
+stream falls PUSH_QUEUE_SIZE events behind, it gets a "gap" event and should
+refetch the feed. Streams end after PUSH_MAX_AGE seconds and clients
+reconnect: Django 4.2's ASGI handler only notices a vanished client when a
+write to it fails, so this bounds how long an abandoned stream is held.
+"""
+import asyncio
+import threading
+from collections import defaultdict, deque
+from itertools import islice
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Follows
+from .pagination import encode_cursor
+from .renderers import dumps
+from .routers import replica_reads
+
+# Subscribed readers looked up and published to per batch
+PUBLISH_BATCH = 2000
+
+# How long (milliseconds) EventSource clients wait before reconnecting
+RECONNECT_MS = 3000
+
+GAP_EVENT = b'event: gap\ndata: {}\n\n'
+
+HEARTBEAT_EVENT = b': keep-alive\n\n'
+
+
+class Subscription:
+    """
+    One stream's bounded queue of events, filled from any thread (through
+    the broker) and read on its event loop. A deque and at most one waiting
+    future: asyncio.Queue would cost several times more per idle stream.
+    """
+    __slots__ = ('broker', 'channel', 'loop', 'size', 'events', 'waiter', 'overflowed')
+
+    def __init__(self, broker, channel, size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.size = size
+        self.events = deque()
+        self.waiter = None
+        self.overflowed = False
+
+    def put(self, event):
+        """Queue event. Call on the subscription's loop."""
+        if len(self.events) < self.size:
+            self.events.append(event)
+        else:
+            self.overflowed = True
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def get(self, timeout):
+        """The next event, or None after timeout seconds without one."""
+        if not self.events:
+            self.waiter = self.loop.create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.waiter = None
+        return self.events.popleft()
+
+    def clear(self):
+        """Drop everything queued, after an overflow."""
+        self.events.clear()
+        self.overflowed = False
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+def _put_all(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+class LocalBroker:
+    """Subscriptions in this process's memory, published to from any thread."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def subscribe(self, channel):
+        """Subscribe to channel. Call on the event loop that will read the subscription."""
+        subscription = Subscription(self, channel, getattr(settings, 'PUSH_QUEUE_SIZE', 100))
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._channels.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._channels[subscription.channel]
+
+    def has_subscribers(self):
+        return bool(self._channels)
+
+    def channels(self):
+        """The channels that have subscribers, right now."""
+        with self._lock:
+            return list(self._channels)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._channels.values())
+
+    def publish(self, channels, event):
+        """Queue event for every subscriber of channels. Returns how many there were."""
+        by_loop = defaultdict(list)
+        with self._lock:
+            for channel in channels:
+                for subscription in self._channels.get(channel, ()):
+                    by_loop[subscription.loop].append(subscription)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_put_all, subscriptions, event)
+            except RuntimeError:
+                # The loop has closed; its streams are gone with it
+                pass
+        return sum(len(subscriptions) for subscriptions in by_loop.values())
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'PUSH_BROKER', 'api.pubsub.LocalBroker'))()
+    return _broker
+
+
+FEED_CHANNEL_PREFIX = 'feed:'
+
+
+def feed_channel(app_user_id):
+    return f'{FEED_CHANNEL_PREFIX}{app_user_id}'
+
+
+def subscribed_readers(broker):
+    """Ids of the AppUsers with a push stream open on broker."""
+    return [
+        int(channel.removeprefix(FEED_CHANNEL_PREFIX)) for channel in broker.channels()
+        if channel.startswith(FEED_CHANNEL_PREFIX)
+    ]
+
+
+def post_event(row):
+    """A feed row as ((timestamp, id), its SSE event)."""
+    cursor = encode_cursor(row['timestamp'], row['id'])
+    return (row['timestamp'], row['id']), b'id: %s\nevent: post\ndata: %s\n\n' % (cursor.encode(), dumps(row))
+
+
+def publish_post(post, username):
+    """
+    Push a committed post to the streams of its author's followers. Returns
+    how many streams it reached; while none are open, this costs nothing.
+    """
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return 0
+    event = post_event({
+        'id': post.id, 'text': post.text, 'timestamp': post.timestamp, 'likes': post.likes, 'user': username,
+    })
+    readers = iter(subscribed_readers(broker))
+    reached = 0
+    while batch := list(islice(readers, PUBLISH_BATCH)):
+        # Answered from the (follower, followee) unique index, one probe per reader
+        follower_ids = Follows.objects.filter(followee=post.user_id_id, follower__in=batch).values_list('follower', flat=True)
+        reached += broker.publish([feed_channel(follower_id) for follower_id in follower_ids], event)
+    return reached
+
+
+async def missed_events(source, cursor, user=None):
+    """
+    The backlog of a reconnecting stream: (position of the newest, events)
+    of source's rows after cursor, or (None, [GAP_EVENT]) if there are more
+    than FEED_MAX_PAGE_SIZE of them.
+    """
+    limit = getattr(settings, 'FEED_MAX_PAGE_SIZE', 100)
+    with replica_reads(user):
+        rows = await source.anewer_rows(cursor, limit + 1)
+    if len(rows) > limit:
+        return None, [GAP_EVENT]
+    events = [post_event(row) for row in rows]
+    return (events[-1][0] if events else None), [event for _, event in events]
+
+
+async def event_stream(channel, backlog=None):
+    """
+    The SSE body of a push stream on channel: the events of backlog (an
+    async callable returning missed_events()), if given, then every event
+    published to the channel, with heartbeats in between, for PUSH_MAX_AGE
+    seconds.
+    """
+    subscription = get_broker().subscribe(channel)
+    try:
+        yield b'retry: %d\n\n' % RECONNECT_MS
+        # Subscribed before reading the backlog, so no post falls between the two
+        replayed = None
+        if backlog is not None:
+            replayed, events = await backlog()
+            # Hold nothing but the subscription for the rest of the stream
+            backlog = None
+            for event in events:
+                yield event
+            del events
+
+        loop = asyncio.get_running_loop()
+        heartbeat = getattr(settings, 'PUSH_HEARTBEAT', 15)
+        deadline = loop.time() + getattr(settings, 'PUSH_MAX_AGE', 300)
+        while (remaining := deadline - loop.time()) > 0:
+            event = await subscription.get(min(heartbeat, remaining))
+            if subscription.overflowed:
+                subscription.clear()
+                yield GAP_EVENT
+            elif event is None:
+                yield HEARTBEAT_EVENT
+            elif replayed is None or event[0] > replayed:
+                yield event[1]
+    finally:
+        subscription.close()
@@ -0,0 +1,121 @@
+"""
+Read-replica routing.
+
+Everything reads from and writes to the primary ('default') unless a view
+opts in with ``replica_reads(user)``. Inside that block ORM reads go to one of
+DATABASE_REPLICAS, so only the endpoints that tolerate replication lag (feed,
+profile, search) ever see a replica.
+
+Read-your-writes: StickyPrimaryMiddleware notes every successful write by an
+authenticated user, and for REPLICA_STICKY_SECONDS afterwards that user's
+replica_reads() blocks stay on the primary. The note lives in the
+REPLICA_STICKY_CACHE_ALIAS cache, which must be shared between processes
+(e.g. Redis) for the window to hold across workers.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.permissions import SAFE_METHODS
+
+_replica_reads = contextvars.ContextVar('bramble_replica_reads', default=False)
+
+
+def sticky_cache():
+    return caches[getattr(settings, 'REPLICA_STICKY_CACHE_ALIAS', 'default')]
+
+
+def sticky_key(user_id):
+    return f'db-sticky:{user_id}'
+
+
+def stick_to_primary(user_id):
+    """Keep user_id's reads on the primary for the next REPLICA_STICKY_SECONDS."""
+    seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+    if seconds and getattr(settings, 'DATABASE_REPLICAS', []):
+        sticky_cache().set(sticky_key(user_id), True, seconds)
+
+
+def is_sticky(user_id):
+    return bool(sticky_cache().get(sticky_key(user_id)))
+
+
+def choose_replica():
+    """A replica alias to read from, or None to use the primary."""
+    replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+    return random.choice(replicas) if replicas else None
+
+
+@contextmanager
+def replica_reads(user=None):
+    """
+    Route ORM reads inside the block to a replica, unless user wrote recently.
+
+    Works in async views too: the flag is a context variable, which
+    sync_to_async carries into the thread running the query.
+    """
+    use_replica = bool(getattr(settings, 'DATABASE_REPLICAS', []))
+    if use_replica and user is not None and user.is_authenticated:
+        use_replica = not is_sticky(user.pk)
+    token = _replica_reads.set(use_replica)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return choose_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema by replicating the primary
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@sync_and_async_middleware
+class StickyPrimaryMiddleware:
+    """
+    Pin users to the primary for a moment after each successful write.
+
+    Async-capable, so under ASGI the async views run without a thread; only
+    writes leave the event loop, to resolve the user.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            self.stick(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            # The session user is resolved lazily, with a query
+            await sync_to_async(self.stick)(request, response)
+        return response
+
+    def stick(self, request, response):
+        # DRF copies the user it authenticates (e.g. by token) onto the request
+        user = getattr(request, 'user', None)
+        if response.status_code < 400 and user is not None and user.is_authenticated:
+            stick_to_primary(user.pk)
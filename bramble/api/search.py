@@ -0,0 +1,189 @@
+"""
+User search.
+
+On SQLite, users are indexed in the ``api_user_search`` FTS5 table (rowid is
+the AppUser id) and results are ranked with bm25, username hits weighing most.
+Every query word matches as a whole token or as a prefix, with whole-token
+hits ranking higher. The table is kept in sync by api.signals.
+
+On PostgreSQL, trigram GIN indexes on username, email and bio serve the
+``icontains`` filters directly and results are ranked by trigram similarity,
+so there is nothing to keep in sync.
+
+Any other database falls back to unranked ``icontains`` filters.
+
+Whatever the database, users whose whole username is the query, ignoring
+case, come first; they are found with the LOWER(username) index from
+migration 0006.
+"""
+import itertools
+import re
+
+from django.db import connection, connections, router
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .models import AppUser
+from .serializers import APP_USER_VALUES
+
+FTS_TABLE = 'api_user_search'
+
+# bm25 weights for the username, email and bio columns
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def fts_query(query):
+    """Turn free text into an FTS5 MATCH expression, or None if it has no words."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' AND '.join(f'("{word}" OR "{word}"*)' for word in words)
+
+
+def index_app_user(app_user):
+    """(Re)index one user. No-op outside SQLite."""
+    if connection.vendor != 'sqlite':
+        return
+    user = app_user.user
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [app_user.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, username, email, bio) VALUES (%s, %s, %s, %s)',
+            [app_user.pk, user.username, user.email, app_user.bio],
+        )
+
+
+def index_app_users(app_user_ids, batch_size=500):
+    """(Re)index many users at once, for bulk loads that bypass api.signals. No-op outside SQLite."""
+    if connection.vendor != 'sqlite':
+        return
+    app_user_ids = list(app_user_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(app_user_ids), batch_size):
+            batch = app_user_ids[start:start + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, username, email, bio) '
+                f'SELECT a.id, u.username, u.email, a.bio FROM api_appuser a JOIN auth_user u ON u.id = a.user_id '
+                f'WHERE a.id IN ({placeholders})',
+                batch,
+            )
+
+
+def unindex_app_user(app_user_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [app_user_id])
+
+
+def _sqlite_ranked_sql():
+    rank = f'bm25({FTS_TABLE}, {", ".join(map(str, FTS_WEIGHTS))})'
+    return f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY {rank}, rowid'
+
+
+def _sqlite_ids(query, limit, offset, using):
+    match = fts_query(query)
+    if match is None:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'{_sqlite_ranked_sql()} LIMIT %s OFFSET %s', [match, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_iter_ids(query, chunk_size, using):
+    match = fts_query(query)
+    if match is None:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(_sqlite_ranked_sql(), [match])
+        while rows := cursor.fetchmany(chunk_size):
+            yield from (row[0] for row in rows)
+
+
+def _postgres_ranked_ids(query):
+    from django.contrib.postgres.search import TrigramSimilarity
+    from django.db.models.functions import Greatest
+
+    return (
+        AppUser.objects.filter(_icontains(query))
+        .annotate(rank=Greatest(
+            TrigramSimilarity('user__username', query),
+            TrigramSimilarity('user__email', query),
+            TrigramSimilarity('bio', query),
+        ))
+        .order_by('-rank', 'id')
+        .values_list('id', flat=True)
+    )
+
+
+def _postgres_ids(query, limit, offset):
+    return list(_postgres_ranked_ids(query)[offset:offset + limit])
+
+
+def _icontains(query):
+    return Q(user__username__icontains=query) | Q(user__email__icontains=query) | Q(bio__icontains=query)
+
+
+def _rows(ids):
+    rows = {row['id']: row for row in AppUser.objects.filter(pk__in=ids).values(*APP_USER_VALUES)}
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+def _username_ids(query, using):
+    """Ids of the users whose username is query, ignoring case."""
+    return list(
+        AppUser.objects.using(using).alias(username_lower=Lower('user__username'))
+        .filter(username_lower=query.lower()).order_by('id').values_list('id', flat=True)
+    )
+
+
+def _ranked_ids(query, limit, offset, using):
+    vendor = connections[using].vendor
+    if vendor == 'sqlite':
+        return _sqlite_ids(query, limit, offset, using)
+    if vendor == 'postgresql':
+        return _postgres_ids(query, limit, offset)
+    return list(
+        AppUser.objects.filter(_icontains(query)).order_by('id')
+        .values_list('id', flat=True)[offset:offset + limit]
+    )
+
+
+def search_app_users(query, limit, offset=0):
+    """
+    Return up to limit AppUsers matching query, best match first, as
+    .values(*APP_USER_VALUES) rows (see api.serializers.app_user_row_data).
+    """
+    # Raw SQL isn't routed, so pick the read database (maybe a replica) here
+    using = router.db_for_read(AppUser)
+    exact = _username_ids(query, using)
+    if not exact:
+        return _rows(_ranked_ids(query, limit, offset, using))
+    # The exact matches are somewhere in the ranking too, so read it from the top
+    ranked = _ranked_ids(query, offset + limit, 0, using)
+    ids = exact + [pk for pk in ranked if pk not in exact]
+    return _rows(ids[offset:offset + limit])
+
+
+def iter_search_app_users(query, chunk_size=500):
+    """
+    Every AppUser matching query, best match first, as a generator of
+    search_app_users() rows that reads ids and rows chunk_size at a time.
+    """
+    using = router.db_for_read(AppUser)
+    exact = _username_ids(query, using)
+    vendor = connections[using].vendor
+    if vendor == 'sqlite':
+        ranked = _sqlite_iter_ids(query, chunk_size, using)
+    elif vendor == 'postgresql':
+        ranked = _postgres_ranked_ids(query).iterator(chunk_size=chunk_size)
+    else:
+        ranked = (
+            AppUser.objects.filter(_icontains(query)).order_by('id')
+            .values_list('id', flat=True).iterator(chunk_size=chunk_size)
+        )
+    ids = itertools.chain(exact, (pk for pk in ranked if pk not in exact))
+    while chunk := list(itertools.islice(ids, chunk_size)):
+        yield from _rows(chunk)
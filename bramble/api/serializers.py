@@ -34,13 +34,11 @@ class AppUserSerializer(serializers.ModelSerializer):
     """Serializer for the AppUser model, allowing creation of both User and AppUser."""
     
     user = UserSerializer()  # Allow writable nested user creation
-    followers_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
-    post_count = serializers.SerializerMethodField()
 
     class Meta:
         model = AppUser
         fields = ['user', 'bio', 'followers_count', 'following_count', 'post_count']
+        read_only_fields = ['followers_count', 'following_count', 'post_count']
 
     def create(self, validated_data):
         user_data = validated_data.pop('user')  # Extract User data from the request
@@ -50,12 +48,46 @@ class AppUserSerializer(serializers.ModelSerializer):
         app_user = AppUser.objects.create(user=user, bio=validated_data.get('bio', ''))
         
         return app_user
-    def get_followers_count(self, obj):
-        return Follows.objects.filter(followee=obj).count()
 
-    def get_following_count(self, obj):
-        return Follows.objects.filter(follower=obj).count()
 
-    def get_post_count(self, obj):
-        return Post.objects.filter(user_id=obj).count()
 
+# Read-only fast path for the hot read endpoints: the same payload as
+# AppUserSerializer, built from .values() rows without DRF's field machinery.
+
+APP_USER_VALUES = (
+    'id', 'bio', 'followers_count', 'following_count', 'post_count',
+    'user__username', 'user__email', 'user__first_name', 'user__last_name',
+)
+
+
+def app_user_row_data(row):
+    """AppUserSerializer(app_user).data, from an AppUser .values(*APP_USER_VALUES) row."""
+    return {
+        'user': {
+            'username': row['user__username'],
+            'email': row['user__email'],
+            'first_name': row['user__first_name'],
+            'last_name': row['user__last_name'],
+        },
+        'bio': row['bio'],
+        'followers_count': row['followers_count'],
+        'following_count': row['following_count'],
+        'post_count': row['post_count'],
+    }
+
+
+def app_user_data(app_user):
+    """AppUserSerializer(app_user).data, from an AppUser with its user loaded."""
+    user = app_user.user
+    return {
+        'user': {
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+        },
+        'bio': app_user.bio,
+        'followers_count': app_user.followers_count,
+        'following_count': app_user.following_count,
+        'post_count': app_user.post_count,
+    }
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from . import autocomplete, counters, feed, metrics, search, tasks
+from .authentication import forget_tokens
+from .conditional import touch
+from .profiles import invalidate_profiles
+from .models import AppUser, Follows, Post
+
+
+def follows_added(follower_id, followee_ids):
+    """
+    Side effects of follower_id starting to follow followee_ids.
+
+    Called per row from the signal below, and directly by bulk writes, which
+    send no signals.
+    """
+    counters.adjust(follower_id, following_count=len(followee_ids))
+    counters.adjust_many(followee_ids, followers_count=1)
+    invalidate_profiles(follower_id, *followee_ids)
+    transaction.on_commit(lambda: _adjust_autocomplete(followee_ids, 1))
+
+
+def follows_removed(follower_id, followee_ids):
+    """The inverse of follows_added()."""
+    counters.adjust(follower_id, following_count=-len(followee_ids))
+    counters.adjust_many(followee_ids, followers_count=-1)
+    invalidate_profiles(follower_id, *followee_ids)
+    transaction.on_commit(lambda: _adjust_autocomplete(followee_ids, -1))
+    if feed.fanout_enabled():
+        tasks.backfill_followers.enqueue_many(
+            [{'author_id': author_id} for author_id in feed.authors_back_at_threshold(followee_ids)]
+        )
+
+
+def _adjust_autocomplete(app_user_ids, delta):
+    index = autocomplete.loaded_index()
+    if index is not None:
+        for app_user_id in app_user_ids:
+            index.adjust_followers(app_user_id, delta)
+
+
+@receiver(post_save, sender=Follows)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        follows_added(instance.follower_id, [instance.followee_id])
+
+
+@receiver(post_delete, sender=Follows)
+def follow_deleted(sender, instance, **kwargs):
+    follows_removed(instance.follower_id, [instance.followee_id])
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust(instance.user_id_id, post_count=1)
+        invalidate_profiles(instance.user_id_id)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.adjust(instance.user_id_id, post_count=-1)
+    invalidate_profiles(instance.user_id_id)
+
+
+@receiver(post_save, sender=AppUser)
+def app_user_saved(sender, instance, created, **kwargs):
+    search.index_app_user(instance)
+    invalidate_profiles(instance.pk)
+    if created:
+        transaction.on_commit(lambda: _add_to_autocomplete(instance))
+
+
+def _add_to_autocomplete(app_user):
+    index = autocomplete.loaded_index()
+    if index is not None:
+        index.add(app_user.pk, app_user.user.username, app_user.followers_count)
+
+
+@receiver(post_delete, sender=AppUser)
+def app_user_deleted(sender, instance, **kwargs):
+    app_user_id = instance.pk
+    search.unindex_app_user(app_user_id)
+    invalidate_profiles(app_user_id)
+    autocomplete.bump_users_version()
+    transaction.on_commit(lambda: _remove_from_autocomplete(app_user_id))
+
+
+def _remove_from_autocomplete(app_user_id):
+    index = autocomplete.loaded_index()
+    if index is not None:
+        index.remove(app_user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # A brand new User has no AppUser or token yet; it's indexed when that is created
+    if created:
+        return
+    # Cached tokens carry the user, e.g. its is_active flag
+    forget_tokens(*Token.objects.filter(user=instance).values_list('key', flat=True))
+    app_user = AppUser.objects.filter(user=instance).first()
+    if app_user is not None:
+        search.index_app_user(app_user)
+        invalidate_profiles(app_user.pk)
+        touch(app_user.pk)
+        if update_fields is None or 'username' in update_fields:
+            # Maybe renamed (e.g. not just a last_login update)
+            autocomplete.bump_users_version()
+        username = instance.username
+        transaction.on_commit(lambda: _rename_in_autocomplete(app_user.pk, username))
+
+
+def _rename_in_autocomplete(app_user_id, username):
+    index = autocomplete.loaded_index()
+    if index is not None:
+        index.rename(app_user_id, username)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    forget_tokens(instance.key)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # Django 4.2 has no SQLite init_command, so apply SQLITE_PRAGMAS here
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    metrics.instrument_connection(connection)
@@ -0,0 +1,75 @@
+"""
+Streaming JSON responses, for exporting whole result sets.
+
+With ``?stream=1`` the feed and user search return every result instead of
+one page, as a ``StreamingHttpResponse`` in the usual ``{"next", "results"}``
+shape (``next`` is always null). Rows are read with ``.iterator()`` and
+encoded with api.renderers.dumps STREAM_CHUNK_SIZE at a time, so memory stays
+flat however long the export is and the first bytes go out after the first
+chunk.
+
+Under ASGI the body is an async iterator: Django 4.2 reads a sync iterator
+into a list before sending any of it there. Each chunk is still read by the
+sync generator, on the request's thread, through sync_to_async.
+
+The body is produced after the view returns, so per-request metrics don't
+see its queries, and replica routing is re-entered for each chunk.
+"""
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .renderers import dumps
+from .routers import replica_reads
+
+TRUTHY = ('1', 'true', 'yes')
+
+
+def stream_requested(request):
+    return request.query_params.get('stream', '').lower() in TRUTHY
+
+
+def chunk_size():
+    return getattr(settings, 'STREAM_CHUNK_SIZE', 500)
+
+
+def stream_results(rows, serialize=None, user=None, size=None):
+    """
+    Yield the JSON of {"next": null, "results": rows}, chunk by chunk.
+    serialize(chunk) maps each chunk of rows to plain data first.
+    """
+    size = size or chunk_size()
+    rows = iter(rows)
+    yield b'{"next":null,"results":['
+    separator = b''
+    while True:
+        # Per chunk rather than around the generator: under ASGI each chunk is read in a context of its own
+        with replica_reads(user):
+            chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            break
+        data = serialize(chunk) if serialize else chunk
+        yield separator + b','.join(dumps(item) for item in data)
+        separator = b','
+    yield b']}'
+
+
+async def aiterate(chunks):
+    """A sync iterator of chunks as an async one, each read on the request's thread."""
+    read = sync_to_async(next)
+    try:
+        while (chunk := await read(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def json_response(request, rows, serialize=None):
+    """A StreamingHttpResponse of stream_results(rows, serialize) for request's user."""
+    chunks = stream_results(rows, serialize, request.user)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = aiterate(chunks)
+    return StreamingHttpResponse(chunks, content_type='application/json')
@@ -0,0 +1,119 @@
+"""
+Synthetic social graphs for benchmarks and load tests.
+
+Popularity follows a power law: every user gets a Pareto-distributed weight
+and picks whom to follow in proportion to it. So, as in real follower graphs,
+most users have a handful of followers and a few have a large share of
+everyone.
+"""
+import bisect
+import itertools
+import random
+from collections import namedtuple
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from . import counters, feed, search
+from .models import AppUser, Follows, Post
+
+SeededUser = namedtuple('SeededUser', 'app_user_id username token')
+
+
+def power_law_follows(users, mean_following, alpha=1.2, rng=None):
+    """
+    Yield (follower, followee) index pairs over range(users), with no self or
+    duplicate follows. Out-degrees are exponential around mean_following;
+    in-degrees are heavy-tailed, with tail exponent alpha.
+    """
+    rng = rng or random.Random()
+    if users < 2 or not mean_following:
+        return
+    cumulative = list(itertools.accumulate(rng.paretovariate(alpha) for _ in range(users)))
+    total = cumulative[-1]
+    for follower in range(users):
+        wanted = min(users - 1, round(rng.expovariate(1 / mean_following)))
+        followees = set()
+        # Popular users get drawn repeatedly; give up on the rest rather than loop forever
+        for _ in range(wanted * 10):
+            if len(followees) == wanted:
+                break
+            followee = min(bisect.bisect(cumulative, rng.random() * total), users - 1)
+            if followee != follower:
+                followees.add(followee)
+        for followee in sorted(followees):
+            yield follower, followee
+
+
+def graph_rows(prefix, users, mean_following=20, posts_per_user=5, alpha=1.2, password_hash=None, seed=0):
+    """
+    The graph seed_graph() would create, as (users, follows, posts) iterators
+    of import rows (see api.bulk_import), generated lazily so any size streams.
+    """
+    rng = random.Random(seed)
+    user_rows = (
+        {'username': f'{prefix}_{i}', 'email': f'{prefix}_{i}@example.com', 'bio': f'Synthetic user {i}',
+         'password_hash': password_hash}
+        for i in range(users)
+    )
+    follow_rows = (
+        {'follower': f'{prefix}_{a}', 'followee': f'{prefix}_{b}'}
+        for a, b in power_law_follows(users, mean_following, alpha, rng)
+    )
+    post_rows = (
+        {'username': f'{prefix}_{i}', 'text': f'Synthetic post {n} by {prefix}_{i}'}
+        for i in range(users) for n in range(posts_per_user)
+    )
+    return user_rows, follow_rows, post_rows
+
+
+def seed_graph(prefix, users, mean_following=20, posts_per_user=5, alpha=1.2, password='password', seed=0, batch_size=1000):
+    """
+    Create users named <prefix>_<n> with tokens, a power-law follow graph
+    among them and posts_per_user posts each. Returns their SeededUsers.
+
+    Rows are bulk inserted, which skips api.signals, so counters, the search
+    index and (with FEED_FANOUT) timelines are rebuilt afterwards. Every user
+    shares one password hash, so seeding doesn't pay PBKDF2 per user.
+    """
+    rng = random.Random(seed)
+    password_hash = make_password(password)
+    with transaction.atomic():
+        created = User.objects.bulk_create([
+            User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com', password=password_hash)
+            for i in range(users)
+        ], batch_size=batch_size)
+        app_users = AppUser.objects.bulk_create(
+            [AppUser(user=user, bio=f'Synthetic user {i}') for i, user in enumerate(created)], batch_size=batch_size,
+        )
+        tokens = Token.objects.bulk_create(
+            [Token(user=user, key=Token.generate_key()) for user in created], batch_size=batch_size,
+        )
+        ids = [app_user.pk for app_user in app_users]
+
+        edges = power_law_follows(users, mean_following, alpha, rng)
+        while batch := list(itertools.islice(edges, batch_size)):
+            Follows.objects.bulk_create([Follows(follower_id=ids[a], followee_id=ids[b]) for a, b in batch])
+        Post.objects.bulk_create([
+            Post(user_id_id=app_user_id, text=f'Synthetic post {n} by {prefix}_{i}', likes=0)
+            for i, app_user_id in enumerate(ids) for n in range(posts_per_user)
+        ], batch_size=batch_size)
+
+        counters.rebuild_counters(AppUser.objects.filter(pk__in=ids))
+        search.index_app_users(ids)
+        if feed.fanout_enabled():
+            edges = Follows.objects.filter(follower_id__in=ids).values_list('follower_id', 'followee_id')
+            for follower_id, followee_id in edges.iterator(chunk_size=batch_size):
+                feed.backfill_timeline(follower_id, followee_id)
+
+    return [
+        SeededUser(app_user.pk, user.username, token.key)
+        for user, app_user, token in zip(created, app_users, tokens)
+    ]
+
+
+def remove_graph(prefix):
+    """Delete everything seed_graph(prefix, ...) created, and whatever those users did since."""
+    User.objects.filter(username__startswith=f'{prefix}_').delete()
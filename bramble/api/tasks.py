@@ -0,0 +1,34 @@
+"""
+Background tasks (see api.jobs): side effects of writes that readers can
+wait a moment for. Each may run after the world moved on, and more than once.
+"""
+from . import feed
+from .conditional import touch
+from .jobs import task
+from .models import Follows, Post
+
+
+@task
+def fan_out_post(post_id):
+    """feed.fan_out_post(), unless the post has been deleted since."""
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        feed.fan_out_post(post)
+        # Followers who fetched their feed before this ran must not get a 304 now
+        touch(post.user_id_id)
+
+
+@task
+def backfill_timeline(follower_id, followee_id):
+    """feed.backfill_timeline(), unless the follow has been undone since."""
+    if Follows.objects.filter(follower_id=follower_id, followee_id=followee_id).exists():
+        feed.backfill_timeline(follower_id, followee_id)
+        touch(follower_id)
+
+
+@task
+def backfill_followers(author_id):
+    """feed.backfill_followers(), unless the author has gone back over the threshold since."""
+    feed.backfill_followers(author_id)
+    # Followers who fetched their feed before this ran must not get a 304 now
+    touch(author_id)
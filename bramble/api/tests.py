@@ -1,7 +1,38 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from unittest import mock, skipUnless
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection, router, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, RequestFactory, SimpleTestCase, override_settings
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
-from .models import AppUser, User, Post, Follows
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from .models import AppUser, User, Post, Follows, Job, TimelineEntry
+from .serializers import APP_USER_VALUES, AppUserSerializer, app_user_data, app_user_row_data
+from . import autocomplete, checks, feed, jobs, pubsub, renderers, routers, search, signals, synthetic, tasks
+from .likes import LikeBuffer, like_buffer, like_post
+from .autocomplete import UsernameIndex, reset_index
+from .authentication import token_cache
+from .hashers import ConfigurablePBKDF2PasswordHasher
+from .metrics import LatencyTracker, MetricsMiddleware, db_latency, registry as metrics_registry
+from .profiles import profile_cache, stats as profile_cache_stats
+from .throttling import parse_rate, take_tokens, throttle_cache
 from rest_framework.authtoken.models import Token
 
 class SignupLoginAPITest(APITestCase):
@@ -23,6 +54,30 @@ class SignupLoginAPITest(APITestCase):
         self.assertTrue(User.objects.filter(username='testuser').exists())
         self.assertIn('token', response.data)
 
+    def test_signup_hashes_password_once(self):
+        signup_data = {
+            'user': {
+                'username': 'hashonce',
+                'email': 'hashonce@example.com',
+                'first_name': 'Hash',
+                'last_name': 'Once',
+                'password': 'testpassword'
+            },
+        }
+        with mock.patch.object(
+            ConfigurablePBKDF2PasswordHasher, 'encode', autospec=True,
+            side_effect=ConfigurablePBKDF2PasswordHasher.encode,
+        ) as encode:
+            response = self.client.post(reverse('signup'), signup_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(encode.call_count, 1)
+        self.assertTrue(User.objects.get(username='hashonce').check_password('testpassword'))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_hasher_iterations_are_configurable(self):
+        user = User.objects.create_user(username='cheap', password='testpassword')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
     def test_login_user(self):
         # Create a user to test login
         user = User.objects.create_user(username='testuser', password='testpassword')
@@ -38,6 +93,16 @@ class SignupLoginAPITest(APITestCase):
         self.assertIn('token', response.data)
         self.assertEqual(response.data['user']['bio'], 'Test bio')
 
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_login_username_is_case_sensitive(self):
+        user = User.objects.create_user(username='TestUser', password='testpassword')
+        AppUser.objects.create(user=user)
+        url = reverse('login')
+        response = self.client.post(url, {'username': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(url, {'username': 'TestUser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_login_invalid_credentials(self):
         # Test login with invalid credentials
         user = User.objects.create_user(username='testuser', password='testpassword')
@@ -91,8 +156,171 @@ class FeedAPITest(APITestCase):
         url = reverse('feed')  # Replace with your actual feed API URL name
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['text'], 'Post by testuser2')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['text'], 'Post by testuser2')
+        self.assertIsNone(response.data['next'])
+
+    def test_feed_cursor_pagination(self):
+        # Walk the feed two posts at a time and make sure nothing is skipped or repeated
+        for i in range(4):
+            Post.objects.create(user_id=self.app_user2, text=f'Post {i}', likes=0)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        url = reverse('feed')
+
+        seen = []
+        params = {'page_size': 2}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(post['id'] for post in response.data['results'])
+            if response.data['next'] is None:
+                break
+            params['cursor'] = response.data['next']
+
+        expected = list(Post.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_feed_cursor_pagination_across_authors(self):
+        authors = [self.app_user2] + [
+            AppUser.objects.create(user=User.objects.create(username=f'author{i}')) for i in range(3)
+        ]
+        Follows.objects.bulk_create([Follows(follower=self.app_user1, followee=author) for author in authors[1:]])
+        Post.objects.bulk_create([
+            Post(user_id=authors[i % 4], text=f'Post {i}', likes=0) for i in range(30)
+        ])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+
+        seen, params = [], {'page_size': 4}
+        while True:
+            response = self.client.get(reverse('feed'), params)
+            seen.extend(post['id'] for post in response.data['results'])
+            if response.data['next'] is None:
+                break
+            params['cursor'] = response.data['next']
+        self.assertEqual(seen, list(Post.objects.order_by('-timestamp', '-id').values_list('id', flat=True)))
+
+    @skipUnless(connection.vendor == 'sqlite', 'Counts SQLite VM steps')
+    def test_feed_page_cost_does_not_grow_with_history(self):
+        authors = [AppUser.objects.create(user=User.objects.create(username=f'author{i}')) for i in range(10)]
+        Follows.objects.bulk_create([Follows(follower=self.app_user1, followee=author) for author in authors])
+        source = feed.pull_source(feed.followee_ids(self.app_user1))
+
+        def cost():
+            steps = []
+            connection.ensure_connection()
+            connection.connection.set_progress_handler(lambda: steps.append(1), 100)
+            try:
+                rows = source.rows(None, 21)
+                source.rows((rows[10]['timestamp'], rows[10]['id']), 21)
+            finally:
+                connection.connection.set_progress_handler(None, 0)
+            return len(steps)
+
+        def add_posts(count):
+            Post.objects.bulk_create([Post(user_id=author, text='Old', likes=0) for author in authors for _ in range(count)])
+
+        add_posts(30)
+        small = cost()
+        add_posts(1000)
+        self.assertLess(cost(), 1.5 * small)
+
+    def test_feed_invalid_cursor(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        response = self.client.get(reverse('feed'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_feed_query_count_is_constant(self):
+        # The feed's validators plus one feed query no matter how many authors;
+        # the token (and AppUser) come from the token cache after the first request
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        url = reverse('feed')
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for i in range(10):
+            user = User.objects.create(username=f'author{i}')
+            author = AppUser.objects.create(user=user)
+            Follows.objects.create(follower=self.app_user1, followee=author)
+            Post.objects.create(user_id=author, text=f'Post by author{i}', likes=0)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 11)
+        self.assertEqual(response.data['results'][0]['user'], 'author9')
+
+
+@override_settings(FEED_FANOUT=True, FEED_FANOUT_MAX_FOLLOWERS=1)
+class FanoutFeedAPITest(APITestCase):
+    def setUp(self):
+        self.reader = AppUser.objects.create(user=User.objects.create(username='reader'))
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        self.celebrity = AppUser.objects.create(user=User.objects.create(username='celebrity'))
+        self.fan = AppUser.objects.create(user=User.objects.create(username='fan'))
+        self.reader_token = Token.objects.create(user=self.reader.user)
+        self.author_token = Token.objects.create(user=self.author.user)
+        self.celebrity_token = Token.objects.create(user=self.celebrity.user)
+
+        Follows.objects.create(follower=self.reader, followee=self.author)
+        # Two followers puts the celebrity over FEED_FANOUT_MAX_FOLLOWERS
+        Follows.objects.create(follower=self.reader, followee=self.celebrity)
+        Follows.objects.create(follower=self.fan, followee=self.celebrity)
+
+    def create_post(self, token, text):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post('/post/', {'text': text})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['post']['id']
+
+    def fetch_feed(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.reader_token.key)
+        response = self.client.get(reverse('feed'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['text'] for post in response.data['results']]
+
+    def test_post_fans_out_to_followers(self):
+        post_id = self.create_post(self.author_token, 'Hello followers')
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, post_id=post_id).exists())
+        self.assertEqual(self.fetch_feed(), ['Hello followers'])
+
+    def test_celebrity_posts_are_pulled_on_read(self):
+        self.create_post(self.author_token, 'From author')
+        self.create_post(self.celebrity_token, 'From celebrity')
+        self.assertFalse(TimelineEntry.objects.filter(author=self.celebrity).exists())
+        self.assertEqual(self.fetch_feed(), ['From celebrity', 'From author'])
+
+    def test_author_back_under_threshold_is_backfilled(self):
+        self.create_post(self.celebrity_token, 'While famous')
+        self.assertEqual(self.fetch_feed(), ['While famous'])
+
+        # Down to one follower: the celebrity is fanned out again, and no longer pulled
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.fan.user).key)
+        self.client.delete(reverse('follow-user', kwargs={'user_id': self.celebrity.id}))
+        self.assertEqual(list(feed.celebrity_followee_ids(self.reader)), [])
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, author=self.celebrity).exists())
+        self.assertEqual(self.fetch_feed(), ['While famous'])
+
+    def test_delete_post_trims_timelines(self):
+        post_id = self.create_post(self.author_token, 'Short lived')
+        response = self.client.delete(f'/post/{post_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(TimelineEntry.objects.filter(post_id=post_id).exists())
+        self.assertEqual(self.fetch_feed(), [])
+
+    def test_unfollow_trims_and_follow_backfills(self):
+        self.create_post(self.author_token, 'Hello followers')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.reader_token.key)
+        url = reverse('follow-user', kwargs={'user_id': self.author.id})
+
+        self.client.delete(url)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader).exists())
+        self.assertEqual(self.fetch_feed(), [])
+
+        self.client.post(url)
+        self.assertEqual(self.fetch_feed(), ['Hello followers'])
 
 
 class PostAPITest(APITestCase):
@@ -144,6 +372,92 @@ class PostLikeAPITest(APITestCase):
         self.post.refresh_from_db()
         self.assertEqual(self.post.likes, 1)
 
+    def test_like_missing_post(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.patch(f'/post/{self.post.id + 1}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_like_post_deleted_mid_like(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        values_list = Post.objects.values_list
+
+        def deleted_meanwhile(*args, **kwargs):
+            # A concurrent delete commits after the UPDATE, before the count is read back
+            Post.objects.filter(pk=self.post.pk).delete()
+            return values_list(*args, **kwargs)
+
+        with mock.patch.object(Post.objects, 'values_list', side_effect=deleted_meanwhile):
+            response = self.client.patch(f'/post/{self.post.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(LIKES_BUFFERED=True, LIKES_FLUSH_BATCH=3, LIKES_FLUSH_INTERVAL=60)
+    def test_buffered_likes_flush_in_batches(self):
+        like_buffer.flush()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = f'/post/{self.post.id}/'
+
+        self.assertEqual(self.client.patch(url).data['likes'], 1)
+        self.assertEqual(self.client.patch(url).data['likes'], 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 0)  # Still buffered
+
+        self.client.patch(url)  # Third like reaches LIKES_FLUSH_BATCH
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 3)
+        self.assertEqual(like_buffer.pending(self.post.id), 0)
+
+
+class ConcurrentLikeTest(APITransactionTestCase):
+    threads = 8
+    likes_per_thread = 25
+
+    def setUp(self):
+        app_user = AppUser.objects.create(user=User.objects.create(username='viral'))
+        self.post = Post.objects.create(user_id=app_user, text='Viral post', likes=0)
+
+    def like_concurrently(self):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.likes_per_thread):
+                    like_post(self.post.id)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_likes_are_not_lost(self):
+        self.like_concurrently()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, self.threads * self.likes_per_thread)
+
+    @override_settings(LIKES_BUFFERED=True, LIKES_FLUSH_BATCH=100, LIKES_FLUSH_INTERVAL=0.05)
+    def test_lone_buffered_like_is_flushed_on_a_timer(self):
+        # A buffer of its own, whose flusher starts with this interval
+        buffer = LikeBuffer()
+        self.assertEqual(buffer.add(self.post.id), 1)
+        # No further likes: only the flusher thread can write it out
+        deadline = time.monotonic() + 5
+        while not Post.objects.filter(id=self.post.id, likes=1).exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+
+    @override_settings(LIKES_BUFFERED=True, LIKES_FLUSH_BATCH=7, LIKES_FLUSH_INTERVAL=60)
+    def test_concurrent_buffered_likes_are_not_lost(self):
+        self.like_concurrently()
+        like_buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, self.threads * self.likes_per_thread)
+
 class FollowAPITest(APITestCase):
     def setUp(self):
         # Create two users: one for following and one to be followed
@@ -167,6 +481,17 @@ class FollowAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue(Follows.objects.filter(follower=self.app_user1, followee=self.app_user2).exists())
 
+    def test_follow_race_is_a_client_error(self):
+        # Another request follows between the existence check and the insert
+        Follows.objects.create(follower=self.app_user1, followee=self.app_user2)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        url = reverse('follow-user', kwargs={'user_id': self.app_user2.id})
+        with mock.patch('django.db.models.query.QuerySet.exists', return_value=False):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.app_user2.refresh_from_db()
+        self.assertEqual(self.app_user2.followers_count, 1)
+
     def test_unfollow_user(self):
         # Test unfollowing a user
         Follows.objects.create(follower=self.app_user1, followee=self.app_user2)
@@ -256,9 +581,58 @@ class UserSearchAPITest(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  # Two users match the query "john"
-        self.assertEqual(response.data[0]['user']['username'], 'john_doe')
-        self.assertEqual(response.data[1]['user']['username'], 'johnny')
+        self.assertEqual(len(response.data['results']), 2)  # Two users match the query "john"
+        self.assertEqual(response.data['results'][0]['user']['username'], 'john_doe')
+        self.assertEqual(response.data['results'][1]['user']['username'], 'johnny')
+
+    def test_search_query_count_is_constant(self):
+        # Token lookup, username lookup, index lookup and one fetch of the page's users
+        for i in range(5):
+            AppUser.objects.create(user=User.objects.create(username=f'johnson{i}'))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('user-search') + '?q=john')
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_search_pagination(self):
+        for i in range(5):
+            AppUser.objects.create(user=User.objects.create(username=f'johnson{i}'))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('user-search')
+
+        first = self.client.get(url, {'q': 'john', 'limit': 4})
+        self.assertEqual(len(first.data['results']), 4)
+        self.assertEqual(first.data['next'], 4)
+        second = self.client.get(url, {'q': 'john', 'limit': 4, 'offset': first.data['next']})
+        self.assertEqual(len(second.data['results']), 3)
+        self.assertIsNone(second.data['next'])
+
+        usernames = [user['user']['username'] for user in first.data['results'] + second.data['results']]
+        self.assertEqual(len(set(usernames)), 7)
+
+    def test_search_puts_username_matches_first(self):
+        # Outranks plain "john" on every column
+        AppUser.objects.create(user=User.objects.create(username='john_john', email='john@john.example'), bio='John, John')
+        AppUser.objects.create(user=User.objects.create(username='John'))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('user-search')
+
+        results = self.client.get(url, {'q': 'JOHN'}).data['results']
+        usernames = [user['user']['username'] for user in results]
+        self.assertEqual(usernames[0], 'John')
+        self.assertEqual(sorted(usernames), ['John', 'john_doe', 'john_john', 'johnny'])
+        pages = [self.client.get(url, {'q': 'JOHN', 'limit': 1, 'offset': offset}).data['results'] for offset in range(5)]
+        self.assertEqual([user for page in pages for user in page], results)
+
+    def test_search_index_follows_bio_edits(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('user-search')
+        self.assertEqual(self.client.get(url, {'q': 'gardening'}).data['results'], [])
+
+        self.app_user2.bio = 'Into gardening'
+        self.app_user2.save()
+        results = self.client.get(url, {'q': 'gardening'}).data['results']
+        self.assertEqual([user['user']['username'] for user in results], ['johnny'])
 
     def test_search_empty_query(self):
         # Set the authorization header with the token
@@ -270,3 +644,1470 @@ class UserSearchAPITest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['message'], 'Search query is required.')
+
+
+class StreamingExportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        Follows.objects.create(follower=self.app_user, followee=self.author)
+        self.client.force_authenticate(self.user)
+
+    def add_posts(self, count, text=''):
+        Post.objects.bulk_create(
+            [Post(user_id=self.author, text=f'Post {i} {text}', likes=i) for i in range(count)], batch_size=500,
+        )
+
+    def stream(self, url, params):
+        response = self.client.get(url, {**params, 'stream': 1})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_feed_stream_matches_pages(self):
+        self.add_posts(25)
+        url = reverse('feed')
+        paged, params = [], {'page_size': 10}
+        while True:
+            data = self.client.get(url, params).data
+            paged.extend(data['results'])
+            if not data['next']:
+                break
+            params['cursor'] = data['next']
+        with override_settings(STREAM_CHUNK_SIZE=7):
+            streamed = self.stream(url, {})
+        self.assertIsNone(streamed['next'])
+        self.assertEqual([row['id'] for row in streamed['results']], [row['id'] for row in paged])
+        self.assertEqual(streamed['results'][0]['user'], 'author')
+
+        # A cursor starts the export after that position
+        first_page = self.client.get(url, {'page_size': 10}).data
+        rest = self.stream(url, {'cursor': first_page['next']})
+        self.assertEqual(len(rest['results']), 15)
+
+    @override_settings(STREAM_CHUNK_SIZE=4)
+    async def test_feed_stream_is_async_under_asgi(self):
+        await sync_to_async(self.add_posts)(10)
+        token = await Token.objects.acreate(user=self.user)
+        response = await self.async_client.get(
+            reverse('feed'), {'stream': 1}, headers={'Authorization': 'Token ' + token.key},
+        )
+        # Sent chunk by chunk, rather than read into a list first
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(json.loads(b''.join(chunks))['results']), 10)
+
+    @override_settings(FEED_FANOUT=True, FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_feed_stream_merges_sources_without_duplicates(self):
+        self.add_posts(5)
+        celebrity = AppUser.objects.create(user=User.objects.create(username='celebrity'), followers_count=1)
+        Follows.objects.create(follower=self.app_user, followee=celebrity)
+        Post.objects.create(user_id=celebrity, text='Pulled', likes=0)
+        self.add_posts(3)
+        results = self.stream(reverse('feed'), {})['results']
+        self.assertEqual(len(results), 9)
+        self.assertEqual(len({row['id'] for row in results}), 9)
+
+    def test_search_stream_matches_ranking(self):
+        for i in range(12):
+            AppUser.objects.create(user=User.objects.create(username=f'streamer{i}'), bio='streams a lot' if i % 2 else '')
+        url = reverse('user-search')
+        paged = self.client.get(url, {'q': 'streamer', 'limit': 50}).data['results']
+        with override_settings(STREAM_CHUNK_SIZE=5):
+            streamed = self.stream(url, {'q': 'streamer'})['results']
+        self.assertEqual(streamed, paged)
+        self.assertEqual(self.stream(url, {'q': '!!'})['results'], [])
+
+    @override_settings(STREAM_CHUNK_SIZE=100)
+    def test_feed_stream_memory_is_flat(self):
+        import tracemalloc
+
+        url = reverse('feed')
+
+        def peak(export):
+            tracemalloc.start()
+            try:
+                size = export()
+                return tracemalloc.get_traced_memory()[1], size
+            finally:
+                tracemalloc.stop()
+
+        def streamed():
+            response = self.client.get(url, {'stream': 1})
+            return sum(len(chunk) for chunk in response.streaming_content)
+
+        def materialized():
+            # What one page of every post would cost: rows listed, then rendered in one go
+            rows = list(feed.pull_source([self.author.pk]).filter(None))
+            return len(renderers.JSONRenderer().render({'next': None, 'results': rows}))
+
+        self.add_posts(2000, 'x' * 200)
+        streamed()  # Warm up, so lazy imports and first-request setup aren't counted
+        small_peak, small_size = peak(streamed)
+        self.add_posts(6000, 'x' * 200)
+        stream_peak, stream_size = peak(streamed)
+        list_peak, list_size = peak(materialized)
+
+        self.assertEqual(stream_size, list_size)
+        self.assertGreater(stream_size, 3.5 * small_size)
+        # Four times the export, about the same peak: a few chunks, not the whole result
+        self.assertLess(stream_peak, 1.5 * small_peak)
+        self.assertLess(stream_peak, list_peak / 8)
+
+
+class CounterAPITest(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='alice')
+        self.app_user1 = AppUser.objects.create(user=self.user1)
+        self.token1 = Token.objects.create(user=self.user1)
+        self.app_user2 = AppUser.objects.create(user=User.objects.create(username='bob'))
+
+    def assertCounts(self, app_user, followers, following, posts):
+        app_user.refresh_from_db()
+        self.assertEqual(
+            (app_user.followers_count, app_user.following_count, app_user.post_count),
+            (followers, following, posts),
+        )
+
+    def test_counters_follow_writes(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        url = reverse('follow-user', kwargs={'user_id': self.app_user2.id})
+
+        self.client.post(url)
+        self.assertCounts(self.app_user1, 0, 1, 0)
+        self.assertCounts(self.app_user2, 1, 0, 0)
+
+        response = self.client.post('/post/', {'text': 'Counting'})
+        self.assertCounts(self.app_user1, 0, 1, 1)
+
+        self.client.delete(f"/post/{response.data['post']['id']}/")
+        self.client.delete(url)
+        self.assertCounts(self.app_user1, 0, 0, 0)
+        self.assertCounts(self.app_user2, 0, 0, 0)
+
+    def test_rebuild_counters_repairs_drift(self):
+        Follows.objects.create(follower=self.app_user1, followee=self.app_user2)
+        Post.objects.create(user_id=self.app_user2, text='Drift', likes=0)
+        AppUser.objects.update(followers_count=42, following_count=0, post_count=7)
+
+        call_command('rebuild_counters', stdout=io.StringIO())
+
+        self.assertCounts(self.app_user1, 0, 1, 0)
+        self.assertCounts(self.app_user2, 1, 0, 1)
+
+
+class UsernameIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = UsernameIndex([
+            (1, 'john_doe', 5),
+            (2, 'Johnny', 50),
+            (3, 'jo', 0),
+            (4, 'mary', 500),
+        ])
+
+    def usernames(self, prefix, limit=10):
+        return [user['username'] for user in self.index.complete(prefix, limit)]
+
+    def test_ranks_prefix_matches_by_followers(self):
+        self.assertEqual(self.usernames('jo'), ['Johnny', 'john_doe', 'jo'])
+        self.assertEqual(self.usernames('JOHN', limit=1), ['Johnny'])
+        self.assertEqual(self.usernames('x'), [])
+
+    def test_updates_invalidate_memoized_prefixes(self):
+        self.assertEqual(self.usernames('j', limit=1), ['Johnny'])
+        self.index.add(5, 'jane', 1000)
+        self.assertEqual(self.usernames('j', limit=1), ['jane'])
+        self.index.adjust_followers(1, 2000)
+        self.assertEqual(self.usernames('j', limit=1), ['john_doe'])
+
+    def test_remove_and_rename(self):
+        self.assertEqual(self.usernames('jo'), ['Johnny', 'john_doe', 'jo'])
+        self.index.remove(2)
+        self.assertEqual(self.usernames('jo'), ['john_doe', 'jo'])
+        self.index.rename(1, 'mark')
+        self.assertEqual(self.usernames('jo'), ['jo'])
+        self.assertEqual(self.index.complete('ma'), [
+            {'id': 4, 'username': 'mary', 'followers_count': 500},
+            {'id': 1, 'username': 'mark', 'followers_count': 5},
+        ])
+        self.assertEqual(len(self.index), 3)
+
+
+class UserAutocompleteAPITest(APITestCase):
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.user = User.objects.create(username='john_doe')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        popular = AppUser.objects.create(user=User.objects.create(username='johnny'))
+        Follows.objects.create(follower=self.app_user, followee=popular)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_autocomplete(self):
+        url = reverse('user-autocomplete')
+        response = self.client.get(url, {'q': 'jo'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['username'] for user in response.data], ['johnny', 'john_doe'])
+        self.assertEqual(response.data[0]['followers_count'], 1)
+
+        # Served from memory once loaded (and the token from the token cache)
+        with self.assertNumQueries(0):
+            self.client.get(url, {'q': 'joh'})
+
+    def test_signup_updates_loaded_index(self):
+        self.client.get(reverse('user-autocomplete'), {'q': 'jo'})
+        with self.captureOnCommitCallbacks(execute=True):
+            AppUser.objects.create(user=User.objects.create(username='joanna'))
+        response = self.client.get(reverse('user-autocomplete'), {'q': 'joa'})
+        self.assertEqual([user['username'] for user in response.data], ['joanna'])
+
+    def test_deletes_and_renames_update_loaded_index(self):
+        self.client.get(reverse('user-autocomplete'), {'q': 'jo'})
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(username='johnny').delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'mary'
+            self.user.save()
+        self.assertEqual(self.client.get(reverse('user-autocomplete'), {'q': 'jo'}).data, [])
+        response = self.client.get(reverse('user-autocomplete'), {'q': 'ma'})
+        self.assertEqual([user['username'] for user in response.data], ['mary'])
+
+    def test_refresh_picks_up_changes_made_without_signals(self):
+        index = autocomplete.get_index()
+        self.assertFalse(autocomplete.refresh_index())
+        # As another worker, or a bulk import, would add them
+        users = User.objects.bulk_create([User(username=f'joker{i}') for i in range(3)])
+        AppUser.objects.bulk_create([AppUser(user=user) for user in users])
+        self.assertTrue(autocomplete.refresh_index())
+        self.assertIsNot(autocomplete.get_index(), index)
+        response = self.client.get(reverse('user-autocomplete'), {'q': 'joke'})
+        self.assertEqual(len(response.data), 3)
+
+    def test_refresh_ignores_activity_but_not_renames_or_deletes(self):
+        popular = AppUser.objects.create(user=User.objects.create(username='popular'))
+        index = autocomplete.get_index()
+        # Posts and follows move updated_at on every active site; none of them rename anyone
+        Follows.objects.create(follower=self.app_user, followee=popular)
+        Post.objects.create(user_id=popular, text='Busy', likes=0)
+        self.assertFalse(autocomplete.refresh_index())
+        self.assertIs(autocomplete.get_index(), index)
+
+        popular.user.username = 'famous'
+        popular.user.save()
+        self.assertTrue(autocomplete.refresh_index())
+        self.assertFalse(autocomplete.refresh_index())
+        popular.user.delete()
+        self.assertTrue(autocomplete.refresh_index())
+
+    def test_autocomplete_empty_query(self):
+        response = self.client.get(reverse('user-autocomplete'), {'q': ''})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(PROFILE_CACHE_TTL=300)
+class ProfileCacheTest(APITestCase):
+    def setUp(self):
+        profile_cache().clear()
+        profile_cache_stats.reset()
+        self.user = User.objects.create(username='cached')
+        self.app_user = AppUser.objects.create(user=self.user, bio='Before')
+        self.token = Token.objects.create(user=self.user)
+        self.other = AppUser.objects.create(user=User.objects.create(username='other'))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def fetch_profile(self):
+        response = self.client.get(reverse('fetch-user-profile'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_profile_is_served_from_cache(self):
+        self.fetch_profile()
+        with self.assertNumQueries(0):  # Token (with AppUser) and profile both cached
+            self.assertEqual(self.fetch_profile()['bio'], 'Before')
+        snapshot = profile_cache_stats.snapshot()
+        self.assertEqual((snapshot['hits'], snapshot['misses']), (1, 1))
+
+    @override_settings(PROFILE_CACHE_TTL=0)
+    def test_unshared_cache_is_not_used(self):
+        self.assertEqual(self.fetch_profile()['bio'], 'Before')
+        # As another worker would write it: its invalidation can't reach this process's cache
+        AppUser.objects.filter(pk=self.app_user.pk).update(bio='After')
+        self.assertEqual(self.fetch_profile()['bio'], 'After')
+        self.assertIsNone(profile_cache().get(f'profile:{self.app_user.id}'))
+
+    def test_follow_invalidates_both_profiles(self):
+        self.fetch_profile()
+        self.client.post(reverse('follow-user', kwargs={'user_id': self.other.id}))
+        self.assertEqual(self.fetch_profile()['following_count'], 1)
+        self.assertIsNone(profile_cache().get(f'profile:{self.other.id}'))
+
+        self.client.delete(reverse('follow-user', kwargs={'user_id': self.other.id}))
+        self.assertEqual(self.fetch_profile()['following_count'], 0)
+
+    def test_post_and_bio_changes_invalidate(self):
+        self.fetch_profile()
+        response = self.client.post('/post/', {'text': 'Hi'})
+        self.assertEqual(self.fetch_profile()['post_count'], 1)
+        self.client.delete(f"/post/{response.data['post']['id']}/")
+        self.assertEqual(self.fetch_profile()['post_count'], 0)
+
+        self.app_user.bio = 'After'
+        self.app_user.save()
+        self.assertEqual(self.fetch_profile()['bio'], 'After')
+
+    def test_cache_stats_require_staff(self):
+        response = self.client.get(reverse('profile-cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('profile-cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_ratio', response.data)
+
+
+class FastSerializerTest(APITestCase):
+    def setUp(self):
+        user = User.objects.create(username='fast', email='fast@example.com', first_name='Fa', last_name='St')
+        self.app_user = AppUser.objects.create(user=user, bio='Quick', followers_count=3, post_count=1)
+
+    def test_row_data_matches_app_user_serializer(self):
+        expected = AppUserSerializer(self.app_user).data
+        row = AppUser.objects.filter(pk=self.app_user.pk).values(*APP_USER_VALUES).get()
+        self.assertEqual(app_user_row_data(row), expected)
+        self.assertEqual(app_user_data(self.app_user), expected)
+        # Same keys in the same order, so rendered bodies are identical too
+        self.assertEqual(renderers.dumps(app_user_row_data(row)), DRFJSONRenderer().render(expected))
+
+    def test_renderer_matches_drf_with_and_without_orjson(self):
+        data = {
+            'next': None,
+            'results': [{
+                'id': 1, 'text': 'Line\u2028separator, café', 'likes': 2 ** 70,
+                'timestamp': datetime.datetime(2024, 1, 2, 3, 4, 5, 678, tzinfo=datetime.timezone.utc),
+            }],
+        }
+        expected = DRFJSONRenderer().render(data)
+        self.assertEqual(renderers.JSONRenderer().render(data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.JSONRenderer().render(data), expected)
+        # Indented output is left to DRF
+        indented = renderers.JSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(indented, DRFJSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class BulkFollowAPITest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='onboarding')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.suggested = [
+            AppUser.objects.create(user=User.objects.create(username=f'suggested{i}')) for i in range(12)
+        ]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = reverse('follow-bulk')
+
+    def test_bulk_follow_reports_per_id(self):
+        Follows.objects.create(follower=self.app_user, followee=self.suggested[0])
+        ids = [self.suggested[0].id, self.suggested[1].id, 999999, self.suggested[1].id]
+        response = self.client.post(self.url, {'user_ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'user_id': self.suggested[0].id, 'status': 'already_following'},
+            {'user_id': self.suggested[1].id, 'status': 'followed'},
+            {'user_id': 999999, 'status': 'not_found'},
+        ])
+        self.app_user.refresh_from_db()
+        self.suggested[1].refresh_from_db()
+        self.assertEqual(self.app_user.following_count, 2)
+        self.assertEqual(self.suggested[1].followers_count, 1)
+
+    def test_bulk_follow_query_count_is_constant(self):
+        self.client.get(reverse('fetch-user-profile'))  # Warm the token cache
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(self.url, {'user_ids': [u.id for u in self.suggested[:2]]}, format='json')
+        with CaptureQueriesContext(connection) as many:
+            self.client.post(self.url, {'user_ids': [u.id for u in self.suggested[2:]]}, format='json')
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Follows.objects.filter(follower=self.app_user).count(), 12)
+
+    def test_bulk_follow_counts_only_rows_it_inserted(self):
+        followee = self.suggested[0]
+        bulk_create = Follows.objects.bulk_create
+        raced = []
+
+        def racing_bulk_create(objs, *args, **kwargs):
+            # Once, a single follow of the same user lands between the check and the insert
+            if not raced:
+                raced.append(Follows.objects.create(follower=self.app_user, followee=followee))
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Follows.objects, 'bulk_create', racing_bulk_create):
+            response = self.client.post(self.url, {'user_ids': [followee.id]}, format='json')
+        self.assertEqual(response.data['results'], [{'user_id': followee.id, 'status': 'followed'}])
+        self.app_user.refresh_from_db()
+        followee.refresh_from_db()
+        self.assertEqual(Follows.objects.filter(follower=self.app_user).count(), 1)
+        self.assertEqual((self.app_user.following_count, followee.followers_count), (1, 1))
+
+    def test_bulk_unfollow(self):
+        Follows.objects.create(follower=self.app_user, followee=self.suggested[0])
+        ids = [self.suggested[0].id, self.suggested[1].id]
+        response = self.client.delete(self.url, {'user_ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']], ['unfollowed', 'not_following'])
+        self.app_user.refresh_from_db()
+        self.assertEqual(self.app_user.following_count, 0)
+
+    def test_bulk_unfollow_query_count_is_constant(self):
+        for followee in self.suggested:
+            Follows.objects.create(follower=self.app_user, followee=followee)
+        self.client.get(reverse('fetch-user-profile'))  # Warm the token cache
+        with CaptureQueriesContext(connection) as few:
+            self.client.delete(self.url, {'user_ids': [u.id for u in self.suggested[:2]]}, format='json')
+        with CaptureQueriesContext(connection) as many:
+            self.client.delete(self.url, {'user_ids': [u.id for u in self.suggested[2:]]}, format='json')
+        self.assertEqual(len(few), len(many))
+        self.assertFalse(Follows.objects.filter(follower=self.app_user).exists())
+        self.suggested[5].refresh_from_db()
+        self.assertEqual(self.suggested[5].followers_count, 0)
+
+    def test_bulk_follow_rejects_bad_payloads(self):
+        for payload in [{}, {'user_ids': []}, {'user_ids': ['1']}, {'user_ids': list(range(101))}]:
+            response = self.client.post(self.url, payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        token_cache().clear()
+        self.user = User.objects.create(username='authed')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    @override_settings(TOKEN_CACHE_TTL=0)
+    def test_token_user_and_app_user_in_one_query(self):
+        with self.assertNumQueries(3):  # Joined token lookup, the feed's validators, then the feed itself
+            response = self.client.get(reverse('feed'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_cached_token_skips_database(self):
+        self.client.get(reverse('feed'))
+        with self.assertNumQueries(2):  # Validators and feed query only
+            self.client.get(reverse('feed'))
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_deleted_token_is_forgotten(self):
+        self.client.get(reverse('feed'))
+        self.token.delete()
+        response = self.client.get(reverse('feed'))
+        # 403 rather than 401: SessionAuthentication comes first and sends no WWW-Authenticate
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_deactivated_user_is_forgotten(self):
+        self.client.get(reverse('feed'))
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('feed'))
+        # 403 rather than 401: SessionAuthentication comes first and sends no WWW-Authenticate
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AsyncViewsTest(APITestCase):
+    def setUp(self):
+        token_cache().clear()
+        profile_cache().clear()
+        self.user1 = User.objects.create_user(username='john_doe', email='john@example.com', password='testpassword1')
+        self.app_user1 = AppUser.objects.create(user=self.user1, bio='User 1 bio')
+        self.token1 = Token.objects.create(user=self.user1)
+
+        self.user2 = User.objects.create_user(username='johnny', email='johnny@example.com', password='testpassword2')
+        self.app_user2 = AppUser.objects.create(user=self.user2, bio='User 2 bio')
+        Follows.objects.create(follower=self.app_user1, followee=self.app_user2)
+        for i in range(3):
+            Post.objects.create(user_id=self.app_user2, text=f'Post {i}', likes=0)
+        self.headers = {'Authorization': 'Token ' + self.token1.key}
+
+    async def test_async_feed_matches_sync_feed(self):
+        response = await self.async_client.get(reverse('async-feed'), {'page_size': 2}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([post['text'] for post in data['results']], ['Post 2', 'Post 1'])
+
+        response = await self.async_client.get(
+            reverse('async-feed'), {'page_size': 2, 'cursor': data['next']}, headers=self.headers,
+        )
+        self.assertEqual([post['text'] for post in response.json()['results']], ['Post 0'])
+        self.assertIsNone(response.json()['next'])
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        sync_response = await sync_to_async(self.client.get)(reverse('feed'), {'page_size': 2})
+        self.assertEqual(data['results'], sync_response.json()['results'])
+
+    async def test_async_feed_invalid_cursor(self):
+        response = await self.async_client.get(reverse('async-feed'), {'cursor': 'not-a-cursor'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_profile(self):
+        response = await self.async_client.get(reverse('async-profile'), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user']['username'], 'john_doe')
+        self.assertEqual(response.json()['following_count'], 1)
+
+    async def test_async_search(self):
+        response = await self.async_client.get(reverse('async-user-search'), {'q': 'john'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        usernames = [app_user['user']['username'] for app_user in response.json()['results']]
+        self.assertEqual(usernames, ['john_doe', 'johnny'])
+
+    async def test_async_views_require_token(self):
+        for name in ('async-feed', 'async-profile', 'async-user-search'):
+            response = await self.async_client.get(reverse(name))
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+
+class SQLitePragmaTest(SimpleTestCase):
+    databases = {'default'}
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connections(self):
+        previous = self.pragma('busy_timeout')
+        try:
+            with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+                signals.configure_sqlite(sender=type(connection), connection=connection)
+            self.assertEqual(self.pragma('busy_timeout'), 1234)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA busy_timeout = {previous}')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite locking')
+class SQLiteWriteLockTest(APITransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='unfollower')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        Follows.objects.create(follower=self.app_user, followee=self.author)
+        self.client.force_authenticate(self.user)
+
+    def test_unfollow_waits_for_a_concurrent_writer(self):
+        locked, errors = threading.Event(), []
+
+        def write_slowly():
+            try:
+                with transaction.atomic():
+                    Post.objects.create(user_id=self.author, text='Slow write', likes=0)
+                    locked.set()
+                    time.sleep(0.3)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                locked.set()
+                connection.close()
+
+        writer = threading.Thread(target=write_slowly)
+        writer.start()
+        locked.wait()
+        # The unfollow's transaction reads (the delete collector) before it writes. Under a
+        # deferred BEGIN that read-then-write fails with "database is locked" while another
+        # connection holds the write lock, instead of queueing behind it
+        response = self.client.delete(reverse('follow-user', kwargs={'user_id': self.author.id}))
+        writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Follows.objects.exists())
+        self.assertTrue(Post.objects.filter(text='Slow write').exists())
+
+
+class ReplicaRoutingTest(APITestCase):
+    def setUp(self):
+        token_cache().clear()
+        profile_cache().clear()
+        routers.sticky_cache().clear()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.app_user = AppUser.objects.create(user=self.user, bio='Reader bio')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_without_replicas_everything_uses_primary(self):
+        with routers.replica_reads(self.user):
+            self.assertEqual(router.db_for_read(Post), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_only_replica_reads_blocks_use_replica(self):
+        self.assertEqual(router.db_for_read(Post), 'default')
+        with routers.replica_reads(self.user):
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            self.assertEqual(router.db_for_write(Post), 'default')
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_read_views_read_from_replica(self):
+        with mock.patch('api.routers.choose_replica', return_value='default') as choose:
+            self.client.get(reverse('feed'))
+            self.client.get(reverse('fetch-user-profile'))
+            self.client.get(reverse('user-search'), {'q': 'reader'})
+            self.assertGreaterEqual(choose.call_count, 3)
+            choose.reset_mock()
+            self.client.post(reverse('post'), {'text': 'Hello'}, format='json')
+            choose.assert_not_called()
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_writer_reads_own_writes_from_primary(self):
+        response = self.client.post(reverse('post'), {'text': 'Hello'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(routers.is_sticky(self.user.pk))
+        with routers.replica_reads(self.user):
+            self.assertEqual(router.db_for_read(Post), 'default')
+
+        other = User.objects.create(username='other')
+        with routers.replica_reads(other):
+            self.assertEqual(router.db_for_read(Post), 'replica')
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_failed_write_is_not_sticky(self):
+        self.client.post(reverse('follow-user', args=[999999]))
+        self.assertFalse(routers.is_sticky(self.user.pk))
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_signup_is_sticky(self):
+        self.client.credentials()
+        response = self.client.post(reverse('signup'), {
+            'user': {
+                'username': 'newcomer', 'email': 'newcomer@example.com',
+                'first_name': 'New', 'last_name': 'Comer', 'password': 'testpassword',
+            },
+            'bio': 'New here',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(routers.is_sticky(User.objects.get(username='newcomer').pk))
+
+    def test_check_requires_shared_sticky_cache_with_replicas(self):
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/1'}
+        self.assertEqual(checks.check_sticky_cache(None), [])
+        with override_settings(DATABASE_REPLICAS=['replica']):
+            self.assertEqual([error.id for error in checks.check_sticky_cache(None)], ['api.E001'])
+            with override_settings(CACHES={**settings.CACHES, 'sticky': redis}):
+                self.assertEqual(checks.check_sticky_cache(None), [])
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    async def test_sticky_middleware_runs_async(self):
+        async def get_response(request):
+            return HttpResponse(status=201)
+
+        middleware = routers.StickyPrimaryMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().post('/post/')
+        request.user = self.user
+        response = await middleware(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await sync_to_async(routers.is_sticky)(self.user.pk))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+class QueryPlanTest(APITestCase):
+    """
+    Every query the endpoints run against a realistically sized, ANALYZEd
+    database must be answered from an index: no plan step may be a
+    ``SCAN``, bare or ``USING [COVERING] INDEX``, except of the FTS5 table.
+    """
+    USERS = 2000
+    FOLLOWS_PER_USER = 20
+    POSTS_PER_USER = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f'planuser{i}', email=f'planuser{i}@example.com') for i in range(cls.USERS)])
+        app_users = AppUser.objects.bulk_create([AppUser(user=user, bio=f'Bio {i}') for i, user in enumerate(users)])
+        Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+        Follows.objects.bulk_create([
+            Follows(follower=app_user, followee=app_users[(i + j) % cls.USERS])
+            for i, app_user in enumerate(app_users) for j in range(1, cls.FOLLOWS_PER_USER + 1)
+        ])
+        Post.objects.bulk_create([
+            Post(user_id=app_user, text=f'Post {j} by {app_user.user.username}', likes=0)
+            for app_user in app_users for j in range(cls.POSTS_PER_USER)
+        ])
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            cls.user = User.objects.create_user(username='PlanReader', password='testpassword')
+        cls.app_user = AppUser.objects.create(user=cls.user, bio='Reads a lot')
+        Follows.objects.bulk_create([Follows(follower=cls.app_user, followee=followee) for followee in app_users[:50]])
+        cls.token = Token.objects.create(user=cls.user)
+        cls.other = app_users[-1]
+        cls.post = Post.objects.filter(user_id=cls.other).first()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        token_cache().clear()
+        profile_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def assertIndexed(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                scans.extend(
+                    f"{row[-1]} in: {query['sql']}" for row in cursor.fetchall()
+                    # Any full scan, bare or through an index; FTS5 tables report MATCH lookups as SCAN
+                    if re.match(r'SCAN ', row[-1]) and not row[-1].startswith(f'SCAN {search.FTS_TABLE} ')
+                )
+        self.assertEqual(scans, [])
+        return response
+
+    def test_index_scans_count_as_scans(self):
+        def full_index_scan():
+            # SCAN api_follows USING COVERING INDEX: every row, just read from an index
+            list(Follows.objects.order_by('followee').values_list('followee', flat=True))
+            return HttpResponse()
+
+        with self.assertRaises(AssertionError):
+            self.assertIndexed(full_index_scan)
+
+    def test_feed(self):
+        response = self.assertIndexed(lambda: self.client.get(reverse('feed')))
+        self.assertIndexed(lambda: self.client.get(reverse('feed'), {'cursor': response.data['next']}))
+
+    @override_settings(FEED_FANOUT=True)
+    def test_fanout_feed(self):
+        self.assertIndexed(lambda: self.client.get(reverse('feed')))
+
+    def test_profile(self):
+        self.assertIndexed(lambda: self.client.get(reverse('fetch-user-profile')))
+
+    def test_search(self):
+        for query in ('planuser12', 'PlanUser12', 'Bio'):
+            self.assertIndexed(lambda: self.client.get(reverse('user-search'), {'q': query}))
+
+    def test_login(self):
+        self.assertIndexed(lambda: self.client.post(
+            reverse('login'), {'username': 'PlanReader', 'password': 'testpassword'}, format='json',
+        ))
+
+    def test_post_create_and_delete(self):
+        response = self.assertIndexed(lambda: self.client.post(reverse('post'), {'text': 'Hello'}, format='json'))
+        self.assertIndexed(lambda: self.client.delete(f"/post/{response.data['post']['id']}/"))
+
+    @override_settings(FEED_FANOUT=True)
+    def test_post_fanout(self):
+        self.assertIndexed(lambda: self.client.post(reverse('post'), {'text': 'Hello'}, format='json'))
+
+    def test_like(self):
+        self.assertIndexed(lambda: self.client.patch(f'/post/{self.post.id}/'))
+
+    @override_settings(FEED_FANOUT=True)
+    def test_follow_and_unfollow(self):
+        url = reverse('follow-user', args=[self.other.id])
+        self.assertIndexed(lambda: self.client.post(url))
+        self.assertIndexed(lambda: self.client.delete(url))
+
+    def test_bulk_follow(self):
+        self.assertIndexed(lambda: self.client.post(reverse('follow-bulk'), {'user_ids': [self.other.id]}, format='json'))
+        self.assertIndexed(lambda: self.client.delete(reverse('follow-bulk'), {'user_ids': [self.other.id]}, format='json'))
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        token_cache().clear()
+        metrics_registry.reset()
+        self.user = User.objects.create(username='measured')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def metrics(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer scrape-me')
+        with override_settings(METRICS_TOKEN='scrape-me'):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_records_requests_per_endpoint(self):
+        self.client.get(reverse('feed'))
+        self.client.get(reverse('feed'))
+        self.client.get(reverse('fetch-user-profile'))
+        body = self.metrics()
+        self.assertIn('bramble_request_duration_seconds_count{endpoint="feed",method="GET"} 2', body)
+        self.assertIn('bramble_request_duration_seconds_bucket{endpoint="feed",method="GET",le="+Inf"} 2', body)
+        self.assertIn('bramble_request_duration_seconds_count{endpoint="fetch-user-profile",method="GET"} 1', body)
+        # Token lookup, validators and the feed, then the last two once the token is cached
+        self.assertIn('bramble_db_queries_total{endpoint="feed",method="GET"} 5', body)
+        self.assertIn('bramble_profile_cache_misses_total', body)
+
+    def test_metrics_require_staff_or_token(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN='scrape-me'):
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_SERVER_TIMING=True, TOKEN_CACHE_TTL=30)
+    def test_server_timing_header(self):
+        self.client.get(reverse('feed'))
+        response = self.client.get(reverse('feed'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_server_timing_off_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('feed')))
+
+    @override_settings(SLOW_QUERY_MS=0.000001)
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('api.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('feed'))
+        self.assertIn('api_post', '\n'.join(logs.output))
+        self.assertIn('bramble_slow_queries_total', self.metrics())
+
+    @override_settings(METRICS_SERVER_TIMING=True, TOKEN_CACHE_TTL=0)
+    async def test_async_views_are_measured(self):
+        response = await self.async_client.get(
+            reverse('async-feed'), headers={'Authorization': 'Token ' + self.token.key},
+        )
+        # Token lookup, then the feed
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    async def test_middleware_runs_async(self):
+        async def get_response(request):
+            return HttpResponse(b'hello')
+
+        middleware = MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/nowhere/'))
+        self.assertEqual(response.content, b'hello')
+        self.assertIn(
+            'bramble_response_bytes_total{endpoint="unmatched",method="GET"} 5', metrics_registry.render(),
+        )
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_RATES={
+    'post': '2/min', 'post_ip': '3/min', 'like': '5/min', 'signup_ip': '1/hour',
+})
+class ThrottlingTest(APITestCase):
+    def setUp(self):
+        throttle_cache().clear()
+        self.user = User.objects.create(username='spammer')
+        self.app_user = AppUser.objects.create(user=self.user)
+        self.other = User.objects.create(username='neighbour')
+        AppUser.objects.create(user=self.other)
+        self.client.force_authenticate(self.user)
+
+    def post(self):
+        return self.client.post(reverse('post'), {'text': 'Buy now'}, format='json')
+
+    def signup(self, username, **extra):
+        return self.client.post(reverse('signup'), {'user': {
+            'username': username, 'email': f'{username}@example.com', 'password': 'testpassword',
+            'first_name': 'New', 'last_name': 'User',
+        }}, format='json', **extra)
+
+    def test_posts_are_throttled_per_user_then_per_ip(self):
+        self.assertEqual([self.post().status_code for _ in range(2)], [201, 201])
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # Another user has their own bucket, but shares the IP's
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.post().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(reverse('post'), {'text': 'Hi'}, format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_scopes_are_separate(self):
+        post = Post.objects.create(user_id=self.app_user, text='Hello', likes=0)
+        self.post(), self.post()
+        self.assertEqual(self.post().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        like = self.client.patch(reverse('post-detail', kwargs={'post_id': post.id}))
+        self.assertEqual(like.status_code, status.HTTP_200_OK)
+        # No follow rate configured, so follows aren't throttled
+        for _ in range(3):
+            self.client.post(reverse('follow-user', kwargs={'user_id': self.other.appuser.id}))
+            response = self.client.delete(reverse('follow-user', kwargs={'user_id': self.other.appuser.id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_signup_is_throttled_per_ip(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.signup('first').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.signup('second').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.signup('third', REMOTE_ADDR='10.0.0.3').status_code, status.HTTP_201_CREATED)
+
+    def test_spoofed_forwarded_for_is_still_throttled(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.signup('first', HTTP_X_FORWARDED_FOR='1.1.1.1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.signup('second', HTTP_X_FORWARDED_FOR='2.2.2.2').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # Behind one trusted proxy, the address it appended is the client
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            spoofed = self.signup('third', HTTP_X_FORWARDED_FOR='3.3.3.3, 10.0.0.4')
+            self.assertEqual(spoofed.status_code, status.HTTP_201_CREATED)
+            spoofed = self.signup('fourth', HTTP_X_FORWARDED_FOR='4.4.4.4, 10.0.0.4')
+            self.assertEqual(spoofed.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_bench_signup_is_not_throttled(self):
+        out = io.StringIO()
+        call_command('bench_signup', signups=3, iterations=1000, stdout=out)
+        self.assertIn('3 signups at 1000 PBKDF2 iterations', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+
+    def test_buckets_refill(self):
+        buckets = [('user', '2/min'), ('ip', '4/min')]
+        self.assertEqual([take_tokens(buckets, now=100) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(take_tokens(buckets, now=100), 30)
+        # The refused request took nothing from the IP bucket
+        self.assertEqual(take_tokens([('ip', '4/min')], now=100), 0)
+        self.assertEqual(take_tokens(buckets, now=130), 0)
+        with self.assertRaises(ValueError):
+            parse_rate('5/fortnight')
+
+
+class LoadSheddingTest(APITestCase):
+    def setUp(self):
+        metrics_registry.reset()
+        self.user = User.objects.create(username='writer')
+        AppUser.objects.create(user=self.user)
+        self.client.force_authenticate(self.user)
+
+    @override_settings(LOAD_SHED_DB_LATENCY_MS=50)
+    def test_writes_are_shed_while_the_database_is_slow(self):
+        with mock.patch.object(db_latency, 'current', return_value=0.2):
+            response = self.client.post(reverse('post'), {'text': 'Hello'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            # Reads still go through
+            self.assertEqual(self.client.get(reverse('feed')).status_code, status.HTTP_200_OK)
+        self.assertFalse(Post.objects.exists())
+        self.assertIn('bramble_shed_requests_total 1', metrics_registry.render())
+
+        with mock.patch.object(db_latency, 'current', return_value=0.01):
+            response = self.client.post(reverse('post'), {'text': 'Hello'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(LOAD_SHED_DB_LATENCY_MS=50)
+    def test_shed_writes_are_counted_under_their_endpoint(self):
+        with mock.patch.object(db_latency, 'current', return_value=0.2):
+            self.client.post(reverse('post'), {'text': 'Hello'}, format='json')
+        self.assertIn('bramble_request_duration_seconds_count{endpoint="post",method="POST"} 1', metrics_registry.render())
+
+    @override_settings(DEBUG=True)
+    def test_middleware_chain_stays_async_under_asgi(self):
+        # Django logs each sync middleware it has to wrap for an async handler
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    def test_latency_average_decays_when_idle(self):
+        tracker = LatencyTracker(weight=0.5, half_life=0.05)
+        tracker.record(1.0)
+        self.assertGreater(tracker.current(), 0.4)
+        time.sleep(0.25)
+        self.assertLess(tracker.current(), 0.05)
+
+
+@override_settings(TASKS_ALWAYS_EAGER=False, FEED_FANOUT=True, TASKS_RETRY_DELAY=60)
+class JobsTest(APITestCase):
+    def setUp(self):
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        self.reader = AppUser.objects.create(user=User.objects.create(username='reader'))
+        Follows.objects.create(follower=self.reader, followee=self.author)
+        self.client.force_authenticate(self.author.user)
+
+    def test_post_fan_out_is_queued(self):
+        response = self.client.post(reverse('post'), {'text': 'Hello'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Counters are still updated in the request; the timeline write waits for the worker
+        self.assertEqual(AppUser.objects.get(pk=self.author.pk).post_count, 1)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader).exists())
+        job = Job.objects.get()
+        self.assertEqual((job.task, job.status), ('api.tasks.fan_out_post', Job.QUEUED))
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, post__text='Hello').exists())
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_backfill_is_skipped_after_unfollow(self):
+        Post.objects.create(user_id=self.author, text='Old', likes=0)
+        follower = AppUser.objects.create(user=User.objects.create(username='follower'))
+        self.client.force_authenticate(follower.user)
+        self.client.post(reverse('follow-user', kwargs={'user_id': self.author.id}))
+        self.client.delete(reverse('follow-user', kwargs={'user_id': self.author.id}))
+        self.assertEqual(Job.objects.get().task, 'api.tasks.backfill_timeline')
+        jobs.run_pending()
+        self.assertFalse(TimelineEntry.objects.filter(owner=follower).exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_enqueue_many(self):
+        posts = [Post.objects.create(user_id=self.author, text=f'Post {i}', likes=0) for i in range(5)]
+        with self.assertNumQueries(1):
+            queued = tasks.fan_out_post.enqueue_many([{'post_id': post.pk} for post in posts])
+        self.assertEqual(len(queued), 5)
+        self.assertEqual(jobs.run_pending(batch_size=2), 2)
+        self.assertEqual(Job.objects.count(), 3)
+
+    def test_failing_job_is_retried_then_failed(self):
+        calls = []
+
+        @jobs.task(name='tests.flaky', max_attempts=2)
+        def flaky(n):
+            calls.append(n)
+            raise ValueError('boom')
+        self.addCleanup(jobs._tasks.pop, 'tests.flaky')
+
+        job = flaky.enqueue(n=1)
+        started = timezone.now()
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('ValueError: boom', job.last_error)
+        # Backed off, so not due yet
+        self.assertGreaterEqual(job.run_at, started + datetime.timedelta(seconds=60))
+        self.assertEqual(jobs.run_pending(), 0)
+
+        Job.objects.update(run_at=started)
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_unknown_task_fails(self):
+        job = Job.objects.create(task='api.tasks.gone', payload={}, run_at=timezone.now(), max_attempts=1)
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("Unknown task 'api.tasks.gone'", job.last_error)
+
+    def test_idle_poll_only_reads(self):
+        Job.objects.create(
+            task='api.tasks.fan_out_post', payload={'post_id': 0},
+            run_at=timezone.now() + datetime.timedelta(hours=1), max_attempts=5,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('SELECT'))
+
+    def test_stale_running_job_is_reclaimed(self):
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        Job.objects.create(
+            task='api.tasks.fan_out_post', payload={'post_id': 0}, status=Job.RUNNING,
+            run_at=long_ago, locked_at=long_ago, attempts=1, max_attempts=5,
+        )
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertFalse(Job.objects.exists())
+
+
+class ConditionalRequestTest(APITestCase):
+    def setUp(self):
+        self.reader = AppUser.objects.create(user=User.objects.create(username='reader'))
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        self.stranger = AppUser.objects.create(user=User.objects.create(username='stranger'))
+        Follows.objects.create(follower=self.reader, followee=self.author)
+        Post.objects.create(user_id=self.author, text='First', likes=0)
+        self.client.force_authenticate(self.reader.user)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    @override_settings(PROFILE_CACHE_TTL=300)
+    def test_profile_not_modified(self):
+        url = reverse('fetch-user-profile')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):  # The validator is cached with the profile
+            not_modified = self.revalidate(url, response)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+        # Gaining a follower changes the profile
+        Follows.objects.create(follower=self.stranger, followee=self.reader)
+        changed = self.revalidate(url, response)
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertEqual(changed.data['followers_count'], 1)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+        self.reader.user.first_name = 'Renamed'
+        self.reader.user.save()
+        self.assertEqual(self.revalidate(url, changed).status_code, status.HTTP_200_OK)
+
+    def test_feed_not_modified(self):
+        url = reverse('feed')
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Posts by strangers don't touch this feed
+        Post.objects.create(user_id=self.stranger, text='Elsewhere', likes=0)
+        self.assertEqual(self.revalidate(url, response).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        def changes(write):
+            nonlocal response
+            write()
+            changed = self.revalidate(url, response)
+            self.assertEqual(changed.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(changed['ETag'], response['ETag'])
+            response = changed
+
+        post = Post.objects.create(user_id=self.author, text='Second', likes=0)
+        changes(lambda: None)
+        self.assertEqual(len(response.data['results']), 2)
+        changes(post.delete)
+        changes(lambda: Follows.objects.create(follower=self.reader, followee=self.stranger))
+        changes(lambda: Follows.objects.filter(follower=self.reader, followee=self.stranger).delete())
+        self.assertEqual(len(response.data['results']), 1)
+
+    @override_settings(FEED_ETAG_MAX_AGE=60)
+    def test_feed_validators_expire_for_like_counts(self):
+        url = reverse('feed')
+        with mock.patch('api.conditional.time.time', return_value=1_000_000_020.0):
+            response = self.client.get(url)
+            self.assertEqual(self.revalidate(url, response).status_code, status.HTTP_304_NOT_MODIFIED)
+        with mock.patch('api.conditional.time.time', return_value=1_000_000_090.0):
+            self.assertEqual(self.revalidate(url, response).status_code, status.HTTP_200_OK)
+
+    @override_settings(FEED_FANOUT=True, TASKS_ALWAYS_EAGER=False)
+    def test_feed_changes_when_fan_out_runs(self):
+        url = reverse('feed')
+        self.client.force_authenticate(self.author.user)
+        self.client.post(reverse('post'), {'text': 'Fanned out'}, format='json')
+        self.client.force_authenticate(self.reader.user)
+        # Fetched before the fan-out job ran: the post isn't in the timeline yet
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'], [])
+        jobs.run_pending()
+        changed = self.revalidate(url, response)
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertEqual(changed.data['results'][0]['text'], 'Fanned out')
+
+
+class NewFeedTest(APITestCase):
+    def setUp(self):
+        self.reader = AppUser.objects.create(user=User.objects.create(username='reader'))
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        self.stranger = AppUser.objects.create(user=User.objects.create(username='stranger'))
+        Follows.objects.create(follower=self.reader, followee=self.author)
+        Post.objects.create(user_id=self.author, text='Old', likes=0)
+        self.client.force_authenticate(self.reader.user)
+
+    def poll(self, since, **params):
+        response = self.client.get(reverse('feed-new'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_new_posts_since_the_feed_was_read(self):
+        since = self.client.get(reverse('feed')).data['since']
+        self.assertEqual(self.poll(since), {'since': since, 'count': 0, 'more': False, 'results': []})
+
+        for text in ('One', 'Two'):
+            Post.objects.create(user_id=self.author, text=text, likes=0)
+        Post.objects.create(user_id=self.stranger, text='Not followed', likes=0)
+        with self.assertNumQueries(1):
+            data = self.poll(since)
+        self.assertEqual([post['text'] for post in data['results']], ['Two', 'One'])
+        self.assertEqual((data['count'], data['more']), (2, False))
+        self.assertEqual(self.poll(data['since'])['count'], 0)
+
+    def test_catches_up_page_by_page(self):
+        since = self.client.get(reverse('feed')).data['since']
+        for i in range(5):
+            Post.objects.create(user_id=self.author, text=f'Post {i}', likes=0)
+        data = self.poll(since, page_size=2)
+        # The oldest new posts first, so the next poll continues without a gap
+        self.assertEqual([post['text'] for post in data['results']], ['Post 1', 'Post 0'])
+        self.assertTrue(data['more'])
+        texts = []
+        while data['count']:
+            texts += [post['text'] for post in reversed(data['results'])]
+            data = self.poll(data['since'], page_size=2)
+        self.assertEqual(texts, [f'Post {i}' for i in range(5)])
+
+    def test_empty_feed_polls_from_now(self):
+        self.client.force_authenticate(self.stranger.user)
+        since = self.client.get(reverse('feed')).data['since']
+        Follows.objects.create(follower=self.stranger, followee=self.author)
+        Post.objects.create(user_id=self.author, text='New', likes=0)
+        self.assertEqual([post['text'] for post in self.poll(since)['results']], ['New'])
+
+    def test_since_is_required(self):
+        self.assertEqual(self.client.get(reverse('feed-new')).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get(reverse('feed-new'), {'since': 'garbage'}).status_code, status.HTTP_404_NOT_FOUND,
+        )
+        # Only the first feed page carries one
+        first = self.client.get(reverse('feed')).data
+        self.assertNotIn('since', self.client.get(reverse('feed'), {'cursor': first['since']}).data)
+
+    @override_settings(FEED_FANOUT=True, TASKS_ALWAYS_EAGER=False)
+    def test_reads_posts_not_timelines(self):
+        since = self.client.get(reverse('feed')).data['since']
+        Post.objects.create(user_id=self.author, text='Not fanned out yet', likes=0)
+        self.assertEqual(self.poll(since)['count'], 1)
+
+
+@override_settings(PUSH_HEARTBEAT=0.05, PUSH_MAX_AGE=0.5)
+class PushTest(APITestCase):
+    def setUp(self):
+        token_cache().clear()
+        self.reader = AppUser.objects.create(user=User.objects.create(username='reader'))
+        self.author = AppUser.objects.create(user=User.objects.create(username='author'))
+        self.stranger = AppUser.objects.create(user=User.objects.create(username='stranger'))
+        Follows.objects.create(follower=self.reader, followee=self.author)
+        self.tokens = {
+            app_user: Token.objects.create(user=app_user.user).key for app_user in (self.reader, self.stranger)
+        }
+
+    async def connect(self, app_user, **headers):
+        response = await self.async_client.get(
+            reverse('async-feed-push'), headers={'Authorization': 'Token ' + self.tokens[app_user], **headers},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        return stream
+
+    async def events(self, stream):
+        """Every event until the stream ends (after PUSH_MAX_AGE), heartbeats left out."""
+        return [event async for event in stream if event != pubsub.HEARTBEAT_EVENT]
+
+    def post(self, text):
+        self.client.force_authenticate(self.author.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post'), {'text': text}, format='json')
+
+    async def test_posts_are_pushed_to_connected_followers(self):
+        reader, stranger = await self.connect(self.reader), await self.connect(self.stranger)
+        await sync_to_async(self.post)('Pushed')
+        events = await self.events(reader)
+        self.assertEqual(len(events), 1)
+        self.assertIn(b'event: post\ndata: ', events[0])
+        self.assertEqual(json.loads(events[0].split(b'data: ')[1])['text'], 'Pushed')
+        self.assertEqual(await self.events(stranger), [])
+        # Ended streams unsubscribe
+        self.assertFalse(pubsub.get_broker().has_subscribers())
+
+    async def test_reconnect_replays_missed_posts(self):
+        self.client.force_authenticate(self.reader.user)
+        since = (await sync_to_async(self.client.get)(reverse('feed'))).data['since']
+        for text in ('One', 'Two'):
+            await Post.objects.acreate(user_id=self.author, text=text, likes=0)
+        events = await self.events(await self.connect(self.reader, **{'Last-Event-ID': since}))
+        self.assertEqual([json.loads(event.split(b'data: ')[1])['text'] for event in events], ['One', 'Two'])
+        # The event ids are cursors, so the next reconnect starts after them
+        last_id = events[-1].split(b'\n')[0].removeprefix(b'id: ').decode()
+        self.assertEqual(await self.events(await self.connect(self.reader, **{'Last-Event-ID': last_id})), [])
+
+        with override_settings(FEED_MAX_PAGE_SIZE=1):
+            events = await self.events(await self.connect(self.reader, **{'Last-Event-ID': since}))
+        self.assertEqual(events, [pubsub.GAP_EVENT])
+
+    async def test_broker(self):
+        broker = pubsub.LocalBroker()
+        with override_settings(PUSH_QUEUE_SIZE=2):
+            subscription = broker.subscribe('feed:1')
+        # Published from another thread, as the sync views do
+        publish = sync_to_async(broker.publish, thread_sensitive=False)
+        self.assertEqual(await publish(['feed:1', 'feed:2'], 'first'), 1)
+        self.assertEqual(await subscription.get(1), 'first')
+        self.assertIsNone(await subscription.get(0.01))
+        for event in ('a', 'b', 'c'):
+            await publish(['feed:1'], event)
+        await asyncio.sleep(0.01)
+        self.assertTrue(subscription.overflowed)
+        subscription.close()
+        self.assertFalse(broker.has_subscribers())
+
+    def test_publish_costs_nothing_without_streams(self):
+        post = Post.objects.create(user_id=self.author, text='Nobody listening', likes=0)
+        with self.assertNumQueries(0):
+            self.assertEqual(pubsub.publish_post(post, 'author'), 0)
+
+    async def test_publish_reads_only_subscribed_followers(self):
+        fans = await AppUser.objects.abulk_create([
+            AppUser(user=user) for user in await User.objects.abulk_create([User(username=f'fan{i}') for i in range(50)])
+        ])
+        await Follows.objects.abulk_create([Follows(follower=fan, followee=self.author) for fan in fans])
+        post = await Post.objects.acreate(user_id=self.author, text='Few listening', likes=0)
+        broker = pubsub.LocalBroker()
+        subscriptions = [broker.subscribe(pubsub.feed_channel(app_user.id)) for app_user in (self.reader, self.stranger)]
+
+        def publish():
+            with mock.patch('api.pubsub.get_broker', return_value=broker), CaptureQueriesContext(connection) as queries:
+                reached = pubsub.publish_post(post, 'author')
+            return reached, [query['sql'] for query in queries]
+
+        reached, queries = await sync_to_async(publish)()
+        self.assertEqual(reached, 1)
+        # One probe for the two open streams, not a read of all 51 followers
+        self.assertEqual(len(queries), 1)
+        self.assertIn(f'IN ({self.reader.id}, {self.stranger.id})', queries[0].replace("'", ''))
+        for subscription in subscriptions:
+            subscription.close()
+
+    def test_failed_publish_does_not_fail_the_post(self):
+        self.client.force_authenticate(self.author.user)
+        with mock.patch('api.pubsub.publish_post', side_effect=RuntimeError('broker down')), \
+                self.assertLogs('django.test', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post'), {'text': 'Still posted'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Post.objects.filter(text='Still posted').exists())
+
+    def test_push_needs_asgi(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.tokens[self.reader])
+        self.assertEqual(self.client.get(reverse('async-feed-push')).status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+
+class SyntheticGraphTest(APITestCase):
+    def test_power_law_follows(self):
+        edges = list(synthetic.power_law_follows(2000, 10, rng=random.Random(1)))
+        self.assertEqual(len(edges), len(set(edges)))
+        self.assertFalse([edge for edge in edges if edge[0] == edge[1]])
+        followers = sorted(Counter(followee for _, followee in edges).values())
+        # Heavy-tailed: the most followed user has far more followers than the typical one
+        self.assertGreater(followers[-1], 20 * followers[len(followers) // 2])
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_seed_and_remove_graph(self):
+        users = synthetic.seed_graph('synth', 50, mean_following=5, posts_per_user=2, password='secret')
+        self.assertEqual(len(users), 50)
+        self.assertEqual(Post.objects.filter(user_id__user__username__startswith='synth_').count(), 100)
+        app_user = AppUser.objects.get(pk=users[0].app_user_id)
+        self.assertEqual(app_user.following_count, Follows.objects.filter(follower=app_user).count())
+        self.assertEqual(app_user.post_count, 2)
+        self.assertTrue(app_user.user.check_password('secret'))
+        self.assertEqual(Token.objects.get(user=app_user.user).key, users[0].token)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + users[0].token)
+        response = self.client.get(reverse('user-search'), {'q': 'synth_7'})
+        self.assertEqual(response.data['results'][0]['user']['username'], 'synth_7')
+
+        synthetic.remove_graph('synth')
+        self.assertFalse(AppUser.objects.filter(user__username__startswith='synth_').exists())
+
+
+class ImportDataCommandTest(APITestCase):
+    def setUp(self):
+        self.existing = User.objects.create_user(username='existing', password='old-password')
+        AppUser.objects.create(user=self.existing)
+
+    def write(self, suffix, content):
+        f = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False)
+        self.addCleanup(os.unlink, f.name)
+        with f:
+            f.write(content)
+        return f.name
+
+    def test_import_files(self):
+        users = self.write('.csv', (
+            'username,email,password,bio\n'
+            'alice,alice@example.com,alice-password,Gardener\n'
+            'bob,bob@example.com,bob-password,\n'
+            'carol,,,\n'
+            'existing,,new-password,\n'
+        ))
+        follows = self.write('.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'follower': 'alice', 'followee': 'bob'},
+            {'follower': 'alice', 'followee': 'bob'},
+            {'follower': 'carol', 'followee': 'bob'},
+            {'follower': 'bob', 'followee': 'bob'},
+            {'follower': 'existing', 'followee': 'alice'},
+            {'follower': 'alice', 'followee': 'nobody'},
+        ]))
+        posts = self.write('.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'username': 'bob', 'text': 'Imported', 'timestamp': '2020-01-02T03:04:05Z', 'likes': 3},
+            {'username': 'bob', 'text': 'Imported today'},
+            {'username': 'nobody', 'text': 'Orphan'},
+        ]))
+        out = io.StringIO()
+        call_command(
+            'import_data', users=users, follows=follows, posts=posts, workers=2, iterations=1000,
+            batch_size=2, transaction_size=3, stdout=out,
+        )
+        self.assertIn('rows/s', out.getvalue())
+
+        alice, bob, carol = (AppUser.objects.get(user__username=name) for name in ('alice', 'bob', 'carol'))
+        self.assertTrue(alice.user.check_password('alice-password'))
+        self.assertEqual(alice.bio, 'Gardener')
+        self.assertFalse(carol.user.has_usable_password())
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.check_password('old-password'))
+
+        self.assertEqual(Follows.objects.count(), 3)
+        self.assertEqual((bob.followers_count, alice.followers_count, alice.following_count), (2, 1, 1))
+        self.assertEqual(bob.post_count, 2)
+        post = Post.objects.get(text='Imported')
+        self.assertEqual((post.timestamp.year, post.likes), (2020, 3))
+        self.assertEqual(Post.objects.get(text='Imported today').timestamp.date(), timezone.now().date())
+        self.assertTrue(Post._meta.get_field('timestamp').auto_now_add)
+
+        self.client.force_authenticate(self.existing)
+        response = self.client.get(reverse('user-search'), {'q': 'gardener'})
+        self.assertEqual(response.data['results'][0]['user']['username'], 'alice')
+
+    def test_import_synthetic_graph(self):
+        call_command(
+            'import_data', synthetic=40, prefix='imported', following=4, posts_per_user=2, workers=0,
+            batch_size=16, transaction_size=32, stdout=io.StringIO(),
+        )
+        app_users = AppUser.objects.filter(user__username__startswith='imported_')
+        self.assertEqual(app_users.count(), 40)
+        self.assertEqual(Post.objects.filter(user_id__in=app_users).count(), 80)
+        app_user = app_users.order_by('-followers_count').first()
+        self.assertEqual(app_user.followers_count, Follows.objects.filter(followee=app_user).count())
+        self.assertTrue(app_user.user.check_password('password'))
+
+    def test_rejects_mixed_sources(self):
+        with self.assertRaises(CommandError):
+            call_command('import_data', synthetic=10, users='users.csv', stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('import_data', users=self.write('.txt', 'username\n'), stdout=io.StringIO())
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000, METRICS_SERVER_TIMING=True)
+class LoadTestCommandTest(LiveServerTestCase):
+    def test_loadtest_replays_every_flow(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'loadtest', url=self.live_server_url, users=30, following=5, requests=120, concurrency=4,
+                output=output.name, stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+            report = json.load(output)
+        self.assertEqual(report['total']['requests'], 120)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertGreater(report['total']['queries_per_request'], 0)
+        self.assertTrue({'feed', 'like', 'search', 'post', 'login', 'signup'} <= set(report['flows']))
+        self.assertFalse(User.objects.filter(username__startswith='load_').exists())
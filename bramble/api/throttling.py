@@ -0,0 +1,172 @@
+"""
+Token-bucket throttles for the write endpoints.
+
+Each scope (post, like, follow, signup) has two buckets per client: one per
+authenticated user, rated by ``THROTTLE_RATES[scope]``, and one per client IP,
+rated by ``THROTTLE_RATES[scope + '_ip']``. The client IP is DRF's get_ident():
+REMOTE_ADDR, or with ``REST_FRAMEWORK['NUM_PROXIES']`` set, the address the
+outermost trusted proxy put in X-Forwarded-For. A rate of 'N/period' is a bucket of
+N tokens refilled at N per period, so a client can burst N requests and then
+sustain the rate. A missing rate turns that bucket off; THROTTLE_ENABLED off
+turns off all of them.
+
+Buckets live in the ``THROTTLE_CACHE_ALIAS`` cache. Updates are serialized
+within a process; with a cache shared between processes, concurrent updates
+can let a few extra requests through, which is fine for spam control.
+Throttled requests get DRF's 429 with a Retry-After header.
+
+LoadSheddingMiddleware protects the database as a whole: while the moving
+average of query latency on the primary (api.metrics.db_latency) is above
+LOAD_SHED_DB_LATENCY_MS, writes are answered with an immediate 503 instead
+of queueing behind the single SQLite writer. Reads still go through, and
+their queries keep the average current.
+"""
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import db_latency, registry
+
+# As in DRF's rates, only the first letter of the period counts: 10/min, 10/minute and 10/m agree
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """'N/period' -> (capacity, tokens per second). Raises ValueError on garbage."""
+    count, _, period = rate.partition('/')
+    try:
+        count, seconds = int(count), PERIODS[period.strip()[:1]]
+    except KeyError:
+        raise ValueError(f'Unknown period in throttle rate {rate!r}.')
+    if count <= 0:
+        raise ValueError(f'Throttle rate {rate!r} must allow at least one request.')
+    return count, count / seconds
+
+
+def throttle_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'throttle')]
+
+
+def take_tokens(buckets, now=None):
+    """
+    Take a token from each (key, rate) bucket, if every one has a token to
+    give. Returns 0 if they did, else the seconds until they all will; a
+    refused request takes nothing.
+    """
+    now = time.time() if now is None else now
+    cache = throttle_cache()
+    with _lock:
+        levels, wait = {}, 0.0
+        for key, rate in buckets:
+            capacity, refill = parse_rate(rate)
+            tokens, updated = cache.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * refill)
+            levels[key] = (tokens, capacity, refill)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / refill)
+        if not wait:
+            for key, (tokens, capacity, refill) in levels.items():
+                # Once idle this long the bucket is full again, the same as no entry
+                cache.set(key, (tokens - 1, now), timeout=int(capacity / refill) + 1)
+    return wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle the methods in `methods` (all, if None) of a view under `scope`."""
+    scope = None
+    methods = None
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def buckets(self, request):
+        rates = getattr(settings, 'THROTTLE_RATES', {})
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and rates.get(self.scope):
+            yield f'throttle:{self.scope}:user:{user.pk}', rates[self.scope]
+        if rates.get(f'{self.scope}_ip'):
+            yield f'throttle:{self.scope}:ip:{self.get_ident(request)}', rates[f'{self.scope}_ip']
+
+    def allow_request(self, request, view):
+        if not getattr(settings, 'THROTTLE_ENABLED', True):
+            return True
+        if self.methods is not None and request.method not in self.methods:
+            return True
+        self.wait_seconds = take_tokens(list(self.buckets(request)))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class PostThrottle(TokenBucketThrottle):
+    scope = 'post'
+    methods = ('POST',)
+
+
+class LikeThrottle(TokenBucketThrottle):
+    scope = 'like'
+    methods = ('PATCH',)
+
+
+class FollowThrottle(TokenBucketThrottle):
+    scope = 'follow'
+    methods = ('POST', 'DELETE')
+
+
+class SignupThrottle(TokenBucketThrottle):
+    scope = 'signup'
+
+
+@sync_and_async_middleware
+class LoadSheddingMiddleware:
+    """
+    Turn writes away with a 503 while the primary is slow (see the module
+    docstring). The check is in memory, so the async path never leaves the
+    event loop.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.shed(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = self.shed(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    def shed(self, request):
+        """A 503 for request if it is a write and the primary is slow, else None."""
+        threshold = getattr(settings, 'LOAD_SHED_DB_LATENCY_MS', 0)
+        if not threshold or request.method in SAFE_METHODS:
+            return None
+        if db_latency.current() * 1000 < threshold:
+            return None
+        try:
+            # Resolved here, so shed requests are still counted under their endpoint
+            request.resolver_match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            pass
+        registry.record_shed_request()
+        response = JsonResponse({'detail': 'The server is busy; try again shortly.'}, status=503)
+        response['Retry-After'] = str(getattr(settings, 'LOAD_SHED_RETRY_AFTER', 1))
+        return response
@@ -1,14 +1,26 @@
 from django.contrib import admin
 from django.urls import path
 from .views import *
+from . import async_views
 
 urlpatterns = [
     path('profile/', fetch_user_profile,name='fetch-user-profile'),
-    path('post/<int:post_id>/', PostAPIView.as_view()),
+    path('profile/cache-stats/', profile_cache_stats_view, name='profile-cache-stats'),
+    path('post/<int:post_id>/', PostAPIView.as_view(), name='post-detail'),
     path('post/',PostAPIView.as_view(),name='post'),
     path('feed/', FeedAPIView.as_view(),name='feed'),
+    path('feed/new/', NewFeedAPIView.as_view(), name='feed-new'),
     path('follow/<int:user_id>/', FollowAPIView.as_view(), name='follow-user'),
+    path('follow/bulk/', BulkFollowAPIView.as_view(), name='follow-bulk'),
     path('search/users/', UserSearchAPIView.as_view(), name='user-search'),
+    path('search/autocomplete/', UserAutocompleteAPIView.as_view(), name='user-autocomplete'),
     path('signup/', signup,name='signup'),
     path('login/', login,name='login'),
+    path('metrics', metrics_view, name='metrics'),
+
+    # Async-native reads for ASGI deployments
+    path('async/feed/', async_views.feed_view, name='async-feed'),
+    path('async/profile/', async_views.profile_view, name='async-profile'),
+    path('async/search/users/', async_views.user_search_view, name='async-user-search'),
+    path('async/feed/push/', async_views.feed_push_view, name='async-feed-push'),
 ]
\ No newline at end of file
@@ -1,37 +1,54 @@
 from django.shortcuts import render
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny,IsAuthenticated
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import AllowAny,BasePermission,IsAdminUser,IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from .models import AppUser,Post,Follows
-from .serializers import AppUserSerializer,PostSerializer
+from .serializers import AppUserSerializer,PostSerializer,app_user_row_data
+from .pagination import FeedCursorPagination, FeedSincePagination, SearchPagination
+from .search import iter_search_app_users, search_app_users
+from . import autocomplete, streaming
+from .conditional import conditional, feed_validators, profile_validators
+from .profiles import get_profile, stats as profile_cache_stats
+from .signals import follows_added, follows_removed
+from django.conf import settings
+from . import feed, pubsub, tasks
+from .likes import like_post
+from .metrics import registry as metrics_registry, serializing
+from .routers import replica_reads, stick_to_primary
+from .throttling import FollowThrottle, LikeThrottle, PostThrottle, SignupThrottle
 from rest_framework.generics import CreateAPIView
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework.authtoken.models import Token
-from django.db.models import Q
+from django.db import IntegrityError, connection, transaction
 
 # Create your views here.
 @api_view(['GET'])
+@conditional(profile_validators)
 def fetch_user_profile(request):
     if request.method == 'GET':
-        appuser = AppUser.objects.get(user=request.user)
-        serializer = AppUserSerializer(appuser)
-        return Response(serializer.data)
+        with replica_reads(request.user):
+            return Response(get_profile(request.user.appuser.id))
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([SignupThrottle])
 def signup(request):
     if request.method == 'POST':
         serializer = AppUserSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
-            user = AppUser.objects.get(user__username=request.data['user']['username'])
-            token = Token.objects.create(user=user.user)
-            user.user.set_password(request.data['user']['password'])
-            user.user.save()
+            # UserSerializer.create already hashes the password; hashing is the
+            # expensive part of signup, so it must happen exactly once
+            with transaction.atomic():
+                app_user = serializer.save()
+                token = Token.objects.create(user=app_user.user)
+            # The new account may not have reached the replicas yet
+            stick_to_primary(app_user.user.pk)
             return Response({"token": token.key}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -39,38 +56,56 @@ def signup(request):
 @permission_classes([AllowAny])
 def login(request):
     if request.method == 'POST':
-        app_user = get_object_or_404(AppUser, user__username=request.data['username'])
+        app_user = get_object_or_404(AppUser.objects.select_related('user'), user__username=request.data['username'])
         if not app_user.user.check_password(request.data['password']):
             return Response({'error': 'Invalid credentials'}, status=status.HTTP_400_BAD_REQUEST)
         token,created = Token.objects.get_or_create(user=app_user.user)
-        serializer = AppUserSerializer(app_user)
-        return Response({"token": token.key, "user": serializer.data}, status=status.HTTP_200_OK)
+        return Response({"token": token.key, "user": get_profile(app_user.pk, app_user)}, status=status.HTTP_200_OK)
     
 
 class FeedAPIView(APIView):
+    pagination_class = FeedCursorPagination
+
+    @method_decorator(conditional(feed_validators))
     def get(self, request):
-        app_user = AppUser.objects.get(user=request.user)
-        following = Follows.objects.filter(follower=app_user).values_list('followee', flat=True)
-        posts = Post.objects.filter(user_id__in=following).order_by('-timestamp')
-        post_list = [
-            {
-                'user': post.user_id.user.username,
-                'text': post.text,
-                'timestamp': post.timestamp,
-                'likes': post.likes,
-            }
-            for post in posts
-        ]
-        return Response(post_list)
+        app_user = request.user.appuser
+        # Sources are projected straight to dicts so a page costs one query
+        # per source, authors included
+        paginator = self.pagination_class()
+        if streaming.stream_requested(request):
+            rows = paginator.stream_sources(feed.feed_sources(app_user), request, streaming.chunk_size())
+            return streaming.json_response(request, rows)
+        with replica_reads(request.user):
+            page = paginator.paginate_sources(feed.feed_sources(app_user), request, view=self)
+        return paginator.get_paginated_response(page)
     
+class NewFeedAPIView(APIView):
+    pagination_class = FeedSincePagination
+
+    def get(self, request):
+        """Feed posts newer than ?since=, the cursor from the feed's first page or the previous poll."""
+        if not request.query_params.get(self.pagination_class.cursor_query_param):
+            return Response({'message': 'A since cursor is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = self.pagination_class()
+        with replica_reads(request.user):
+            page = paginator.paginate_newer(feed.new_posts_source(request.user.appuser), request)
+        return paginator.get_paginated_response(page)
+
 class PostAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [PostThrottle, LikeThrottle]
     def post(self, request):
-        app_user = AppUser.objects.get(user=request.user)
+        app_user = request.user.appuser
         text = request.data.get('text', '')
         if not text:
             return Response({'error': 'Text field cannot be empty.'}, status=status.HTTP_400_BAD_REQUEST)
-        post = Post.objects.create(user_id=app_user, text=text, likes=0)
+        with transaction.atomic():
+            post = Post.objects.create(user_id=app_user, text=text, likes=0)
+            if feed.fanout_enabled():
+                # Committed with the post, run after the response
+                tasks.fan_out_post.enqueue(post_id=post.id)
+            # Robust: the post is committed by then, so a failed push is only logged
+            transaction.on_commit(lambda: pubsub.publish_post(post, request.user.username), robust=True)
         return Response({
             'message': 'Post created successfully.',
             'post': {
@@ -82,36 +117,43 @@ class PostAPIView(APIView):
         }, status=status.HTTP_201_CREATED)
 
     def delete(self, request, post_id):
-        app_user = AppUser.objects.get(user=request.user)
+        app_user = request.user.appuser
         post = get_object_or_404(Post, id=post_id, user_id=app_user)
-        post.delete()
+        with transaction.atomic():
+            post.delete()
         return Response({'message': 'Post deleted successfully.'}, status=status.HTTP_200_OK)
 
     def patch(self, request, post_id):
-        post = get_object_or_404(Post, id=post_id)
-        post.likes += 1
-        post.save()
+        likes = like_post(post_id)
         return Response({
             'message': 'Post liked successfully.',
-            'likes': post.likes
+            'likes': likes
         }, status=status.HTTP_200_OK)
 
 class FollowAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [FollowThrottle]
     def post(self, request, user_id):
         """Follow a user."""
-        follower = AppUser.objects.get(user=request.user)
+        follower = request.user.appuser
         followee = get_object_or_404(AppUser, id=user_id)
 
         if Follows.objects.filter(follower=follower, followee=followee).exists():
             return Response({'message': 'You are already following this user.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        Follows.objects.create(follower=follower, followee=followee)
+        try:
+            with transaction.atomic():
+                Follows.objects.create(follower=follower, followee=followee)
+                if feed.fanout_enabled():
+                    tasks.backfill_timeline.enqueue(follower_id=follower.id, followee_id=followee.id)
+        except IntegrityError:
+            # A concurrent request created the same follow after the check above
+            return Response({'message': 'You are already following this user.'}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'message': f'You are now following {followee.user.username}'}, status=status.HTTP_201_CREATED)
 
     def delete(self, request, user_id):
         """Unfollow a user."""
-        follower = AppUser.objects.get(user=request.user)
+        follower = request.user.appuser
         followee = get_object_or_404(AppUser, id=user_id)
 
         follow_relationship = Follows.objects.filter(follower=follower, followee=followee)
@@ -119,11 +161,132 @@ class FollowAPIView(APIView):
         if not follow_relationship.exists():
             return Response({'message': 'You are not following this user.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        follow_relationship.delete()
+        with transaction.atomic():
+            follow_relationship.delete()
+            feed.trim_timeline(follower.id, followee.id)
         return Response({'message': f'You have unfollowed {followee.user.username}'}, status=status.HTTP_200_OK)
 
+# How often a bulk follow is retried when it races a concurrent follow
+BULK_FOLLOW_ATTEMPTS = 3
+
+
+class BulkFollowAPIView(APIView):
+    """Follow or unfollow a list of users in one request: {"user_ids": [...]}."""
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [FollowThrottle]
+
+    def get_user_ids(self, request):
+        user_ids = request.data.get('user_ids')
+        max_ids = getattr(settings, 'FOLLOW_BULK_MAX', 100)
+        if (not isinstance(user_ids, list) or not user_ids or len(user_ids) > max_ids
+                or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids)):
+            return None
+        return list(dict.fromkeys(user_ids))  # Drop duplicates, keep order
+
+    def invalid_response(self):
+        max_ids = getattr(settings, 'FOLLOW_BULK_MAX', 100)
+        return Response(
+            {'message': f'user_ids must be a list of 1 to {max_ids} user ids.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    def post(self, request):
+        """Follow every user in user_ids that exists and isn't followed yet."""
+        user_ids = self.get_user_ids(request)
+        if user_ids is None:
+            return self.invalid_response()
+        follower = request.user.appuser
+
+        for attempt in range(BULK_FOLLOW_ATTEMPTS):
+            try:
+                existing, already = self.follow(follower, user_ids)
+                break
+            except IntegrityError:
+                # A concurrent request followed one of them, or deleted a user,
+                # between the checks and the insert; nothing was counted, so check again
+                if attempt == BULK_FOLLOW_ATTEMPTS - 1:
+                    raise
+
+        def result(user_id):
+            if user_id not in existing:
+                return 'not_found'
+            return 'already_following' if user_id in already else 'followed'
+        return Response(
+            {'results': [{'user_id': user_id, 'status': result(user_id)} for user_id in user_ids]},
+            status=status.HTTP_200_OK,
+        )
+
+    def follow(self, follower, user_ids):
+        """
+        Insert the follows that don't exist yet, with their side effects.
+        Returns (existing, already): the user ids that exist, and those of
+        them that were already followed.
+        """
+        with transaction.atomic():
+            # Checked in the transaction that inserts, and the insert keeps the
+            # unique constraint, so the counters only ever see rows it added
+            existing = set(AppUser.objects.filter(id__in=user_ids).values_list('id', flat=True))
+            already = set(
+                Follows.objects.filter(follower=follower, followee_id__in=existing).values_list('followee_id', flat=True)
+            )
+            new_ids = [user_id for user_id in user_ids if user_id in existing and user_id not in already]
+            # bulk_create sends no signals, so the usual follow side effects run once for the batch
+            Follows.objects.bulk_create([Follows(follower=follower, followee_id=user_id) for user_id in new_ids])
+            if new_ids:
+                follows_added(follower.id, new_ids)
+            if feed.fanout_enabled():
+                tasks.backfill_timeline.enqueue_many(
+                    [{'follower_id': follower.id, 'followee_id': user_id} for user_id in new_ids]
+                )
+        return existing, already
+
+    def delete(self, request):
+        """Unfollow every user in user_ids that is currently followed."""
+        user_ids = self.get_user_ids(request)
+        if user_ids is None:
+            return self.invalid_response()
+        follower = request.user.appuser
+
+        existing = set(AppUser.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        follows = Follows.objects.filter(follower=follower, followee_id__in=existing)
+
+        with transaction.atomic():
+            # Locked, so a concurrent unfollow of the same users can't also count them
+            following = list(follows.select_for_update().values_list('followee_id', flat=True))
+            if following:
+                delete_follows(follower.id, following)
+                # delete_follows() sends no signals, so the side effects run once for the batch here
+                follows_removed(follower.id, following)
+                feed.trim_timeline(follower.id, *following)
+
+        def result(user_id):
+            if user_id not in existing:
+                return 'not_found'
+            return 'unfollowed' if user_id in following else 'not_following'
+        return Response(
+            {'results': [{'user_id': user_id, 'status': result(user_id)} for user_id in user_ids]},
+            status=status.HTTP_200_OK,
+        )
+
+def delete_follows(follower_id, followee_ids):
+    """
+    DELETE follower_id's follows of followee_ids in one statement. Unlike
+    QuerySet.delete(), which sends post_delete (and so follows_removed) for
+    each row, this sends no signals: the caller adjusts counters itself.
+    """
+    meta = Follows._meta
+    qn = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(followee_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(meta.db_table)} WHERE {qn(meta.get_field("follower").column)} = %s '
+            f'AND {qn(meta.get_field("followee").column)} IN ({placeholders})',
+            [follower_id, *followee_ids],
+        )
+
 class UserSearchAPIView(APIView):
     permission_classes = [IsAuthenticated]  # Allow only authenticated users to search
+    pagination_class = SearchPagination
 
     def get(self, request):
         # Get the search query parameter from the request
@@ -132,15 +295,64 @@ class UserSearchAPIView(APIView):
         if not query:
             return Response({'message': 'Search query is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Search for users by username, email, or bio (which is in AppUser)
-        users = AppUser.objects.filter(
-            Q(user__username__icontains=query) | 
-            Q(user__email__icontains=query) | 
-            Q(bio__icontains=query)
-        )
+        if streaming.stream_requested(request):
+            users = iter_search_app_users(query, streaming.chunk_size())
+            return streaming.json_response(request, users, lambda chunk: [app_user_row_data(row) for row in chunk])
+
+        # Ranked search over username, email and bio (see api.search)
+        paginator = self.pagination_class()
+        with replica_reads(request.user):
+            users = paginator.paginate_search(
+                lambda limit, offset: search_app_users(query, limit, offset), request, view=self,
+            )
+
+        # Same payload as AppUserSerializer, built straight from the rows
+        with serializing():
+            data = [app_user_row_data(row) for row in users]
 
-        # Serialize the results using the AppUserSerializer
-        serializer = AppUserSerializer(users, many=True)
+        return paginator.get_paginated_response(data)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
 
+class UserAutocompleteAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """Type-ahead: most-followed users whose username starts with ?q=, from memory."""
+        prefix = request.query_params.get('q', '')
+        if not prefix:
+            return Response({'message': 'Search query is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', autocomplete.default_results()))
+        except ValueError:
+            limit = autocomplete.default_results()
+        limit = max(1, min(limit, autocomplete.max_results()))
+        return Response(autocomplete.get_index().complete(prefix, limit), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_cache_stats_view(request):
+    """Hit/miss counters of this process's profile cache, for sizing it."""
+    return Response(profile_cache_stats.snapshot())
+
+
+class MetricsPermission(BasePermission):
+    """Staff users, or the scraper presenting METRICS_TOKEN as a bearer token."""
+    def has_permission(self, request, view):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+@api_view(['GET'])
+@permission_classes([MetricsPermission])
+def metrics_view(request):
+    """This process's request metrics and profile cache counters, in the Prometheus text format."""
+    cache = profile_cache_stats.snapshot()
+    body = metrics_registry.render(extra=[
+        ('bramble_profile_cache_hits_total', 'Profile cache hits.', 'counter', cache['hits']),
+        ('bramble_profile_cache_misses_total', 'Profile cache misses.', 'counter', cache['misses']),
+        ('bramble_profile_cache_invalidations_total', 'Profile cache invalidations.', 'counter', cache['invalidations']),
+    ])
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
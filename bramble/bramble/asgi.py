@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bramble.settings')
 
 application = get_asgi_application()
+
+from api.autocomplete import preload  # noqa: E402  (needs the app registry)
+from api.jobs import start_worker  # noqa: E402
+
+preload()
+start_worker()
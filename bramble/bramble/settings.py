@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -56,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,6 +68,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'api.routers.StickyPrimaryMiddleware',
+    'api.throttling.LoadSheddingMiddleware',
 ]
 
 ROOT_URLCONF = 'bramble.urls'
@@ -89,14 +95,159 @@ WSGI_APPLICATION = 'bramble.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+#
+# BRAMBLE_DB_PROFILE picks one of:
+#   sqlite      the development default: one file, rollback journal, a new
+#               connection per request.
+#   sqlite-wal  SQLite in WAL mode, so readers don't wait for the writer, with
+#               a busy timeout instead of immediate "database is locked"
+#               errors and persistent connections. Single-host deployments.
+#   postgres    PostgreSQL (needs psycopg) with persistent, health-checked
+#               connections, configured by the BRAMBLE_PG_* variables. Set
+#               BRAMBLE_PG_PGBOUNCER when connecting through PgBouncer in
+#               transaction pooling mode.
+# BRAMBLE_CONN_MAX_AGE overrides how long (seconds) a connection is reused.
+
+DB_PROFILE = os.environ.get('BRAMBLE_DB_PROFILE', 'sqlite')
+
+SQLITE_PATH = Path(os.environ.get('BRAMBLE_SQLITE_PATH', BASE_DIR / 'db.sqlite3'))
+
+# PRAGMAs run on every new SQLite connection (see api.signals)
+SQLITE_PRAGMAS = {}
+
+if DB_PROFILE in ('sqlite', 'sqlite-wal'):
+    DATABASES = {
+        'default': {
+            # django.db.backends.sqlite3, starting transactions with BEGIN IMMEDIATE
+            'ENGINE': 'api.backends.sqlite3',
+            'NAME': SQLITE_PATH,
+            # On disk rather than in shared-cache memory, so threaded tests wait on
+            # SQLite's file lock instead of failing with "table is locked"
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+    if DB_PROFILE == 'sqlite-wal':
+        SQLITE_PRAGMAS = {
+            'journal_mode': 'WAL',
+            # Durable at checkpoints rather than every commit; safe in WAL mode
+            'synchronous': 'NORMAL',
+            'busy_timeout': int(os.environ.get('BRAMBLE_SQLITE_BUSY_TIMEOUT', 5000)),
+        }
+        DATABASES['default'].update({
+            'CONN_MAX_AGE': int(os.environ.get('BRAMBLE_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+        })
+elif DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('BRAMBLE_PG_NAME', 'bramble'),
+            'USER': os.environ.get('BRAMBLE_PG_USER', 'bramble'),
+            'PASSWORD': os.environ.get('BRAMBLE_PG_PASSWORD', ''),
+            'HOST': os.environ.get('BRAMBLE_PG_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('BRAMBLE_PG_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('BRAMBLE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            # PgBouncer's transaction pooling can't hold server-side cursors open
+            'DISABLE_SERVER_SIDE_CURSORS': bool(os.environ.get('BRAMBLE_PG_PGBOUNCER')),
+            'OPTIONS': {'connect_timeout': 5},
+        }
+    }
+else:
+    raise ImproperlyConfigured(
+        f"Unknown BRAMBLE_DB_PROFILE {DB_PROFILE!r}; expected 'sqlite', 'sqlite-wal' or 'postgres'."
+    )
+
+# Read replicas
+# The feed, profile and search endpoints read from a replica when any are
+# configured (see api.routers); everything else, and every write, uses the
+# primary. A user who just wrote reads from the primary for
+# REPLICA_STICKY_SECONDS, which should exceed the usual replication lag.
+#
+# BRAMBLE_PG_REPLICA_HOSTS (comma-separated) adds PostgreSQL replicas that
+# share the primary's credentials. For local testing with SQLite,
+# BRAMBLE_SQLITE_REPLICA_PATH adds a second file as the replica; refresh it
+# from the primary with `manage.py sync_replica`.
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+DATABASE_REPLICAS = []
+
+if DB_PROFILE == 'postgres':
+    for i, host in enumerate(filter(None, os.environ.get('BRAMBLE_PG_REPLICA_HOSTS', '').split(','))):
+        DATABASE_REPLICAS.append(f'replica{i + 1}')
+        DATABASES[f'replica{i + 1}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+elif os.environ.get('BRAMBLE_SQLITE_REPLICA_PATH'):
+    DATABASE_REPLICAS.append('replica')
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': Path(os.environ['BRAMBLE_SQLITE_REPLICA_PATH']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+REPLICA_STICKY_SECONDS = int(os.environ.get('BRAMBLE_REPLICA_STICKY_SECONDS', 5))
+
+# Must be shared between processes (BRAMBLE_REDIS_URL) for the window to hold
+# across workers; `manage.py check` fails if it isn't while replicas are on.
+REPLICA_STICKY_CACHE_ALIAS = 'sticky'
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# Serialized profiles and throttle buckets get their own bounded caches. Local
+# memory evicts least recently used entries past MAX_ENTRIES; set
+# BRAMBLE_REDIS_URL (e.g. redis://127.0.0.1:6379/1) to share them between
+# processes through Redis, run with a maxmemory-policy of allkeys-lru for the
+# same bound.
+
+PROFILE_CACHE_ALIAS = 'profiles'
+
+# Seconds a serialized profile (and its HTTP validator) stays cached; 0 reads
+# every profile from the database. Writes drop the entry from the cache the
+# writing process uses only, so caching is on by default only when
+# BRAMBLE_REDIS_URL shares that cache between workers; otherwise other workers
+# would serve stale profiles, and wrong 304s, for up to the TTL.
+PROFILE_CACHE_TTL = int(os.environ.get('BRAMBLE_PROFILE_CACHE_TTL', 300 if os.environ.get('BRAMBLE_REDIS_URL') else 0))
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'profiles': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'profiles',
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('BRAMBLE_PROFILE_CACHE_SIZE', 10000))},
+    },
+    # Resolved API tokens of api.authentication
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Read-your-writes markers of api.routers
+    'sticky': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sticky',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Token buckets of api.throttling
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
 
+if os.environ.get('BRAMBLE_REDIS_URL'):
+    for alias in ('profiles', 'tokens', 'sticky', 'throttle'):
+        CACHES[alias].update({
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['BRAMBLE_REDIS_URL'],
+            'KEY_PREFIX': 'bramble',
+            'OPTIONS': {},
+        })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -116,16 +267,46 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# PBKDF2 is deliberately slow and dominates signup and login CPU. Tune its cost
+# per deployment with BRAMBLE_PBKDF2_ITERATIONS (Django 4.2 default: 600000).
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('BRAMBLE_PBKDF2_ITERATIONS', 600000))
+
+PASSWORD_HASHERS = [
+    'api.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [ # new
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.AppUserTokenAuthentication',
     ],
+    # Reverse proxies in front of the app. Throttles key clients on the address
+    # the last of them saw (X-Forwarded-For); with 0 they use REMOTE_ADDR and
+    # ignore the header, which clients can set to anything.
+    'NUM_PROXIES': int(os.environ.get('BRAMBLE_NUM_PROXIES', 0)),
 }
 
+# Seconds a resolved API token (with its User and AppUser) stays cached in the
+# TOKEN_CACHE_ALIAS cache; 0 looks every token up in the database. Revoking a
+# token or deactivating its user only drops the entry from the cache that
+# process uses, so caching is on by default only when BRAMBLE_REDIS_URL shares
+# that cache between workers; otherwise other workers would keep accepting the
+# token for up to the TTL.
+TOKEN_CACHE_ALIAS = 'tokens'
+
+TOKEN_CACHE_TTL = int(os.environ.get('BRAMBLE_TOKEN_CACHE_TTL', 30 if os.environ.get('BRAMBLE_REDIS_URL') else 0))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -148,3 +329,168 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Feed
+# Page size for the cursor-paginated feed; clients may ask for up to
+# FEED_MAX_PAGE_SIZE with ?page_size=.
+
+FEED_PAGE_SIZE = 20
+
+FEED_MAX_PAGE_SIZE = 100
+
+# Fan-out on write: push new posts into per-follower timelines instead of
+# pulling every followee's posts on each feed read. Authors with more than
+# FEED_FANOUT_MAX_FOLLOWERS followers are still pulled on read. Run
+# `manage.py rebuild_timelines` after switching this on for existing data.
+
+FEED_FANOUT = False
+
+FEED_FANOUT_MAX_FOLLOWERS = 5000
+
+# How many of a followee's recent posts are copied into a timeline on follow
+FEED_FANOUT_BACKFILL = 100
+
+# A feed's ETag and Last-Modified also change every FEED_ETAG_MAX_AGE seconds,
+# so a client revalidating with 304s sees like counts (which don't change the
+# validators) at most this old
+FEED_ETAG_MAX_AGE = 60
+
+# Most user ids accepted by one /follow/bulk/ request
+FOLLOW_BULK_MAX = 100
+
+# Likes
+# LIKES_BUFFERED collects likes in memory and writes them in batches of
+# LIKES_FLUSH_BATCH, and at least every LIKES_FLUSH_INTERVAL seconds from a
+# background thread, so a viral post doesn't serialize every liker on its row
+# lock. Off means one atomic UPDATE per like.
+
+LIKES_BUFFERED = False
+
+LIKES_FLUSH_BATCH = 100
+
+LIKES_FLUSH_INTERVAL = 1.0
+
+# User search
+# Results per page for /search/users/; clients may ask for up to
+# SEARCH_MAX_PAGE_SIZE with ?limit=.
+
+SEARCH_PAGE_SIZE = 20
+
+SEARCH_MAX_PAGE_SIZE = 50
+
+# Streaming exports
+# ?stream=1 on the feed and user search returns every result in one streamed
+# response, read and encoded this many rows at a time.
+
+STREAM_CHUNK_SIZE = 500
+
+# Username autocomplete
+# An in-process prefix index, built when the WSGI/ASGI application starts
+# unless AUTOCOMPLETE_PRELOAD is off (then on the first request). Every
+# AUTOCOMPLETE_REFRESH_INTERVAL seconds it is reloaded if users changed in
+# another process or through bulk inserts; 0 turns that off.
+
+AUTOCOMPLETE_PRELOAD = True
+
+AUTOCOMPLETE_REFRESH_INTERVAL = int(os.environ.get('BRAMBLE_AUTOCOMPLETE_REFRESH_INTERVAL', 60))
+
+AUTOCOMPLETE_RESULTS = 10
+
+AUTOCOMPLETE_MAX_RESULTS = 20
+
+# Metrics
+# Per-endpoint latency, query and serialization metrics (see api.metrics),
+# served in the Prometheus text format at /metrics to staff users, or to
+# scrapers sending "Authorization: Bearer $BRAMBLE_METRICS_TOKEN".
+# BRAMBLE_SERVER_TIMING=1 adds a Server-Timing header to every response.
+
+METRICS_TOKEN = os.environ.get('BRAMBLE_METRICS_TOKEN')
+
+METRICS_SERVER_TIMING = bool(os.environ.get('BRAMBLE_SERVER_TIMING'))
+
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statements at least this slow (milliseconds) are logged to api.slow_queries;
+# 0 turns the log off.
+SLOW_QUERY_MS = float(os.environ.get('BRAMBLE_SLOW_QUERY_MS', 200))
+
+# Background jobs
+# Side effects that can trail a write (timeline fan-out and backfill) are
+# queued as api.jobs Job rows and run by a worker thread pool. Every web
+# process starts one while FEED_FANOUT is on, the only source of jobs, unless
+# BRAMBLE_TASKS_WORKER=0; `manage.py run_tasks` runs a single standalone one
+# instead (or drains jobs left over from turning fan-out off, with --burst).
+# BRAMBLE_TASKS_EAGER=1 runs jobs inline instead.
+
+TASKS_ALWAYS_EAGER = os.environ.get('BRAMBLE_TASKS_EAGER') == '1'
+
+TASKS_WORKER = os.environ.get('BRAMBLE_TASKS_WORKER', '1' if FEED_FANOUT else '0') != '0'
+
+TASKS_THREADS = int(os.environ.get('BRAMBLE_TASKS_THREADS', 4))
+
+# Jobs claimed per round, and seconds between polls when the queue is empty
+TASKS_BATCH_SIZE = 50
+
+TASKS_POLL_INTERVAL = 1.0
+
+# Attempts per job; retries wait TASKS_RETRY_DELAY seconds, doubling each time
+TASKS_MAX_ATTEMPTS = 5
+
+TASKS_RETRY_DELAY = 2.0
+
+# Seconds after which a job claimed by a worker that died is claimed again
+TASKS_LOCK_TIMEOUT = 300
+
+# Push
+# Under ASGI, /async/feed/push/ streams new feed posts as Server-Sent Events
+# (see api.pubsub). PUSH_BROKER delivers them; the default reaches the
+# streams of this process only.
+
+PUSH_BROKER = 'api.pubsub.LocalBroker'
+
+# Events a stream may fall behind by before it is told to refetch the feed
+PUSH_QUEUE_SIZE = 100
+
+# Seconds between keep-alive comments on an idle stream, and before a stream
+# ends and its client reconnects
+PUSH_HEARTBEAT = 15
+
+PUSH_MAX_AGE = 300
+
+# Throttling and load shedding
+# Token-bucket rates ('N/period': bursts of N, refilled at N per period) per
+# user for each write scope, and per client IP under '<scope>_ip'; see
+# api.throttling. BRAMBLE_THROTTLE=0 turns throttling off, e.g. for load tests.
+
+THROTTLE_ENABLED = os.environ.get('BRAMBLE_THROTTLE', '1') != '0'
+
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+THROTTLE_RATES = {
+    'post': '30/min',
+    'post_ip': '300/min',
+    'like': '120/min',
+    'like_ip': '1200/min',
+    'follow': '60/min',
+    'follow_ip': '600/min',
+    'signup_ip': '20/hour',
+}
+
+# Writes get an immediate 503 while the moving average of query latency on the
+# primary is above this many milliseconds; 0 turns load shedding off.
+LOAD_SHED_DB_LATENCY_MS = float(os.environ.get('BRAMBLE_LOAD_SHED_MS', 0))
+
+# Retry-After (seconds) sent with shed requests
+LOAD_SHED_RETRY_AFTER = 1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.slow_queries': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.test.runner import DiscoverRunner
 from colorama import init, Fore, Style
 import unittest
@@ -23,6 +24,19 @@ class ColoredTextTestRunner(DiscoverRunner):
         """Override to provide custom result class."""
         return ColoredTextTestResult
 
+    def setup_test_environment(self, **kwargs):
+        """
+        Read from the (mirrored) primary, don't throttle (every test client
+        shares one IP), run background jobs inline and don't refresh the
+        username index in the background. Routing, throttling and job tests
+        opt in with override_settings; index tests call refresh_index().
+        """
+        super().setup_test_environment(**kwargs)
+        settings.DATABASE_REPLICAS = []
+        settings.THROTTLE_ENABLED = False
+        settings.TASKS_ALWAYS_EAGER = True
+        settings.AUTOCOMPLETE_REFRESH_INTERVAL = 0
+
     def run_suite(self, suite, **kwargs):
         """Override run_suite to pass the custom result class."""
         runner = unittest.TextTestRunner(resultclass=self.get_resultclass())
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bramble.settings')
 
 application = get_wsgi_application()
+
+from api.autocomplete import preload  # noqa: E402  (needs the app registry)
+from api.jobs import start_worker  # noqa: E402
+
+preload()
+start_worker()